@@ -2,6 +2,7 @@
 #
 #
 
+from .flatten import SpfFlatteningProcessor
 from .processor import SpfDnsLookupProcessor
 from .source import SpfSource
 
@@ -10,4 +11,5 @@ __version__ = __VERSION__ = '1.0.0'
 
 # Quell warnings
 SpfDnsLookupProcessor
+SpfFlatteningProcessor
 SpfSource
@@ -0,0 +1,194 @@
+#
+#
+#
+
+from collections import OrderedDict
+from copy import copy
+from json import dumps, loads
+from logging import getLogger
+from sqlite3 import connect
+from threading import Lock
+from time import time
+
+
+class SpfResolutionCache(object):
+    '''
+    Bounded, TTL aware, LRU cache of resolved values keyed by `(kind, name)`,
+    e.g. `('TXT', '_spf.google.com')`. `get` returns a `(value, expires)`
+    tuple, or `None` on a miss.
+
+    Entries expire once the TTL of the answer they were built from has elapsed
+    and the least recently used entries are evicted once `max_size` is
+    reached. Callers willing to accept stale entries can pass a `grace`, in
+    seconds, to `get` to have those that expired within it returned. A single
+    process-wide instance is available via `shared` so that every processor in
+    a run benefits from the others' lookups.
+    '''
+
+    DEFAULT_MAX_SIZE = 4096
+
+    log = getLogger('SpfResolutionCache')
+
+    _shared = None
+    _shared_lock = Lock()
+
+    @classmethod
+    def shared(cls, max_size=DEFAULT_MAX_SIZE):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(max_size)
+            elif max_size > cls._shared.max_size:
+                # the largest requested size wins
+                cls._shared.max_size = max_size
+            return cls._shared
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.log.debug('__init__: max_size=%d', max_size)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, name, grace=0):
+        key = (kind, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                now = time()
+                if expires + grace > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, expires
+                if not grace:
+                    del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, kind, name, value, ttl):
+        if ttl <= 0:
+            # nothing to remember
+            return
+        key = (kind, name)
+        with self._lock:
+            self._entries[key] = (value, time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class SpfSqliteCache(object):
+    '''
+    Persistent cache with the same interface as `SpfResolutionCache` backed by
+    a SQLite database in WAL mode so that it can be shared between runs and by
+    multiple concurrent octoDNS processes.
+
+    Entries expire after their TTL, but never more than `max_stale` seconds
+    after they were written. Expired rows are ignored, unless they're within
+    the `grace` passed to `get`, and overwritten as new answers come in.
+    '''
+
+    DEFAULT_MAX_STALE = 86400
+    # How long to wait on another process's write lock, in seconds
+    BUSY_TIMEOUT = 30
+
+    log = getLogger('SpfSqliteCache')
+
+    _shared = {}
+    _shared_lock = Lock()
+
+    @classmethod
+    def shared(cls, path, max_stale=DEFAULT_MAX_STALE):
+        '''
+        Returns the process-wide cache for `path`. Callers with different
+        `max_stale`s share its connection, each capping what it writes at its
+        own.
+        '''
+        with cls._shared_lock:
+            key = (path, max_stale)
+            cache = cls._shared.get(key)
+            if cache is None:
+                other = next(
+                    (c for (p, _), c in cls._shared.items() if p == path), None
+                )
+                if other is None:
+                    cache = cls(path, max_stale)
+                else:
+                    cache = copy(other)
+                    cache.max_stale = max_stale
+                    cache.hits = 0
+                    cache.misses = 0
+                cls._shared[key] = cache
+            return cache
+
+    def __init__(self, path, max_stale=DEFAULT_MAX_STALE):
+        self.log.debug('__init__: path=%s, max_stale=%d', path, max_stale)
+        self.path = path
+        self.max_stale = max_stale
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        # autocommit, every statement is its own transaction
+        self._conn = connect(
+            path,
+            timeout=self.BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries (kind TEXT NOT NULL, '
+            'name TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, '
+            'PRIMARY KEY (kind, name))'
+        )
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute(
+                'SELECT COUNT(*) FROM entries'
+            ).fetchone()
+            return count
+
+    def get(self, kind, name, grace=0):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires FROM entries WHERE kind = ? AND '
+                'name = ? AND expires > ?',
+                (kind, name, time() - grace),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return loads(row[0]), row[1]
+
+    def set(self, kind, name, value, ttl):
+        ttl = min(ttl, self.max_stale)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (kind, name, value, expires) '
+                'VALUES (?, ?, ?, ?)',
+                (kind, name, dumps(value), time() + ttl),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
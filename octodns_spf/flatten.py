@@ -0,0 +1,404 @@
+#
+#
+#
+
+from collections import namedtuple
+from itertools import combinations
+from logging import getLogger
+from typing import List, Optional, Tuple
+
+from dns.exception import DNSException
+from dns.resolver import NoAnswer
+
+from octodns.record import Record
+
+from .policy import parse_spf
+from .processor import (
+    SpfDnsLookupException,
+    SpfDnsLookupProcessor,
+    SpfValueException,
+)
+from .source import (
+    SpfException,
+    _build_spf,
+    _layout_spf,
+    _merge_and_dedup_preserving_order,
+    _parse_spf,
+)
+
+# A mechanism that can be flattened, along with the addresses it'd be replaced
+# with and the number of lookups that would save
+_Candidate = namedtuple(
+    '_Candidate', ('kind', 'target', 'ip4', 'ip6', 'lookups')
+)
+
+
+def _resolvable(target):
+    # a & mx of the current domain, or with cidr lengths, can't be replaced
+    # with the addresses their name resolves to
+    return bool(target) and '/' not in target
+
+
+class SpfFlatteningProcessor(SpfDnsLookupProcessor):
+    '''
+    Rewrites SPF values in TXT records, replacing `include:` mechanisms with
+    the `ip4:` and `ip6:` addresses they resolve to so that receivers don't
+    have to spend DNS lookups on them. Optionally `a:` and `mx:` mechanisms
+    are resolved to addresses as well.
+
+    Includes whose values can't be represented with addresses alone, e.g.
+    those using `exists:`, macros, `redirect=`, or passing on `all`, are left
+    as-is, as are any that fail to resolve.
+
+    When `selective` is enabled only as much as is required to bring values
+    within `lookup_budget` is flattened, choosing the mechanisms that result in
+    the smallest values. An exhaustive search is used when there are few
+    enough candidates, falling back to a greedy choice of the most lookups
+    saved per byte added otherwise.
+
+    When `aggregate_addresses` is enabled the resulting addresses are collapsed
+    into the fewest equivalent networks.
+
+    When `max_length` is set values longer than it are split, moving addresses
+    into generated `_spfN` records that the value includes. The lookups those
+    includes cost count against `lookup_budget`.
+
+    Resolution, caching, etc. is configured with the same options as
+    SpfDnsLookupProcessor.
+    '''
+
+    # Up to 2^12 combinations of candidates are tried, beyond that greedy
+    EXACT_MAX_CANDIDATES = 12
+
+    log = getLogger('SpfFlatteningProcessor')
+
+    def __init__(
+        self,
+        id,
+        flatten_a_mx=False,
+        verify_dns_lookups=False,
+        selective=False,
+        lookup_budget=10,
+        aggregate_addresses=False,
+        max_length=None,
+        **kwargs,
+    ):
+        self.log.debug(
+            f'__init__: id={id}, flatten_a_mx={flatten_a_mx}, verify_dns_lookups={verify_dns_lookups}, selective={selective}, lookup_budget={lookup_budget}, aggregate_addresses={aggregate_addresses}, max_length={max_length}'
+        )
+        super().__init__(id, **kwargs)
+        self.flatten_a_mx = flatten_a_mx
+        self.verify_dns_lookups = verify_dns_lookups
+        self.selective = selective
+        self.lookup_budget = lookup_budget
+        self.aggregate_addresses = aggregate_addresses
+        self.max_length = max_length
+
+    def _optional(self, domain: str, rdtype: str) -> List[str]:
+        try:
+            return self._resolve(domain, rdtype)[0]
+        except NoAnswer:
+            return []
+
+    def _addresses(self, domain: str) -> Tuple[List[str], List[str]]:
+        return self._optional(domain, 'A'), self._optional(domain, 'AAAA')
+
+    def _mx_addresses(self, domain: str) -> Tuple[List[str], List[str]]:
+        ip4 = []
+        ip6 = []
+        for mx in self._optional(domain, 'MX'):
+            # preference exchange
+            host = mx.split()[-1]
+            host_ip4, host_ip6 = self._addresses(host)
+            ip4.extend(host_ip4)
+            ip6.extend(host_ip6)
+        return ip4, ip6
+
+    def _parse(self, value: str) -> Optional[Tuple]:
+        policy = parse_spf(value)
+        # Things that can't be represented as a list of addresses, e.g. ptr,
+        # redirect=, passing on all, and macros
+        if (
+            policy.unrecognized is not None
+            or policy.unsupported
+            or policy.modifiers
+            or '%' in value
+        ):
+            return None
+        return _parse_spf(value)
+
+    def _flatten_include(
+        self, domain: str, path: Tuple[str, ...] = ()
+    ) -> Optional[Tuple[List[str], List[str], int]]:
+        '''
+        Returns the ip4 and ip6 addresses `domain`'s SPF value passes, along
+        with the lookups including it costs, or None if it can't be flattened.
+        '''
+        if domain in path:
+            self.log.warning(
+                f'_flatten_include: include loop {" -> ".join(path + (domain,))}'
+            )
+            return None
+        if len(path) >= self.max_depth:
+            self.log.warning(
+                f'_flatten_include: {domain} exceeds the maximum include depth of {self.max_depth}'
+            )
+            return None
+
+        try:
+            values = self._resolve(domain, 'TXT')[0]
+        except DNSException as e:
+            self.log.warning(f'_flatten_include: {domain} failed, {e}')
+            return None
+
+        spf = [v for v in values if v.startswith('v=spf1 ')]
+        if len(spf) != 1:
+            return None
+
+        parsed = self._parse(spf[0])
+        if parsed is None:
+            return None
+        a_records, mx_records, ip4, ip6, includes, exists, _ = parsed
+        if exists:
+            return None
+        # the include's a & mx would have to be flattened along with it
+        if (a_records or mx_records) and not self.flatten_a_mx:
+            return None
+        if not all(_resolvable(v) for v in a_records + mx_records):
+            return None
+
+        ip4 = list(ip4)
+        ip6 = list(ip6)
+        try:
+            for a_record in a_records:
+                a_ip4, a_ip6 = self._addresses(a_record)
+                ip4.extend(a_ip4)
+                ip6.extend(a_ip6)
+            for mx_record in mx_records:
+                mx_ip4, mx_ip6 = self._mx_addresses(mx_record)
+                ip4.extend(mx_ip4)
+                ip6.extend(mx_ip6)
+        except DNSException as e:
+            self.log.warning(f'_flatten_include: {domain} failed, {e}')
+            return None
+
+        # the include itself and any a & mx
+        lookups = 1 + len(a_records) + len(mx_records)
+        path = path + (domain,)
+        for include in includes:
+            nested = self._flatten_include(include, path)
+            if nested is None:
+                return None
+            ip4.extend(nested[0])
+            ip6.extend(nested[1])
+            lookups += nested[2]
+
+        return ip4, ip6, lookups
+
+    def _include_lookups(self, domain: str) -> int:
+        try:
+            return self.check_dns_lookups(domain, [f'v=spf1 include:{domain}'])
+        except (DNSException, SpfDnsLookupException, SpfValueException) as e:
+            # flattening can't help with this one, it'll blow any budget
+            self.log.warning(f'_include_lookups: {domain} failed, {e}')
+            return self.lookup_budget + 1
+
+    def _candidates(self, parsed: Tuple) -> Tuple[List[_Candidate], int]:
+        '''
+        Returns the mechanisms in `parsed` that could be flattened and the
+        number of lookups required by those that can't.
+        '''
+        a_records, mx_records, _, _, includes, exists, _ = parsed
+
+        candidates = []
+        fixed_lookups = len(exists)
+        for include in includes:
+            flattened = self._flatten_include(include)
+            if flattened is None:
+                if self.selective:
+                    fixed_lookups += self._include_lookups(include)
+                continue
+            candidates.append(_Candidate('include', include, *flattened))
+
+        for kind, records, resolve in (
+            ('a', a_records, self._addresses),
+            ('mx', mx_records, self._mx_addresses),
+        ):
+            for record in records:
+                if not self.flatten_a_mx or not _resolvable(record):
+                    fixed_lookups += 1
+                    continue
+                try:
+                    ip4, ip6 = resolve(record)
+                except DNSException as e:
+                    self.log.warning(f'_candidates: {record} failed, {e}')
+                    fixed_lookups += 1
+                    continue
+                candidates.append(_Candidate(kind, record, ip4, ip6, 1))
+
+        return candidates, fixed_lookups
+
+    def _build(self, parsed: Tuple, chosen: List[_Candidate]) -> str:
+        a_records, mx_records, ip4, ip6, includes, exists, soft_fail = parsed
+
+        flattened = set((c.kind, c.target) for c in chosen)
+        ip4 = list(ip4)
+        ip6 = list(ip6)
+        for candidate in chosen:
+            ip4.extend(candidate.ip4)
+            ip6.extend(candidate.ip6)
+
+        return _build_spf(
+            [a for a in a_records if ('a', a) not in flattened],
+            [mx for mx in mx_records if ('mx', mx) not in flattened],
+            _merge_and_dedup_preserving_order(ip4, []),
+            _merge_and_dedup_preserving_order(ip6, []),
+            [i for i in includes if ('include', i) not in flattened],
+            exists,
+            soft_fail,
+            aggregate_addresses=self.aggregate_addresses,
+        )
+
+    def _added_bytes(self, candidate: _Candidate) -> int:
+        added = sum(len(f' ip4:{ip}') for ip in candidate.ip4) + sum(
+            len(f' ip6:{ip}') for ip in candidate.ip6
+        )
+        return added - len(f' {candidate.kind}:{candidate.target}')
+
+    def _select(
+        self, parsed: Tuple, candidates: List[_Candidate], fixed_lookups: int
+    ) -> List[_Candidate]:
+        total = fixed_lookups + sum(c.lookups for c in candidates)
+        needed = total - self.lookup_budget
+        if needed <= 0:
+            return []
+        if fixed_lookups > self.lookup_budget:
+            self.log.warning(
+                f'_select: flattening everything possible still needs {fixed_lookups} lookups, more than the budget of {self.lookup_budget}'
+            )
+            return candidates
+
+        if len(candidates) <= self.EXACT_MAX_CANDIDATES:
+            # try every combination that saves enough preferring, in order,
+            # fewer TXT strings, fewer bytes, and fewer things flattened
+            best = None
+            for n in range(1, len(candidates) + 1):
+                for chosen in combinations(candidates, n):
+                    if sum(c.lookups for c in chosen) < needed:
+                        continue
+                    size = len(self._build(parsed, chosen))
+                    key = ((size + 254) // 255, size, n)
+                    if best is None or key < best[0]:
+                        best = (key, list(chosen))
+            return best[1]
+
+        # the most lookups saved per byte added first
+        chosen = []
+        saved = 0
+        for candidate in sorted(
+            candidates, key=lambda c: self._added_bytes(c) / c.lookups
+        ):
+            if saved >= needed:
+                break
+            chosen.append(candidate)
+            saved += candidate.lookups
+        return chosen
+
+    def flatten(self, value: str, reserved_lookups: int = 0) -> str:
+        '''
+        Returns `value` with its includes, and optionally a & mx mechanisms,
+        replaced with the addresses they resolve to. When selective only what's
+        required to fit within the lookup budget, less `reserved_lookups`, is
+        flattened.
+        '''
+        parsed = self._parse(value)
+        if parsed is None:
+            self.log.warning(f'flatten: unable to flatten "{value}"')
+            return value
+
+        candidates, fixed_lookups = self._candidates(parsed)
+        try:
+            if not self.selective:
+                return self._build(parsed, candidates)
+
+            chosen = self._select(
+                parsed, candidates, fixed_lookups + reserved_lookups
+            )
+            flattened = self._build(parsed, chosen)
+        except SpfException as e:
+            # addresses that can't be aggregated
+            self.log.warning(f'flatten: unable to flatten "{value}", {e}')
+            return value
+        if chosen:
+            targets = ', '.join(f'{c.kind}:{c.target}' for c in chosen)
+            self.log.info(
+                f'flatten: chose {targets}, saving {sum(c.lookups for c in chosen)} lookups, {len(value)} -> {len(flattened)} bytes'
+            )
+        return flattened
+
+    def _flatten_and_layout(
+        self, fqdn: str, spf: str
+    ) -> Tuple[str, List[Tuple[str, str]]]:
+        '''
+        Flattens `spf` and, when needed, splits it into values no longer than
+        `max_length`. When selective the includes of the generated values are
+        reserved from the budget, flattening further as required.
+        '''
+        reserved = 0
+        while True:
+            flattened = self.flatten(spf, reserved)
+            if self.max_length is None:
+                return flattened, []
+            try:
+                laid_out, generated = _layout_spf(
+                    flattened, fqdn[:-1], self.max_length
+                )
+            except SpfException as e:
+                if not self.selective or reserved > self.lookup_budget:
+                    raise SpfValueException(f'{fqdn}: {e}')
+                # flattening more may make room
+                reserved += 1
+                continue
+            if not self.selective or len(generated) <= reserved:
+                return laid_out, generated
+            reserved = len(generated)
+
+    def process_source_zone(self, zone, *args, **kwargs):
+        existing = {r.name for r in zone.records if r._type == 'TXT'}
+        for record in sorted(zone.records):
+            if record._type != 'TXT' or record.octodns.get('lenient'):
+                continue
+
+            spf = self._get_spf_from_txt_values(record.fqdn, record.values)
+            if spf is None:
+                continue
+
+            flattened, generated = self._flatten_and_layout(record.fqdn, spf)
+            if flattened == spf:
+                continue
+
+            # the generated values are answered from the zone when verifying
+            for label, value in generated:
+                name = f'{label}.{record.name}' if record.name else label
+                generated_record = Record.new(
+                    zone,
+                    name,
+                    {'ttl': record.ttl, 'type': 'TXT', 'value': value},
+                )
+                if name in existing:
+                    raise SpfValueException(
+                        f'{generated_record.fqdn} already has a TXT record, it can\'t hold a generated SPF value'
+                    )
+                zone.add_record(generated_record)
+
+            self.log.info(
+                f'process_source_zone:   flattened {record.fqdn}, {len(spf)} -> {len(flattened)} bytes'
+            )
+            record = record.copy()
+            record.values[record.values.index(spf)] = flattened
+            zone.add_record(record, replace=True)
+
+        if self.verify_dns_lookups:
+            return super().process_source_zone(zone, *args, **kwargs)
+
+        return zone
@@ -0,0 +1,79 @@
+#
+#
+#
+
+from datetime import date, datetime, timezone
+from logging import getLogger
+from os.path import dirname, join
+from typing import Optional, Tuple
+
+from octodns.processor.base import ProcessorException
+from octodns.yaml import safe_load
+
+
+class SpfKnownIncludes(object):
+    '''
+    Lookup costs of the include trees of well-known SPF providers, e.g.
+    `_spf.google.com`, so that they can be used without resolving anything.
+
+    The table shipped with octodns_spf is loaded first, followed by any
+    `paths`, with later entries replacing earlier ones. Each file is YAML:
+
+        ---
+        version: 1
+        includes:
+          _spf.google.com:
+            cost: 3
+            verified: 2026-10-01
+
+    `verified` is optional, entries without it haven't been checked against
+    the provider's records. `get` returns a `(cost, verified)` tuple,
+    `verified` a timestamp or `None`, or `None` for domains that aren't known.
+    '''
+
+    VERSION = 1
+    DEFAULT_PATH = join(dirname(__file__), 'known-includes.yaml')
+
+    log = getLogger('SpfKnownIncludes')
+
+    def __init__(self, *paths):
+        self.log.debug('__init__: paths=%s', paths)
+        self.includes = {}
+        for path in (self.DEFAULT_PATH,) + paths:
+            self._load(path)
+
+    def _load(self, path):
+        with open(path) as fh:
+            data = safe_load(fh, enforce_order=False) or {}
+
+        version = data.get('version')
+        if version != self.VERSION:
+            raise ProcessorException(
+                f'{path}: unsupported known includes version {version}, must be {self.VERSION}'
+            )
+
+        for domain, entry in (data.get('includes') or {}).items():
+            try:
+                cost = entry['cost']
+                verified = entry.get('verified')
+                if verified is not None and not isinstance(verified, date):
+                    verified = date.fromisoformat(str(verified))
+            except (KeyError, TypeError, ValueError):
+                raise ProcessorException(
+                    f'{path}: {domain} must have a cost and, if verified, a date'
+                )
+            if not isinstance(cost, int) or not 0 <= cost <= 10:
+                raise ProcessorException(
+                    f'{path}: {domain} has an invalid cost {cost}, must be 0-10'
+                )
+            if verified is not None:
+                verified = datetime(
+                    verified.year,
+                    verified.month,
+                    verified.day,
+                    tzinfo=timezone.utc,
+                ).timestamp()
+            self.includes[domain.lower().rstrip('.')] = (cost, verified)
+
+    def get(self, domain: str) -> Optional[Tuple[int, float]]:
+        return self.includes.get(domain.lower().rstrip('.'))
@@ -0,0 +1,177 @@
+#
+#
+#
+
+from collections import namedtuple
+from functools import lru_cache
+from sys import intern
+
+from octodns.record import RecordException
+
+
+class SpfException(RecordException):
+    def __init__(self, msg, record=None):
+        context = getattr(record, 'context', None)
+        if context:
+            msg += f', from {context}'
+        super().__init__(msg)
+        self.record = record
+
+
+# A single term of an SPF value, https://datatracker.ietf.org/doc/html/rfc7208#section-4.6.1
+#
+# text: the term as written
+# qualifier: one of +, -, ~, or ?, + when not written, None for modifiers
+# mechanism: the lowercased mechanism name, e.g. include, None for modifiers
+# modifier: the lowercased modifier name, e.g. redirect, None for mechanisms
+# value: what follows the mechanism's name, less the separating `:`, or the
+#   modifier's `=`, e.g. `example.com` for `include:example.com`, `/24` for
+#   `a/24`, and an empty string for `mx`
+SpfTerm = namedtuple(
+    'SpfTerm', ('text', 'qualifier', 'mechanism', 'modifier', 'value')
+)
+
+MECHANISMS = frozenset(
+    ('all', 'include', 'a', 'mx', 'ptr', 'ip4', 'ip6', 'exists')
+)
+# Each of these costs a DNS lookup when evaluated, https://datatracker.ietf.org/doc/html/rfc7208#section-4.6.4
+LOOKUP_MECHANISMS = frozenset(('include', 'a', 'mx', 'ptr', 'exists'))
+LOOKUP_MODIFIERS = frozenset(('redirect',))
+
+_QUALIFIERS = frozenset('+-~?')
+# Mechanisms that must have a `:` and something after it
+_REQUIRES_VALUE = frozenset(('include', 'exists', 'ip4', 'ip6'))
+# Modifiers whose domain-spec can't be empty
+_REQUIRES_DOMAIN = frozenset(('redirect', 'exp'))
+# Mechanisms SpfSource manages, all others are left to the value's author
+_MANAGED = ('a', 'mx', 'ip4', 'ip6', 'include', 'exists')
+
+
+def _tokenize(piece):
+    qualifier = '+'
+    start = 0
+    if piece[0] in _QUALIFIERS:
+        qualifier = piece[0]
+        start = 1
+
+    # the name runs until the first delimiter, which tells us what we have
+    end = len(piece)
+    for i in range(start, end):
+        if piece[i] in ':/=':
+            end = i
+            break
+    name = piece[start:end].lower()
+
+    if end < len(piece) and piece[end] == '=':
+        if start or not name:
+            # modifiers have names and don't have qualifiers
+            return None
+        value = piece[end + 1 :]
+        if not value and name in _REQUIRES_DOMAIN:
+            return None
+        return SpfTerm(piece, None, None, intern(name), value)
+
+    value = piece[end:]
+    if value.startswith(':'):
+        value = value[1:]
+        if not value or value[0] == '/':
+            # a `:` without a domain-spec after it, e.g. `include:` or `a:/24`
+            return None
+    elif name in _REQUIRES_VALUE:
+        return None
+    return SpfTerm(piece, qualifier, intern(name), None, intern(value))
+
+
+class SpfPolicy(object):
+    '''
+    A parsed SPF value, its terms in order along with the values of each of
+    the mechanisms SpfSource manages. Strings are interned so that the many
+    policies referencing common domains, e.g. popular includes, share them.
+
+    Values are tokenized per RFC 7208's grammar in a single pass. Terms that
+    aren't valid mechanisms or modifiers are noted in `unrecognized` and
+    mechanisms or qualifiers that SpfSource can't represent, e.g. `ptr` or
+    `?all`, in `unsupported`.
+
+    Instances are shared by everything that parses the same value, see
+    `parse_spf`, and must not be modified.
+    '''
+
+    __slots__ = (
+        'value',
+        'terms',
+        'a_records',
+        'mx_records',
+        'ip4_addresses',
+        'ip6_addresses',
+        'includes',
+        'exists',
+        'soft_fail',
+        'modifiers',
+        'unrecognized',
+        'unsupported',
+    )
+
+    def __init__(self, value):
+        pieces = value.split()
+        if not pieces or pieces[0].lower() != 'v=spf1':
+            raise SpfException(f'Unrecognized SPF value: "{value}"')
+
+        managed = {m: [] for m in _MANAGED}
+        soft_fail = None
+        modifiers = []
+        unrecognized = None
+        unsupported = None
+        terms = []
+        for piece in pieces[1:]:
+            term = _tokenize(piece)
+            if term is None or (
+                term.modifier is None and term.mechanism not in MECHANISMS
+            ):
+                # the first thing we don't understand
+                if unrecognized is None:
+                    unrecognized = piece
+                continue
+            terms.append(term)
+
+            if term.modifier is not None:
+                modifiers.append((term.modifier, term.value))
+            elif term.mechanism == 'all' and term.qualifier in '-~':
+                soft_fail = term.qualifier == '~'
+            elif term.mechanism in managed and term.qualifier == '+':
+                managed[term.mechanism].append(term.value)
+            elif unsupported is None:
+                unsupported = piece
+
+        self.value = value
+        self.terms = tuple(terms)
+        self.a_records = tuple(managed['a'])
+        self.mx_records = tuple(managed['mx'])
+        self.ip4_addresses = tuple(managed['ip4'])
+        self.ip6_addresses = tuple(managed['ip6'])
+        self.includes = tuple(managed['include'])
+        self.exists = tuple(managed['exists'])
+        self.soft_fail = soft_fail
+        # (name, value) of the modifiers, e.g. redirect & exp
+        self.modifiers = tuple(modifiers)
+        # the text of the first term that isn't a valid mechanism or modifier,
+        # if any
+        self.unrecognized = unrecognized
+        # the first mechanism SpfSource can't represent, if any
+        self.unsupported = unsupported
+
+    def __repr__(self):
+        return f'SpfPolicy<{self.value}>'
+
+
+# The number of distinct values whose parsed policies are kept
+PARSE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_spf(value):
+    '''
+    Returns the SpfPolicy for `value`, parsing each distinct value once and
+    keeping the most recently used in a bounded LRU.
+    '''
+    return SpfPolicy(value)
@@ -0,0 +1,184 @@
+'''
+Warms SPF caches with every include referenced by an octoDNS config
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from logging import WARNING, getLogger
+from time import monotonic
+
+from dns.exception import DNSException
+
+from octodns.cmds.args import ArgumentParser
+from octodns.idna import idna_decode
+from octodns.manager import Manager
+from octodns.processor.base import ProcessorException
+
+from .cache import SpfSqliteCache
+from .processor import SpfDnsLookupProcessor
+from .source import SpfSource
+
+log = getLogger('SpfPrefetch')
+
+# The number of values in the summary's list of the slowest
+SLOWEST = 10
+
+
+def _percentile(durations, percentile):
+    index = int(len(durations) * percentile / 100)
+    return durations[min(index, len(durations) - 1)]
+
+
+def collect(manager):
+    '''
+    Returns a dict of each SpfDnsLookupProcessor configured in `manager` to
+    the SPF values it'll see, mapped to the fqdn of the first record, or
+    source, they came from.
+    '''
+    processors = [
+        p
+        for p in manager.processors.values()
+        if isinstance(p, SpfDnsLookupProcessor)
+    ]
+    work = {p: {} for p in processors}
+
+    # Every SpfSource's includes, each on its own so that a problem with one
+    # doesn't keep the others from being warmed
+    for provider in manager.providers.values():
+        if isinstance(provider, SpfSource):
+            for include in provider.includes:
+                for values in work.values():
+                    values.setdefault(
+                        f'v=spf1 include:{include} -all', f'<{provider.id}>'
+                    )
+
+    # The SPF values of every zone that uses one of the processors, the zones,
+    # their sources, and processors, as sync would see them. These are Manager
+    # internals, pyproject.toml's octodns requirement is the earliest version
+    # they've been checked against.
+    zones = manager._preprocess_zones(manager.config['zones'])
+    for zone_name, config in zones.items():
+        if 'alias' in config:
+            # same records as the zone it's an alias of
+            continue
+        decoded_zone_name = idna_decode(zone_name)
+        processors = [
+            p
+            for p in manager._get_processors(decoded_zone_name, config)
+            if p in work
+        ]
+        if not processors:
+            continue
+
+        log.info('collect: zone=%s', decoded_zone_name)
+        zone = manager.get_zone(zone_name)
+        for source in manager._get_sources(decoded_zone_name, config, None):
+            source.populate(zone, lenient=True)
+
+        for record in zone.records:
+            if record._type != 'TXT' or record.octodns.get('lenient'):
+                continue
+            for value in record.values:
+                if value.startswith('v=spf1 '):
+                    for processor in processors:
+                        work[processor].setdefault(value, record.fqdn)
+
+    return work
+
+
+def warm(processor, values, max_workers=8):
+    '''
+    Walks each of `values`, a dict of SPF value to fqdn, with `processor`
+    concurrently, filling its cache. Returns a list of (fqdn, value, seconds,
+    error) for each.
+    '''
+
+    def one(item):
+        value, fqdn = item
+        start = monotonic()
+        error = None
+        try:
+            processor.check_dns_lookups(fqdn, [value])
+        except (DNSException, ProcessorException) as e:
+            # warming is best effort, validation will report problems
+            error = f'{e.__class__.__name__}: {e}'
+        return fqdn, value, monotonic() - start, error
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(one, values.items()))
+
+
+def prefetch(manager, max_workers=8):
+    '''
+    Warms the caches of every SpfDnsLookupProcessor configured in `manager`,
+    returning a summary of what was done and how long it took.
+    '''
+    start = monotonic()
+    work = collect(manager)
+    collected = monotonic()
+
+    summary = {'processors': {}}
+    results = []
+    for processor, values in work.items():
+        if not isinstance(processor.cache, SpfSqliteCache):
+            log.warning(
+                'prefetch: processor %s has no cache_path, its cache will not outlive this process',
+                processor.id,
+            )
+        processor_start = monotonic()
+        processor_results = warm(processor, values, max_workers)
+        results.extend(processor_results)
+        summary['processors'][processor.id] = {
+            'values': len(values),
+            'failures': sum(1 for r in processor_results if r[3]),
+            'seconds': monotonic() - processor_start,
+        }
+
+    durations = sorted(r[2] for r in results)
+    summary.update(
+        {
+            'values': len(results),
+            'errors': [
+                {'fqdn': fqdn, 'value': value, 'error': error}
+                for fqdn, value, _, error in results
+                if error
+            ],
+            'seconds': {
+                'collect': collected - start,
+                'warm': monotonic() - collected,
+                'total': monotonic() - start,
+            },
+            'latency': {
+                f'p{p}': _percentile(durations, p) if durations else None
+                for p in (50, 95, 99)
+            },
+            'slowest': [
+                {'fqdn': fqdn, 'value': value, 'seconds': seconds}
+                for fqdn, value, seconds, _ in sorted(
+                    results, key=lambda r: r[2], reverse=True
+                )[:SLOWEST]
+            ],
+        }
+    )
+    return summary
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[1])
+
+    parser.add_argument(
+        '--config-file',
+        required=True,
+        help='The Manager configuration file to use',
+    )
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=8,
+        help='The number of SPF values to warm concurrently',
+    )
+
+    args = parser.parse_args(WARNING)
+
+    manager = Manager(args.config_file)
+    print(dumps(prefetch(manager, args.max_workers), indent=2))
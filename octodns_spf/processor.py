@@ -2,13 +2,29 @@
 #
 #
 
+from asyncio import gather, run, wrap_future
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from importlib import import_module
 from logging import getLogger
-from typing import List, Optional
+from math import inf
+from threading import Lock
+from time import monotonic, time
+from typing import Dict, List, Optional, Tuple
 
-import dns.resolver
-from dns.resolver import Answer
+from dns.exception import DNSException
+from dns.resolver import NXDOMAIN, Answer, NoAnswer
 
 from octodns.processor.base import BaseProcessor, ProcessorException
+from octodns.record import Create, Update
+
+from .cache import SpfResolutionCache, SpfSqliteCache
+from .known import SpfKnownIncludes
+from .policy import LOOKUP_MECHANISMS, LOOKUP_MODIFIERS, parse_spf
+from .resolver import BaseSpfResolver, DnsPythonResolver
+from .stats import SpfStats
+from .throttle import SpfThrottle
+from .tracing import BaseSpfSpanSink, JsonLinesSpanSink, SpfTracer
 
 
 class SpfValueException(ProcessorException):
@@ -19,12 +35,245 @@ class SpfDnsLookupException(ProcessorException):
     pass
 
 
+# Answers that make a lookup "void", https://datatracker.ietf.org/doc/html/rfc7208#section-4.6.4
+_VOIDS = {'NXDOMAIN': NXDOMAIN, 'NoAnswer': NoAnswer}
+
+
+class _SpfFrame(object):
+    '''
+    An SPF value being walked, the terms remaining and the counts when it was
+    entered so that its subtree's cost can be computed once it's finished.
+    '''
+
+    __slots__ = (
+        'domain',
+        'terms',
+        'follows',
+        'lookups',
+        'voids',
+        'expires',
+        'span',
+    )
+
+    def __init__(self, domain, policy, lookups, voids, expires, span=None):
+        self.domain = domain
+        terms = () if policy is None else policy.terms
+        self.terms = iter(terms)
+        # redirect is ignored when there's an all mechanism, https://datatracker.ietf.org/doc/html/rfc7208#section-6.1
+        self.follows = not any(t.mechanism == 'all' for t in terms)
+        self.lookups = lookups
+        self.voids = voids
+        self.expires = expires
+        # the tracing span timing its walk, when tracing
+        self.span = span
+
+
+def _stat(name):
+    '''
+    A read-only attribute backed by one of the processor's stats counters.
+    '''
+    return property(lambda self: self.stats.counters[name])
+
+
+def _instantiate(_type, config):
+    config = dict(config)
+    _class = config.pop('class', None)
+    try:
+        module_name, class_name = _class.rsplit('.', 1)
+        klass = getattr(import_module(module_name), class_name)
+    except (AttributeError, ImportError, ValueError):
+        raise ProcessorException(f'Unknown {_type} class: {_class}')
+    return klass(**config)
+
+
 class SpfDnsLookupProcessor(BaseProcessor):
+    # sync resolves includes one at a time as they're encountered, async
+    # resolves each level of the include tree concurrently up front
+    ENGINES = ('sync', 'async')
+    # How long names and types that don't exist are remembered
+    NEGATIVE_TTL = 300
+    # How deeply includes and redirects may be nested by default
+    DEFAULT_MAX_DEPTH = 10
+    # Threads refreshing stale cache entries in the background
+    REFRESH_WORKERS = 2
+    # The longest a record will go without being re-validated when
+    # fingerprinting
+    DEFAULT_FINGERPRINT_MAX_AGE = 86400
+    # How the costs of well-known includes are used, trusted outright or
+    # verified in the background
+    KNOWN_INCLUDES_POLICIES = ('trust', 'verify')
+    # The oldest a known include cost may be, since it was last verified, and
+    # still be used, 180 days
+    DEFAULT_KNOWN_INCLUDES_MAX_AGE = 15552000
+
     log = getLogger('SpfDnsLookupProcessor')
 
-    def __init__(self, id):
-        self.log.debug('__init__:')
+    validated = _stat('validated')
+    reused = _stat('reused')
+    skipped = _stat('skipped')
+    coalesced = _stat('coalesced')
+    refreshed = _stat('refreshed')
+
+    def __init__(
+        self,
+        id,
+        cache_enabled=False,
+        cache_size=SpfResolutionCache.DEFAULT_MAX_SIZE,
+        cache_path=None,
+        cache_max_stale=SpfSqliteCache.DEFAULT_MAX_STALE,
+        engine='sync',
+        max_workers=1,
+        resolver=None,
+        resolve_mechanisms=False,
+        max_depth=DEFAULT_MAX_DEPTH,
+        max_qps=None,
+        max_in_flight=None,
+        stale_grace=0,
+        fingerprint_path=None,
+        fingerprint_max_age=DEFAULT_FINGERPRINT_MAX_AGE,
+        changes_only=False,
+        known_includes=None,
+        known_includes_path=None,
+        known_includes_max_age=DEFAULT_KNOWN_INCLUDES_MAX_AGE,
+        metrics_path=None,
+        tracing=None,
+    ):
+        self.log.debug(
+            f'__init__: id={id}, cache_enabled={cache_enabled}, cache_size={cache_size}, cache_path={cache_path}, cache_max_stale={cache_max_stale}, engine={engine}, max_workers={max_workers}, resolver={resolver}, resolve_mechanisms={resolve_mechanisms}, max_depth={max_depth}, max_qps={max_qps}, max_in_flight={max_in_flight}, stale_grace={stale_grace}, fingerprint_path={fingerprint_path}, fingerprint_max_age={fingerprint_max_age}, changes_only={changes_only}, known_includes={known_includes}, known_includes_path={known_includes_path}, known_includes_max_age={known_includes_max_age}, metrics_path={metrics_path}, tracing={tracing}'
+        )
         super().__init__(id)
+        if engine not in self.ENGINES:
+            raise ProcessorException(
+                f'Unsupported engine "{engine}", must be one of {", ".join(self.ENGINES)}'
+            )
+        self.engine = engine
+        if max_workers < 1:
+            raise ProcessorException(
+                f'Invalid max_workers {max_workers}, must be at least 1'
+            )
+        self.max_workers = max_workers
+        if max_depth < 1:
+            raise ProcessorException(
+                f'Invalid max_depth {max_depth}, must be at least 1'
+            )
+        self.max_depth = max_depth
+        if max_qps is not None and max_qps <= 0:
+            raise ProcessorException(
+                f'Invalid max_qps {max_qps}, must be greater than 0'
+            )
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ProcessorException(
+                f'Invalid max_in_flight {max_in_flight}, must be at least 1'
+            )
+        # Limits are shared by all processor instances in the process
+        if max_qps is not None or max_in_flight is not None:
+            self.throttle = SpfThrottle.shared(max_qps, max_in_flight)
+        else:
+            self.throttle = None
+        # seconds this processor's queries spent waiting on the throttle
+        self.throttle_waited = 0
+        # a resolver instance, or the config, `class` and its parameters, for
+        # one
+        if resolver is None:
+            resolver = DnsPythonResolver()
+        elif not isinstance(resolver, BaseSpfResolver):
+            resolver = _instantiate('resolver', resolver)
+        self.resolver = resolver
+        # resolve the domains of a, mx, and exists mechanisms to enforce the
+        # void lookup and MX host limits
+        self.resolve_mechanisms = resolve_mechanisms
+        # Caches are shared by all processor instances in the process
+        if cache_path:
+            self.cache = SpfSqliteCache.shared(cache_path, cache_max_stale)
+        elif cache_enabled:
+            self.cache = SpfResolutionCache.shared(cache_size)
+        else:
+            self.cache = None
+        if stale_grace < 0:
+            raise ProcessorException(
+                f'Invalid stale_grace {stale_grace}, must be at least 0'
+            )
+        # seconds past their expiration that cached answers are served while
+        # they're refreshed in the background
+        self.stale_grace = stale_grace
+        # fingerprints of the SPF values that have been validated successfully
+        # and the earliest expiration of the answers they relied upon, so that
+        # unchanged values can be skipped in later runs
+        if fingerprint_path:
+            self.fingerprints = SpfSqliteCache.shared(
+                fingerprint_path, fingerprint_max_age
+            )
+        else:
+            self.fingerprints = None
+        # validate the records in computed plans' creates and updates rather
+        # than every record in the source zones
+        self.changes_only = changes_only
+        if (
+            known_includes is not None
+            and known_includes not in self.KNOWN_INCLUDES_POLICIES
+        ):
+            raise ProcessorException(
+                f'Unsupported known_includes "{known_includes}", must be one of {", ".join(self.KNOWN_INCLUDES_POLICIES)}'
+            )
+        if known_includes_path and known_includes is None:
+            raise ProcessorException(
+                'known_includes_path requires known_includes to be set'
+            )
+        # lookup costs of well-known includes that are used rather than
+        # walking them, optionally verified in the background
+        self.known_includes = known_includes
+        if known_includes is not None:
+            paths = (known_includes_path,) if known_includes_path else ()
+            self.known = SpfKnownIncludes(*paths)
+        else:
+            self.known = None
+        self.known_includes_max_age = known_includes_max_age
+        # the known includes whose costs have been used, each is verified the
+        # first time it's used
+        self.known_used = set()
+        self._refresher = None
+        # (rdtype, domain) of the refreshes that have been scheduled
+        self._refreshing = set()
+        # domain -> the domains it includes, built as include trees are walked
+        self.include_graph = {}
+        # domain -> (lookup cost of its include subtree, expiration), shared by
+        # every record this processor validates so that common subtrees are
+        # only walked once
+        self._costs = {}
+        # subtrees with void lookups aren't remembered so costs are only
+        # shared with processors that resolve mechanisms the same way
+        self._cost_kind = 'resolved-cost' if resolve_mechanisms else 'cost'
+        # (rdtype, domain) -> (exception class, expiration) for names and types
+        # that don't exist, so that dead domains aren't queried again
+        self._voids = {}
+        # fqdn -> the TXT values of the zones being validated, answered from
+        # the zone so that records that'll be published by the sync, e.g.
+        # SpfSource's `_spfN` chain, are validated as they're desired
+        self._zone_txt = {}
+        # normalized SPF value -> lookup count, or the (exception class,
+        # message suffix) it failed with, so that each distinct value is only
+        # validated once per run
+        self._results = {}
+        self._results_lock = Lock()
+        # (rdtype, domain) -> Future of queries that are in flight, callers
+        # asking for the same thing wait on it rather than querying again
+        self._inflight = {}
+        self._inflight_lock = Lock()
+        # counters and histograms of the work done, summarized after each zone
+        # and written in the Prometheus text format to `metrics_path` when set
+        self.stats = SpfStats()
+        self.metrics_path = metrics_path
+        # spans of each validation and the targets walked within it go to a
+        # sink, a JSON-lines file path, a sink instance, or the config,
+        # `class` and its parameters, for one
+        if tracing is None:
+            self.tracer = None
+        else:
+            if isinstance(tracing, str):
+                tracing = JsonLinesSpanSink(tracing)
+            elif not isinstance(tracing, BaseSpfSpanSink):
+                tracing = _instantiate('tracing sink', tracing)
+            self.tracer = SpfTracer(tracing)
 
     def _get_spf_from_txt_values(
         self, fqdn: str, values: List[str]
@@ -58,52 +307,804 @@ class SpfDnsLookupProcessor(BaseProcessor):
 
         return values
 
-    def check_dns_lookups(
-        self, fqdn: str, values: List[str], lookups: int = 0
-    ) -> int:
+    def _cached(
+        self, domain: str, rdtype: str = 'TXT', span=None
+    ) -> Optional[Tuple[List[str], float]]:
+        '''
+        Returns `domain`'s `rdtype` values and their expiration when they're
+        known without a query, `None` otherwise. When given, `span` is labeled
+        with where the answer came from.
+        '''
+        if rdtype == 'TXT':
+            values = self._zone_txt.get(domain)
+            if values is not None:
+                if span is not None:
+                    span.attrs['cache'] = 'zone'
+                # already expired so that nothing built on it is remembered
+                # beyond this validation
+                return values, time()
+        void = self._voids.get((rdtype, domain))
+        if void is not None and void[1] > time():
+            if span is not None:
+                span.attrs['cache'] = 'hit'
+            if self.cache is not None:
+                self.stats.increment('cache_hits')
+            raise void[0]()
+        if self.cache is None:
+            # there's nothing to hit or miss
+            if span is not None:
+                span.attrs['cache'] = 'miss'
+            return None
+        hit = self.cache.get(rdtype, domain, grace=self.stale_grace)
+        if span is not None:
+            span.attrs['cache'] = 'miss' if hit is None else 'hit'
+        if hit is None:
+            self.stats.increment('cache_misses')
+            return None
+        self.stats.increment('cache_hits')
+        self.log.debug(f"_cached: domain={domain} rdtype={rdtype} cache hit")
+        if hit[1] <= time():
+            # stale, but within the grace period, use it while a fresh answer
+            # is fetched
+            self._refresh_later(domain, rdtype)
+        if isinstance(hit[0], str):
+            # a negative answer
+            exception_class = _VOIDS[hit[0]]
+            self._voids[(rdtype, domain)] = (exception_class, hit[1])
+            raise exception_class()
+        return hit
+
+    def _refresh_later(self, domain: str, rdtype: str):
+        key = (rdtype, domain)
+        with self._inflight_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self.log.debug(f'_refresh_later: domain={domain} rdtype={rdtype}')
+        self._background(self._refresh, domain, rdtype)
+
+    def _background(self, fn, *args):
+        with self._inflight_lock:
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(
+                    max_workers=self.REFRESH_WORKERS,
+                    thread_name_prefix=f'{self.id}-refresh',
+                )
+        self._refresher.submit(fn, *args)
+
+    def _refresh(self, domain: str, rdtype: str):
+        try:
+            self._query(domain, rdtype)
+        except (NXDOMAIN, NoAnswer):
+            # remembered as a void by _query
+            pass
+        except DNSException as e:
+            # keep using what we have until it's out of grace
+            self.log.warning(f'_refresh: {domain} {rdtype} failed, {e}')
+        finally:
+            with self._inflight_lock:
+                self._refreshing.discard((rdtype, domain))
+            self.stats.increment('refreshed')
+
+    def _store_void(self, domain: str, rdtype: str, exception: Exception):
+        exception_class = exception.__class__
+        self._voids[(rdtype, domain)] = (
+            exception_class,
+            time() + self.NEGATIVE_TTL,
+        )
+        if self.cache is not None:
+            self.cache.set(
+                rdtype, domain, exception_class.__name__, self.NEGATIVE_TTL
+            )
+
+    def _cached_cost(self, domain: str) -> Optional[Tuple[int, float]]:
+        if domain in self._zone_txt:
+            # walk what the zone has, not what was published previously
+            return None
+        memo = self._costs.get(domain)
+        if memo is not None and memo[1] > time():
+            return memo
+        if self.cache is not None:
+            hit = self.cache.get(self._cost_kind, domain)
+            if hit is not None:
+                self._costs[domain] = hit
+                return hit
+        if self.known is not None:
+            return self._known_cost(domain)
+        return None
+
+    def _known_cost(self, domain: str) -> Optional[Tuple[int, float]]:
+        known = self.known.get(domain)
+        if known is None:
+            return None
+        cost, verified = known
+        if verified is None:
+            # never checked against the provider's records, walk it
+            self.log.debug(f'_known_cost: domain={domain} unverified')
+            return None
+        expires = verified + self.known_includes_max_age
+        if expires <= time():
+            # too long since it was verified, walk it
+            self.log.debug(f'_known_cost: domain={domain} too old')
+            return None
+        with self._inflight_lock:
+            verify = (
+                self.known_includes == 'verify'
+                and domain not in self.known_used
+            )
+            self.known_used.add(domain)
+        if verify:
+            self._background(self._verify_known, domain, cost)
+        return cost, expires
+
+    def _verify_known(self, domain: str, cost: int):
+        '''
+        Walks `domain`'s include tree, warning if its cost differs from the
+        known one. The walked cost is used from then on.
+        '''
+        try:
+            values, answer_expires = self._resolve_txt(domain)
+            actual, voids, expires = self._check_dns_lookups(
+                domain, values, 0, domain=domain
+            )
+        except (DNSException, ProcessorException) as e:
+            self.log.warning(f'_verify_known: {domain} failed, {e}')
+            return
+        if actual != cost:
+            self.log.warning(
+                f'_verify_known: {domain} costs {actual} lookups, the known includes table has {cost}'
+            )
+        if not voids:
+            self._store_cost(domain, actual, min(answer_expires, expires))
+
+    def _store_cost(self, domain: str, cost: int, expires: float):
+        self._costs[domain] = (cost, expires)
+        if self.cache is not None:
+            self.cache.set(self._cost_kind, domain, cost, expires - time())
+
+    def _store(
+        self, domain: str, rdtype: str, answer: Answer
+    ) -> Tuple[List[str], float]:
+        if rdtype == 'TXT':
+            values = self._process_answer(answer)
+        else:
+            values = [value.to_text() for value in answer]
+
+        # Expiration is only tracked when there's somewhere to keep it
+        if self.cache is None and self.fingerprints is None:
+            return values, inf
+
+        ttl = answer.rrset.ttl
+        if self.cache is not None:
+            self.cache.set(rdtype, domain, values, ttl)
+        return values, time() + ttl
+
+    def _throttled(self, waited: float):
+        if waited > 0:
+            with self._inflight_lock:
+                self.throttle_waited += waited
+
+    def _queried(self, start: float):
+        self.stats.increment('queries')
+        self.stats.observe('query_seconds', monotonic() - start)
+
+    def _query(self, domain: str, rdtype: str) -> Tuple[List[str], float]:
+        throttle = self.throttle
+        if throttle is not None:
+            self._throttled(throttle.acquire())
+        start = monotonic()
+        try:
+            answer = self.resolver.resolve(domain, rdtype)
+        except (NXDOMAIN, NoAnswer) as e:
+            self._store_void(domain, rdtype, e)
+            raise
+        finally:
+            self._queried(start)
+            if throttle is not None:
+                throttle.release()
+        return self._store(domain, rdtype, answer)
+
+    async def _query_async(self, domain: str) -> Tuple[List[str], float]:
+        throttle = self.throttle
+        if throttle is not None:
+            self._throttled(await throttle.acquire_async())
+        start = monotonic()
+        try:
+            answer = await self.resolver.resolve_async(domain, 'TXT')
+        except (NXDOMAIN, NoAnswer) as e:
+            self._store_void(domain, 'TXT', e)
+            raise
+        finally:
+            self._queried(start)
+            if throttle is not None:
+                throttle.release()
+        return self._store(domain, 'TXT', answer)
+
+    def _resolve(
+        self, domain: str, rdtype: str = 'TXT', span=None
+    ) -> Tuple[List[str], float]:
+        '''
+        Returns the values, as text, of `domain`'s `rdtype` records along with
+        when they expire, from the cache when possible. Concurrent requests
+        for the same records share a single query.
+        '''
+        hit = self._cached(domain, rdtype, span)
+        if hit is not None:
+            return hit
+
+        future, leader = self._join_flight(domain, rdtype)
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._query(domain, rdtype)
+        except Exception as e:
+            self._land_flight(domain, rdtype, future, exception=e)
+            raise
+        self._land_flight(domain, rdtype, future, result=result)
+        return result
+
+    def _join_flight(self, domain: str, rdtype: str) -> Tuple[Future, bool]:
+        '''
+        Returns the Future for an in flight query of `domain`'s `rdtype`
+        records along with whether the caller is the leader, responsible for
+        making the query and landing the result.
+        '''
+        key = (rdtype, domain)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats.increment('coalesced')
+                self.log.debug(
+                    f'_join_flight: domain={domain} rdtype={rdtype} coalesced'
+                )
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _land_flight(
+        self,
+        domain: str,
+        rdtype: str,
+        future: Future,
+        result=None,
+        exception: Optional[Exception] = None,
+    ):
+        with self._inflight_lock:
+            del self._inflight[(rdtype, domain)]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _resolve_txt(
+        self, domain: str, prefetched: Optional[Dict] = None, span=None
+    ) -> Tuple[List[str], float]:
+        if prefetched is not None and domain in prefetched:
+            if span is not None:
+                span.attrs['cache'] = 'prefetched'
+            result = prefetched[domain]
+            if isinstance(result, Exception):
+                # resolving failed, fail the same way we would have here
+                raise result
+            return result
+
+        return self._resolve(domain, 'TXT', span)
+
+    async def _resolve_txt_async(self, domain: str) -> Tuple[List[str], float]:
+        hit = self._cached(domain)
+        if hit is not None:
+            return hit
+
+        future, leader = self._join_flight(domain, 'TXT')
+        if not leader:
+            # the query may be in flight on another thread's event loop
+            return await wrap_future(future)
+
+        try:
+            result = await self._query_async(domain)
+        except Exception as e:
+            self._land_flight(domain, 'TXT', future, exception=e)
+            raise
+        self._land_flight(domain, 'TXT', future, result=result)
+        return result
+
+    def _includes(self, values: List[str]) -> List[str]:
+        includes = []
+        for value in values:
+            if value.startswith('v=spf1 '):
+                for term in parse_spf(value).terms:
+                    if term.mechanism == 'include':
+                        includes.append(term.value)
+        return includes
+
+    def _targets(self, values: List[str]) -> List[str]:
+        '''
+        Returns the domains whose SPF values `values` will be walked into,
+        their includes and any redirect that'll be followed.
+        '''
+        targets = []
+        for value in values:
+            if value.startswith('v=spf1 '):
+                policy = parse_spf(value)
+                follows = not any(t.mechanism == 'all' for t in policy.terms)
+                for term in policy.terms:
+                    if term.mechanism == 'include' or (
+                        follows and term.modifier == 'redirect'
+                    ):
+                        targets.append(term.value)
+        return targets
+
+    async def _prefetch(self, values: List[str]) -> Dict:
+        '''
+        Resolves the include tree of `values` a level at a time, with all of
+        the includes in each level in flight concurrently. Returns a dict of
+        domain to either its `_resolve_txt` result or the exception raised
+        while resolving it.
+        '''
+        prefetched = {}
+        level = self._targets(values)
+        # Every include costs at least one lookup so there's no point in
+        # looking beyond the first 10 unique domains, the walk will have
+        # failed by then
+        while level and len(prefetched) <= 10:
+            # unique, not previously seen, preserving order
+            domains = [
+                d
+                for d in dict.fromkeys(level)
+                if d not in prefetched and self._cached_cost(d) is None
+            ]
+            self.log.debug(f'_prefetch: domains={domains}')
+            results = await gather(
+                *[self._resolve_txt_async(d) for d in domains],
+                return_exceptions=True,
+            )
+            level = []
+            for domain, result in zip(domains, results):
+                prefetched[domain] = result
+                if not isinstance(result, Exception):
+                    level.extend(self._targets(result[0]))
+
+        return prefetched
+
+    def _check_void(
+        self, fqdn: str, term, domain: Optional[str]
+    ) -> Tuple[int, float]:
+        '''
+        Resolves the domain-spec of an a, mx, or exists mechanism, returning 1
+        if the lookup was void, nothing there, and 0 otherwise, along with when
+        the answers that was based on expire.
+        '''
+        target = term.value
+        if term.mechanism != 'exists':
+            # a & mx default to the current domain and may have cidr lengths
+            target = target.split('/', 1)[0] or domain
+        if not target or '%' in target:
+            # there's no current domain, or macros that are only expanded when
+            # a message is evaluated, nothing we can check ahead of time
+            return 0, inf
+
+        if term.mechanism == 'mx':
+            try:
+                hosts, expires = self._resolve(target, 'MX')
+            except (NXDOMAIN, NoAnswer):
+                return 1, self._void_expires(target, 'MX')
+            # https://datatracker.ietf.org/doc/html/rfc7208#section-4.6.4
+            if len(hosts) > 10:
+                raise SpfValueException(
+                    f"{fqdn} {term.text} has more than 10 MX hosts"
+                )
+            return 0 if hosts else 1, expires
+
+        expires = inf
+        for rdtype in ('A', 'AAAA') if term.mechanism == 'a' else ('A',):
+            try:
+                values, answer_expires = self._resolve(target, rdtype)
+            except NXDOMAIN:
+                # the name doesn't exist, no other types will either
+                return 1, self._void_expires(target, rdtype)
+            except NoAnswer:
+                expires = min(expires, self._void_expires(target, rdtype))
+                continue
+            expires = min(expires, answer_expires)
+            if values:
+                return 0, expires
+        return 1, expires
+
+    def _void_expires(self, domain: str, rdtype: str) -> float:
+        # when the memoized non-existence of domain's rdtype records expires,
+        # it's always remembered by the time the exception gets to us
+        return self._voids[(rdtype, domain)][1]
+
+    def _policy(self, fqdn: str, values: List[str]):
+        spf = self._get_spf_from_txt_values(fqdn, values)
+        if spf is None:
+            return None
+
+        # parsed once and shared by every record and include with this value
+        policy = parse_spf(spf)
+        if policy.unrecognized is not None:
+            raise SpfValueException(
+                f'{fqdn} has an unrecognized SPF term "{policy.unrecognized}"'
+            )
+        return policy
+
+    def _check_dns_lookups(
+        self,
+        fqdn: str,
+        values: List[str],
+        lookups: int,
+        prefetched: Optional[Dict] = None,
+        domain: Optional[str] = None,
+        voids: int = 0,
+        span=None,
+    ) -> Tuple[int, int, float]:
+        '''
+        Returns the running lookup and void lookup counts along with the
+        earliest expiration of the answers they relied upon. `domain` is the
+        one `values` were published on, if known. `span` is the tracing span
+        of the validation, targets walked get spans of their own within it.
+
+        The include and redirect tree is walked depth first with an explicit
+        stack, bounded by `max_depth`, rather than recursion. Targets that are
+        already being walked, loops, are errors.
+        '''
         self.log.debug(
             f"check_dns_lookups: record={fqdn} values={values} lookups={lookups}"
         )
 
-        spf = self._get_spf_from_txt_values(fqdn, values)
+        stack = [
+            _SpfFrame(
+                domain, self._policy(fqdn, values), lookups, voids, inf, span
+            )
+        ]
+        if span is None:
+            return self._walk(fqdn, stack, lookups, voids, prefetched)
 
-        if spf is None:
-            return lookups
+        try:
+            return self._walk(fqdn, stack, lookups, voids, prefetched)
+        except Exception as e:
+            # finish the spans of the targets that were being walked
+            error = f'{e.__class__.__name__}: {e}'
+            for frame in reversed(stack[1:]):
+                self.tracer.finish(frame.span, error=error)
+            raise
+
+    def _walk(
+        self,
+        fqdn: str,
+        stack: List[_SpfFrame],
+        lookups: int,
+        voids: int,
+        prefetched: Optional[Dict],
+    ) -> Tuple[int, int, float]:
+        # the targets currently on the stack
+        path = set()
+        while True:
+            frame = stack[-1]
+            term = next(frame.terms, None)
+
+            if term is None:
+                if lookups > 10:
+                    raise SpfDnsLookupException(
+                        f"{fqdn} exceeds the 10 DNS lookup limit in the SPF record"
+                    )
+                stack.pop()
+                if not stack:
+                    return lookups, voids, frame.expires
 
-        terms = spf[len('v=spf1 ') :].split(' ')
+                # The target's entire tree was walked successfully, remember
+                # its cost for as long as the answers it's based on remain
+                # valid. Subtrees with void lookups are walked each time so
+                # that they count against every record using them.
+                if voids == frame.voids:
+                    self._store_cost(
+                        frame.domain, lookups - frame.lookups, frame.expires
+                    )
+                if frame.span is not None:
+                    self.tracer.finish(
+                        frame.span, lookups=lookups - frame.lookups
+                    )
+                path.remove(frame.domain)
+                parent = stack[-1]
+                parent.expires = min(parent.expires, frame.expires)
+                continue
 
-        for term in terms:
             if lookups > 10:
                 raise SpfDnsLookupException(
                     f"{fqdn} exceeds the 10 DNS lookup limit in the SPF record"
                 )
 
-            if term.startswith('ptr'):
+            if term.mechanism == 'ptr':
                 raise SpfValueException(
                     f"{fqdn} uses the deprecated ptr mechanism"
                 )
 
-            # These mechanisms cost one DNS lookup each
-            if term.startswith(('a', 'mx', 'exists:', 'redirect', 'include:')):
+            # These mechanisms cost one DNS lookup each, as does a redirect
+            # that'll be followed
+            if term.mechanism in LOOKUP_MECHANISMS or (
+                frame.follows and term.modifier in LOOKUP_MODIFIERS
+            ):
                 lookups += 1
 
-            # The include mechanism can result in further lookups after resolving the DNS record
-            if term.startswith('include:'):
-                domain = term[len('include:') :]
-                answer = dns.resolver.resolve(domain, 'TXT')
-                answer_values = self._process_answer(answer)
-                lookups = self.check_dns_lookups(fqdn, answer_values, lookups)
+            # includes and redirects can result in further lookups after
+            # resolving the DNS record
+            if term.mechanism == 'include' or (
+                frame.follows and term.modifier == 'redirect'
+            ):
+                target = term.value
 
-        return lookups
+                hit = self._cached_cost(target)
+                if hit is not None:
+                    # We've previously walked this target, use its cost
+                    cost, cost_expires = hit
+                    if frame.span is not None:
+                        self.tracer.finish(
+                            self.tracer.start(
+                                term.mechanism or term.modifier,
+                                target,
+                                len(stack),
+                                frame.span,
+                            ),
+                            lookups=cost,
+                            cache='cost',
+                        )
+                    lookups += cost
+                    frame.expires = min(frame.expires, cost_expires)
+                    # stop early, the remaining terms can't help
+                    if lookups > 10:
+                        raise SpfDnsLookupException(
+                            f"{fqdn} exceeds the 10 DNS lookup limit in the SPF record"
+                        )
+                    continue
 
-    def process_source_zone(self, zone, *args, **kwargs):
+                if target in path:
+                    chain = [f.domain for f in stack[1:]] + [target]
+                    raise SpfDnsLookupException(
+                        f"{fqdn} has an include loop, {' -> '.join(chain)}"
+                    )
+                if len(stack) > self.max_depth:
+                    raise SpfDnsLookupException(
+                        f"{fqdn} exceeds the maximum include depth of {self.max_depth}"
+                    )
+
+                span = None
+                if frame.span is None:
+                    answer_values, answer_expires = self._resolve_txt(
+                        target, prefetched
+                    )
+                else:
+                    span, answer_values, answer_expires = self._resolve_traced(
+                        term.mechanism or term.modifier,
+                        target,
+                        len(stack),
+                        frame.span,
+                        prefetched,
+                    )
+                self.include_graph[target] = self._includes(answer_values)
+                stack.append(
+                    _SpfFrame(
+                        target,
+                        self._policy(fqdn, answer_values),
+                        lookups,
+                        voids,
+                        answer_expires,
+                        span,
+                    )
+                )
+                path.add(target)
+            elif self.resolve_mechanisms and term.mechanism in (
+                'a',
+                'mx',
+                'exists',
+            ):
+                void, void_expires = self._check_void(fqdn, term, frame.domain)
+                voids += void
+                # the value is only good for as long as what was found, or
+                # wasn't, remains so
+                frame.expires = min(frame.expires, void_expires)
+                if voids > 2:
+                    raise SpfDnsLookupException(
+                        f"{fqdn} exceeds the 2 void DNS lookup limit in the SPF record"
+                    )
+
+    def _resolve_traced(
+        self,
+        name: str,
+        target: str,
+        depth: int,
+        parent,
+        prefetched: Optional[Dict],
+    ):
+        '''
+        `_resolve_txt` within a span of its own, returning the span along
+        with the values and their expiration.
+        '''
+        span = self.tracer.start(name, target, depth, parent)
+        try:
+            values, expires = self._resolve_txt(target, prefetched, span)
+        except Exception as e:
+            self.tracer.finish(span, error=f'{e.__class__.__name__}: {e}')
+            raise
+        return span, values, expires
+
+    def _check(
+        self, fqdn: str, values: List[str], lookups: int = 0
+    ) -> Tuple[int, int, float]:
+        prefetched = None
+        if self.engine == 'async':
+            prefetched = run(self._prefetch(values))
+        # records are published on their fqdn, others, e.g. SpfSource's
+        # generated values, don't have a domain of their own
+        domain = fqdn[:-1] if fqdn.endswith('.') else None
+        if self.tracer is None:
+            return self._check_dns_lookups(
+                fqdn, values, lookups, prefetched, domain
+            )
+
+        span = self.tracer.start('record', fqdn)
+        try:
+            result = self._check_dns_lookups(
+                fqdn, values, lookups, prefetched, domain, span=span
+            )
+        except Exception as e:
+            self.tracer.finish(span, error=f'{e.__class__.__name__}: {e}')
+            raise
+        self.tracer.finish(span, lookups=result[0])
+        return result
+
+    def check_dns_lookups(
+        self, fqdn: str, values: List[str], lookups: int = 0
+    ) -> int:
+        return self._check(fqdn, values, lookups)[0]
+
+    def _fingerprint(self, key: str) -> str:
+        # the options that change the outcome of validation are part of it
+        return sha256(
+            f'{self.resolve_mechanisms} {self.max_depth} {key}'.encode()
+        ).hexdigest()
+
+    def _validate_record(self, record):
+        fqdn = record.fqdn
+        spf = self._get_spf_from_txt_values(fqdn, record.values)
+        if spf is None:
+            return
+
+        key = ' '.join(spf.split())
+        if self.resolve_mechanisms and any(
+            t.mechanism in ('a', 'mx') and t.value[:1] in ('', '/')
+            for t in parse_spf(spf).terms
+        ):
+            # results depend upon the record's own domain
+            key = f'{fqdn} {key}'
+        with self._results_lock:
+            result = self._results.get(key)
+            if result is None:
+                # we're the first with this value, others wait on us rather
+                # than validating it again
+                future = self._results[key] = Future()
+            else:
+                self.stats.increment('reused')
+
+        if result is None:
+            try:
+                result = self._validate_value(fqdn, key, spf)
+            except Exception as e:
+                # nothing to reuse, those waiting fail the same way
+                with self._results_lock:
+                    del self._results[key]
+                future.set_exception(e)
+                raise
+            with self._results_lock:
+                self._results[key] = result
+            future.set_result(result)
+        elif isinstance(result, Future):
+            # the value is being validated on another thread
+            result = result.result()
+
+        if isinstance(result, tuple):
+            exception_class, suffix = result
+            raise exception_class(f'{fqdn}{suffix}')
+
+    def _validate_value(self, fqdn: str, key: str, spf: str):
+        '''
+        Returns the lookup count of `spf`, or the (exception class, message
+        suffix) it failed with.
+        '''
+        fingerprint = None
+        if self.fingerprints is not None:
+            fingerprint = self._fingerprint(key)
+            hit = self.fingerprints.get('fingerprint', fingerprint)
+            if hit is not None:
+                # validated previously and nothing it relied upon has
+                # expired since
+                self.log.debug(f'_validate_value: {fqdn} unchanged')
+                self.stats.increment('skipped')
+                return hit[0]
+
+        self.stats.increment('validated')
+        try:
+            result, _, expires = self._check(fqdn, [spf])
+        except (SpfDnsLookupException, SpfValueException) as e:
+            # messages lead with the fqdn, keep the rest so that it can be
+            # re-raised for other records with the same value
+            return (e.__class__, str(e)[len(fqdn) :])
+        self.stats.observe('record_lookups', result)
+        if fingerprint is not None:
+            self.fingerprints.set(
+                'fingerprint', fingerprint, result, expires - time()
+            )
+        return result
+
+    def _log_summary(self, method, zone):
+        # everything is counted from the start of the run, not per-zone
+        parts = [self.stats.summary()]
+        if self.known is not None:
+            parts.append(f'known_used={len(self.known_used)}')
+        if self.throttle is not None:
+            parts.append(f'throttle_waited={self.throttle_waited:.3f}')
+        for k, v in self.resolver.stats().items():
+            parts.append(
+                f'resolver_{k}={v:.3f}'
+                if isinstance(v, float)
+                else f'resolver_{k}={v}'
+            )
+        self.log.info(
+            f'{method}:   run totals after {zone.decoded_name}, {", ".join(parts)}'
+        )
+        if self.metrics_path:
+            # rewritten after each zone so that it's complete once the run is
+            self.stats.write_prometheus(
+                self.metrics_path, {'processor': self.id}
+            )
+
+    def _validate_records(self, method, zone, records):
         for record in zone.records:
-            if record._type != 'TXT':
-                continue
+            if record._type == 'TXT':
+                self._zone_txt[record.fqdn[:-1]] = record.values
 
-            if record.octodns.get('lenient'):
-                continue
+        # sorted so that validation, and thus errors, happen in a consistent
+        # order
+        records = sorted(
+            record
+            for record in records
+            if record._type == 'TXT' and not record.octodns.get('lenient')
+        )
+
+        if self.max_workers == 1 or len(records) < 2:
+            for record in records:
+                self._validate_record(record)
+            self._log_summary(method, zone)
+            return
 
-            self.check_dns_lookups(record.fqdn, record.values, 0)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self._validate_record, record)
+                for record in records
+            ]
+        # the executor has waited on everything, collect the failures in
+        # record order regardless of which finished first
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            for error in errors:
+                self.log.error(f'{method}: {error}')
+            raise errors[0]
 
+        self._log_summary(method, zone)
+
+    def process_source_zone(self, zone, *args, **kwargs):
+        if not self.changes_only:
+            self._validate_records('process_source_zone', zone, zone.records)
         return zone
+
+    def process_plan(self, plan, *args, **kwargs):
+        if self.changes_only and plan is not None:
+            # only the records that will be created or updated, those that
+            # match what the target already has are left alone
+            records = [
+                change.new
+                for change in plan.changes
+                if isinstance(change, (Create, Update))
+            ]
+            self._validate_records('process_plan', plan.desired, records)
+        return plan
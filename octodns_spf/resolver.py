@@ -0,0 +1,454 @@
+#
+#
+#
+
+from asyncio import (
+    FIRST_COMPLETED,
+    ensure_future,
+    new_event_loop,
+    run_coroutine_threadsafe,
+    wait,
+)
+from collections import deque
+from logging import getLogger
+from threading import Lock, Thread
+from time import monotonic
+
+import dns.asyncresolver
+import dns.exception
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+from dns.rdtypes.ANY.TXT import TXT
+
+from octodns.processor.base import ProcessorException
+from octodns.yaml import safe_load
+
+
+class BaseSpfResolver(object):
+    '''
+    The DNS resolution used by SpfDnsLookupProcessor.
+
+    `resolve` returns a `dns.resolver.Answer`, or something that behaves like
+    one, i.e. iterable over its rdata and with an `rrset` carrying the TTL.
+    Failures are raised as their dnspython equivalents, e.g. `NXDOMAIN` or
+    `NoAnswer`.
+    '''
+
+    def resolve(self, name, rdtype):
+        raise NotImplementedError('Abstract base class, resolve method missing')
+
+    async def resolve_async(self, name, rdtype):
+        return self.resolve(name, rdtype)
+
+    def stats(self):
+        '''
+        Returns a dict of statistics about the queries made, if any are kept.
+        '''
+        return {}
+
+
+class DnsPythonResolver(BaseSpfResolver):
+    '''
+    Resolves using dnspython. With no options the system's configured
+    resolvers and dnspython's defaults are used.
+
+    timeout: seconds to wait for a response from each nameserver
+    lifetime: total seconds to spend on a query, across nameservers and retries
+    nameservers: list of nameserver IP addresses to query instead of the
+        system's configured resolvers
+    retries: number of additional attempts made when a query times out or no
+        nameserver could answer it
+    '''
+
+    log = getLogger('DnsPythonResolver')
+
+    def __init__(
+        self, timeout=None, lifetime=None, nameservers=None, retries=0
+    ):
+        self.log.debug(
+            '__init__: timeout=%s, lifetime=%s, nameservers=%s, retries=%d',
+            timeout,
+            lifetime,
+            nameservers,
+            retries,
+        )
+        self.timeout = timeout
+        self.lifetime = lifetime
+        self.nameservers = nameservers
+        self.retries = retries
+
+        if timeout is None and lifetime is None and nameservers is None:
+            # dnspython's default, system configured, resolvers
+            self._resolver = None
+            self._async_resolver = None
+        else:
+            self._resolver = self._configure(dns.resolver.Resolver)
+            self._async_resolver = self._configure(dns.asyncresolver.Resolver)
+
+    def _configure(self, resolver_class):
+        # only load the system config when we'll be using its nameservers
+        resolver = resolver_class(configure=self.nameservers is None)
+        if self.nameservers is not None:
+            resolver.nameservers = self.nameservers
+        if self.timeout is not None:
+            resolver.timeout = self.timeout
+        if self.lifetime is not None:
+            resolver.lifetime = self.lifetime
+        return resolver
+
+    def _should_retry(self, name, rdtype, attempt, error):
+        if attempt >= self.retries:
+            return False
+        self.log.warning(
+            'resolve: %s %s failed (%s), retrying', name, rdtype, error
+        )
+        return True
+
+    def resolve(self, name, rdtype):
+        if self._resolver is None:
+            resolve = dns.resolver.resolve
+        else:
+            resolve = self._resolver.resolve
+
+        attempt = 0
+        while True:
+            try:
+                return resolve(name, rdtype)
+            except (
+                dns.resolver.LifetimeTimeout,
+                dns.resolver.NoNameservers,
+            ) as e:
+                if not self._should_retry(name, rdtype, attempt, e):
+                    raise
+                attempt += 1
+
+    async def resolve_async(self, name, rdtype):
+        if self._async_resolver is None:
+            resolve = dns.asyncresolver.resolve
+        else:
+            resolve = self._async_resolver.resolve
+
+        attempt = 0
+        while True:
+            try:
+                return await resolve(name, rdtype)
+            except (
+                dns.resolver.LifetimeTimeout,
+                dns.resolver.NoNameservers,
+            ) as e:
+                if not self._should_retry(name, rdtype, attempt, e):
+                    raise
+                attempt += 1
+
+
+class HedgedResolver(BaseSpfResolver):
+    '''
+    Resolves using dnspython, querying each of `nameservers` individually to
+    keep a slow or lossy one from stalling validation. If the first hasn't
+    answered once `hedge_percentile` of recent queries would have, the query
+    is also sent to the next and whichever answers first wins. Nameservers
+    that fail are immediately failed over from and those that fail
+    `failure_threshold` times in a row are sidelined for `cooldown` seconds.
+
+    nameservers: list of nameserver IP addresses, in order of preference, at
+        least 2
+    timeout: seconds to wait on each nameserver's answer
+    hedge_percentile: the percentile of recent query latencies after which a
+        query is hedged
+    hedge_delay: seconds after which queries are hedged until enough latencies
+        have been seen to compute the percentile
+    failure_threshold: consecutive failures after which a nameserver is
+        sidelined
+    cooldown: seconds a sidelined nameserver is skipped before being tried
+        again
+    '''
+
+    # Latencies needed before the percentile is trusted and the most that are
+    # kept, the most recent
+    MIN_SAMPLES = 20
+    MAX_SAMPLES = 1000
+
+    log = getLogger('HedgedResolver')
+
+    def __init__(
+        self,
+        nameservers,
+        timeout=2,
+        hedge_percentile=95,
+        hedge_delay=0.1,
+        failure_threshold=3,
+        cooldown=30,
+    ):
+        self.log.debug(
+            '__init__: nameservers=%s, timeout=%s, hedge_percentile=%s, hedge_delay=%s, failure_threshold=%d, cooldown=%s',
+            nameservers,
+            timeout,
+            hedge_percentile,
+            hedge_delay,
+            failure_threshold,
+            cooldown,
+        )
+        if len(nameservers) < 2:
+            raise ProcessorException(
+                'HedgedResolver requires at least 2 nameservers'
+            )
+        if not 0 < hedge_percentile < 100:
+            raise ProcessorException(
+                f'Invalid hedge_percentile {hedge_percentile}, must be between 0 and 100'
+            )
+        self.nameservers = list(nameservers)
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._resolvers = {}
+        for nameserver in self.nameservers:
+            resolver = dns.asyncresolver.Resolver(configure=False)
+            resolver.nameservers = [nameserver]
+            resolver.lifetime = timeout
+            self._resolvers[nameserver] = resolver
+
+        self._lock = Lock()
+        # nameserver -> consecutive failures
+        self._failures = {n: 0 for n in self.nameservers}
+        # nameserver -> when it's no longer sidelined
+        self._sidelined = {n: 0 for n in self.nameservers}
+        self._latencies = deque(maxlen=self.MAX_SAMPLES)
+        self.queries = 0
+        self.hedged = 0
+        self.failovers = 0
+        # runs the queries of synchronous callers, started when first needed
+        self._loop = None
+        self._loop_thread = None
+
+    def _percentile(self, latencies, percentile):
+        index = int(len(latencies) * percentile / 100)
+        return sorted(latencies)[min(index, len(latencies) - 1)]
+
+    def _hedge_after(self):
+        with self._lock:
+            if len(self._latencies) < self.MIN_SAMPLES:
+                return self.hedge_delay
+            return self._percentile(self._latencies, self.hedge_percentile)
+
+    def _available(self):
+        now = monotonic()
+        with self._lock:
+            available = [
+                n for n in self.nameservers if self._sidelined[n] <= now
+            ]
+        # if everything's sidelined there's nothing to lose by trying
+        return available or list(self.nameservers)
+
+    def _succeeded(self, nameserver):
+        with self._lock:
+            self._failures[nameserver] = 0
+
+    def _failed(self, nameserver, error):
+        with self._lock:
+            self._failures[nameserver] += 1
+            if self._failures[nameserver] < self.failure_threshold:
+                return
+            self._sidelined[nameserver] = monotonic() + self.cooldown
+        self.log.warning(
+            '_failed: sidelining %s for %ss, %s',
+            nameserver,
+            self.cooldown,
+            error,
+        )
+
+    async def _query(self, nameserver, name, rdtype):
+        try:
+            answer = await self._resolvers[nameserver].resolve(name, rdtype)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            # the nameserver answered, there's just nothing there
+            self._succeeded(nameserver)
+            raise
+        except dns.exception.DNSException as e:
+            self._failed(nameserver, e)
+            raise
+        self._succeeded(nameserver)
+        return answer
+
+    def _sync_loop(self):
+        # A single event loop, in a thread of its own, shared by every
+        # synchronous caller so that queries don't pay to set one up and tear
+        # it down and callers that are themselves within a running loop work
+        with self._lock:
+            if self._loop is None:
+                self._loop = new_event_loop()
+                self._loop_thread = Thread(
+                    target=self._loop.run_forever,
+                    name='HedgedResolver',
+                    daemon=True,
+                )
+                self._loop_thread.start()
+            return self._loop
+
+    def resolve(self, name, rdtype):
+        return run_coroutine_threadsafe(
+            self.resolve_async(name, rdtype), self._sync_loop()
+        ).result()
+
+    def close(self):
+        '''
+        Stops the event loop used by `resolve`, if it was started.
+        '''
+        with self._lock:
+            loop, self._loop = self._loop, None
+            thread, self._loop_thread = self._loop_thread, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    async def resolve_async(self, name, rdtype):
+        start = monotonic()
+        remaining = self._available()
+        with self._lock:
+            self.queries += 1
+
+        pending = set()
+
+        def launch():
+            nameserver = remaining.pop(0)
+            pending.add(ensure_future(self._query(nameserver, name, rdtype)))
+
+        launch()
+        error = None
+        try:
+            while pending:
+                done, pending = await wait(
+                    pending,
+                    timeout=self._hedge_after() if remaining else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    # too slow, hedge with the next nameserver
+                    with self._lock:
+                        self.hedged += 1
+                    launch()
+                    continue
+                for task in done:
+                    try:
+                        answer = task.result()
+                    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                        self._record(start)
+                        raise
+                    except dns.exception.DNSException as e:
+                        error = e
+                        if remaining:
+                            with self._lock:
+                                self.failovers += 1
+                            launch()
+                        continue
+                    self._record(start)
+                    return answer
+            raise error
+        finally:
+            # whatever's left lost the race
+            for task in pending:
+                task.cancel()
+
+    def _record(self, start):
+        with self._lock:
+            self._latencies.append(monotonic() - start)
+
+    def stats(self):
+        now = monotonic()
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                'queries': self.queries,
+                'hedged': self.hedged,
+                'failovers': self.failovers,
+                'sidelined': sum(
+                    1 for t in self._sidelined.values() if t > now
+                ),
+            }
+        for percentile in (50, 95, 99):
+            stats[f'latency_p{percentile}'] = (
+                self._percentile(latencies, percentile) if latencies else None
+            )
+        return stats
+
+
+class _FixtureAnswer(object):
+    def __init__(self, rrset):
+        self.rrset = rrset
+
+    def __iter__(self):
+        return iter(self.rrset)
+
+
+class FixtureResolver(BaseSpfResolver):
+    '''
+    Answers from a YAML, or JSON, file rather than the network, for offline
+    validation, testing, and benchmarking. The file maps names to either a list
+    of TXT values or to a mapping of record type to values, e.g.
+
+      _spf.example.com:
+        - v=spf1 include:_netblocks.example.com -all
+      example.com:
+        TXT:
+          - v=spf1 mx -all
+        MX:
+          - 10 mx1.example.com.
+
+    Names that aren't present raise `NXDOMAIN` and types that aren't present
+    raise `NoAnswer`.
+
+    path: the file to load
+    ttl: the TTL of every answer
+    '''
+
+    DEFAULT_TTL = 3600
+
+    log = getLogger('FixtureResolver')
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.log.debug('__init__: path=%s, ttl=%d', path, ttl)
+        self.path = path
+        self.ttl = ttl
+        with open(path) as fh:
+            data = safe_load(fh, enforce_order=False) or {}
+
+        self.records = {}
+        for name, values in data.items():
+            if not isinstance(values, dict):
+                values = {'TXT': values}
+            self.records[self._normalize(name)] = {
+                rdtype.upper(): v for rdtype, v in values.items()
+            }
+
+    def _normalize(self, name):
+        return name.lower().rstrip('.')
+
+    def _rdata(self, rdtype, value):
+        if rdtype == 'TXT':
+            # long values are split into multiple 255 byte strings just as
+            # they would be when served
+            value = value.encode()
+            strings = [value[i : i + 255] for i in range(0, len(value), 255)]
+            return TXT(dns.rdataclass.IN, dns.rdatatype.TXT, strings or [b''])
+        return dns.rdata.from_text(dns.rdataclass.IN, rdtype, value)
+
+    def resolve(self, name, rdtype):
+        try:
+            records = self.records[self._normalize(name)]
+        except KeyError:
+            raise dns.resolver.NXDOMAIN(qnames=[dns.name.from_text(name)])
+        values = records.get(rdtype)
+        if not values:
+            raise dns.resolver.NoAnswer()
+
+        rrset = dns.rrset.from_rdata_list(
+            name, self.ttl, [self._rdata(rdtype, v) for v in values]
+        )
+        return _FixtureAnswer(rrset)
@@ -3,67 +3,61 @@
 #
 
 from io import StringIO
+from ipaddress import collapse_addresses, ip_network
 from logging import getLogger
 
-from octodns.record import Record, RecordException
+from octodns.record import Record
 from octodns.source.base import BaseSource
 
+from .policy import SpfException, parse_spf
 from .processor import SpfDnsLookupProcessor
 
 
-class SpfException(RecordException):
-    def __init__(self, msg, record=None):
-        context = getattr(record, 'context', None)
-        if context:
-            msg += f', from {context}'
-        super().__init__(msg)
-        self.record = record
-
-
 def _parse_spf(value):
-    a_records = []
-    mx_records = []
-    ip4_addresses = []
-    ip6_addresses = []
-    includes = []
-    exists = []
-    soft_fail = None
-
-    pieces = value.split()
-    if pieces[0] != 'v=spf1':
-        raise SpfException(f'Unrecognized SPF value: "{value}"')
-
-    for piece in pieces[1:]:
-        if 'all' in piece:
-            soft_fail = piece.startswith('~')
-            continue
-        mechinism, v = piece.split(':', 1)
-        if mechinism == 'a':
-            a_records.append(v)
-        elif mechinism == 'mx':
-            mx_records.append(v)
-        elif mechinism == 'ip4':
-            ip4_addresses.append(v)
-        elif mechinism == 'ip6':
-            ip6_addresses.append(v)
-        elif mechinism == 'include':
-            includes.append(v)
-        elif mechinism == 'exists':
-            exists.append(v)
-        else:
-            raise SpfException(f'Unrecognized SPF mechinism: "{mechinism}"')
+    policy = parse_spf(value)
+    if policy.unrecognized is not None:
+        raise SpfException(
+            f'Unrecognized SPF mechinism: "{policy.unrecognized}"'
+        )
+    if policy.unsupported is not None:
+        raise SpfException(f'Unsupported SPF term: "{policy.unsupported}"')
 
+    # copies, the policy is shared
     return (
-        a_records,
-        mx_records,
-        ip4_addresses,
-        ip6_addresses,
-        includes,
-        exists,
-        soft_fail,
+        list(policy.a_records),
+        list(policy.mx_records),
+        list(policy.ip4_addresses),
+        list(policy.ip6_addresses),
+        list(policy.includes),
+        list(policy.exists),
+        policy.soft_fail,
     )
 
 
+def _aggregate_addresses(addresses, version):
+    '''
+    Normalizes, de-overlaps, and collapses `addresses` into the smallest
+    equivalent set of networks, returned in address order. Single hosts are
+    written without a prefix length.
+    '''
+    networks = []
+    for address in addresses:
+        try:
+            # SPF ignores host bits, e.g. 10.0.0.5/24 is 10.0.0.0/24
+            network = ip_network(address, strict=False)
+        except ValueError:
+            network = None
+        if network is None or network.version != version:
+            raise SpfException(f'Invalid ip{version} address: "{address}"')
+        networks.append(network)
+
+    for network in collapse_addresses(networks):
+        if network.prefixlen == network.max_prefixlen:
+            yield str(network.network_address)
+        else:
+            yield network.with_prefixlen
+
+
 def _build_spf(
     a_records,
     mx_records,
@@ -72,16 +66,28 @@ def _build_spf(
     includes,
     exists,
     soft_fail,
+    aggregate_addresses=False,
+    modifiers=(),
 ):
+    if aggregate_addresses:
+        ip4_addresses = _aggregate_addresses(ip4_addresses, 4)
+        ip6_addresses = _aggregate_addresses(ip6_addresses, 6)
+
     buf = StringIO()
     buf.write('v=spf1')
     if a_records:
         for a_record in a_records:
-            buf.write(' a:')
+            buf.write(' a')
+            # bare, the current domain, and its optional cidr lengths don't
+            # take a :
+            if a_record and a_record[0] != '/':
+                buf.write(':')
             buf.write(a_record)
     if mx_records:
         for mx_record in mx_records:
-            buf.write(' mx:')
+            buf.write(' mx')
+            if mx_record and mx_record[0] != '/':
+                buf.write(':')
             buf.write(mx_record)
     if ip4_addresses:
         for ip4_address in ip4_addresses:
@@ -104,6 +110,8 @@ def _build_spf(
             buf.write(' ~all')
         else:
             buf.write(' -all')
+    for name, value in modifiers:
+        buf.write(f' {name}={value}')
     return buf.getvalue()
 
 
@@ -119,6 +127,85 @@ def _merge_and_dedup_preserving_order(a, b):
         seen.add(x)
 
 
+def _layout_spf(value, domain, max_length):
+    '''
+    Splits `value` so that it's no longer than `max_length` bytes by moving
+    `ip4:` and `ip6:` mechanisms into a chain of generated values, the first
+    included by `value` and each including the next. Returns the value along
+    with a list of (label, value) for the generated values, which are to be
+    published at `<label>.<domain>`. Each generated value costs an additional
+    DNS lookup.
+    '''
+    if len(value) <= max_length:
+        return value, []
+
+    def link(n):
+        return f'include:_spf{n}.{domain}'
+
+    policy = parse_spf(value)
+    if policy.unrecognized is not None:
+        # we'd lose it
+        raise SpfException(
+            f'Unrecognized SPF mechinism: "{policy.unrecognized}"'
+        )
+    terms = [t.text for t in policy.terms]
+    movable = [
+        i
+        for i, t in enumerate(policy.terms)
+        if t.mechanism in ('ip4', 'ip6') and t.qualifier == '+'
+    ]
+    # everything that stays put along with the start of the chain
+    size = len('v=spf1') + sum(len(t) + 1 for t in terms) + len(link(1)) + 1
+    size -= sum(len(terms[i]) + 1 for i in movable)
+    if size > max_length:
+        raise SpfException(
+            f'Unable to fit SPF value within {max_length} bytes: "{value}"'
+        )
+
+    # keep as many as fit, in order, spill the rest
+    spilled = []
+    for i in movable:
+        if not spilled and size + len(terms[i]) + 1 <= max_length:
+            size += len(terms[i]) + 1
+        else:
+            spilled.append(i)
+
+    remaining = [terms[i] for i in spilled]
+    left = len('v=spf1') + sum(len(t) + 1 for t in remaining)
+    chunks = []
+    start = 0
+    while left > max_length:
+        # not everything fits, leave room to link to the next
+        chunk = ['v=spf1']
+        size = len('v=spf1') + len(link(len(chunks) + 2)) + 1
+        while size + len(remaining[start]) + 1 <= max_length:
+            size += len(remaining[start]) + 1
+            left -= len(remaining[start]) + 1
+            chunk.append(remaining[start])
+            start += 1
+        if len(chunk) == 1:
+            raise SpfException(
+                f'Unable to fit "{remaining[start]}" within {max_length} bytes'
+            )
+        chunk.append(link(len(chunks) + 2))
+        chunks.append(' '.join(chunk))
+    chunks.append(' '.join(['v=spf1'] + remaining[start:]))
+
+    # the chain takes the place of the first spilled mechanism
+    first = spilled[0]
+    spilled = set(spilled)
+    laid_out = ['v=spf1']
+    for i, term in enumerate(terms):
+        if i == first:
+            laid_out.append(link(1))
+        if i not in spilled:
+            laid_out.append(term)
+
+    return ' '.join(laid_out), [
+        (f'_spf{i}', chunk) for i, chunk in enumerate(chunks, 1)
+    ]
+
+
 def _merge_spf(
     value,
     a_records,
@@ -128,6 +215,7 @@ def _merge_spf(
     includes,
     exists,
     soft_fail,
+    aggregate_addresses=False,
 ):
     (
         parsed_a_records,
@@ -138,10 +226,13 @@ def _merge_spf(
         parsed_exists,
         parsed_soft_fail,
     ) = _parse_spf(value)
+    modifiers = parse_spf(value).modifiers
 
     if parsed_soft_fail is None:
-        # just use whatever we were passed
-        parsed_soft_fail = soft_fail
+        # just use whatever we were passed, unless there's a redirect which an
+        # all would take precedence over
+        if not any(name == 'redirect' for name, _ in modifiers):
+            parsed_soft_fail = soft_fail
     else:
         # merge them, if either is true (soft) it's soft
         parsed_soft_fail |= soft_fail
@@ -154,6 +245,8 @@ def _merge_spf(
         _merge_and_dedup_preserving_order(parsed_includes, includes),
         _merge_and_dedup_preserving_order(parsed_exists, exists),
         parsed_soft_fail,
+        aggregate_addresses=aggregate_addresses,
+        modifiers=modifiers,
     )
 
 
@@ -178,10 +271,12 @@ class SpfSource(BaseSource):
         merging_enabled=False,
         ttl=DEFAULT_TTL,
         verify_dns_lookups=False,
+        aggregate_addresses=False,
+        max_length=None,
     ):
         self.log = getLogger(f'SpfSource[{id}]')
         self.log.info(
-            '__init__: id=%s, a_records=%s, mx_records=%s, ip4_addresses=%s, ip6_addresses=%s, includes=%s, exists=%s, soft_fail=%s, merging_enabled=%s, ttl=%d, verify_dns_lookups=%s',
+            '__init__: id=%s, a_records=%s, mx_records=%s, ip4_addresses=%s, ip6_addresses=%s, includes=%s, exists=%s, soft_fail=%s, merging_enabled=%s, ttl=%d, verify_dns_lookups=%s, aggregate_addresses=%s, max_length=%s',
             id,
             a_records,
             mx_records,
@@ -193,6 +288,8 @@ class SpfSource(BaseSource):
             merging_enabled,
             ttl,
             verify_dns_lookups,
+            aggregate_addresses,
+            max_length,
         )
         super().__init__(id)
         self.a_records = a_records
@@ -206,6 +303,9 @@ class SpfSource(BaseSource):
 
         self.merging_enabled = merging_enabled
         self.ttl = ttl
+        self.aggregate_addresses = aggregate_addresses
+        self.max_length = max_length
+        self.verify_dns_lookups = verify_dns_lookups
 
         self.spf_value = _build_spf(
             a_records,
@@ -215,6 +315,7 @@ class SpfSource(BaseSource):
             includes,
             exists,
             soft_fail,
+            aggregate_addresses=aggregate_addresses,
         )
         self.log.debug('__init__:   spf=%s', self.spf_value)
 
@@ -223,6 +324,40 @@ class SpfSource(BaseSource):
                 f'<{self.id}>', [self.spf_value]
             )
 
+    def _layout(self, zone, value, lenient):
+        if self.max_length is None:
+            return value
+
+        laid_out, generated = _layout_spf(
+            value, zone.name[:-1], self.max_length
+        )
+        if not generated:
+            return value
+
+        self.log.info(
+            'populate:   value is %d bytes, split into %d values',
+            len(value),
+            len(generated) + 1,
+        )
+        if self.verify_dns_lookups:
+            # the generated values only hold addresses, they cost the include
+            # of each and nothing more
+            SpfDnsLookupProcessor(self.id).check_dns_lookups(
+                f'<{self.id}>', [value], lookups=len(generated)
+            )
+        existing = {r.name for r in zone.records if r._type == 'TXT'}
+        for name, v in generated:
+            record = Record.new(
+                zone, name, {'ttl': self.ttl, 'type': 'TXT', 'value': v}
+            )
+            if name in existing:
+                raise SpfException(
+                    f'{record.fqdn} already has a TXT record, it can\'t hold a generated SPF value',
+                    record,
+                )
+            zone.add_record(record, lenient=lenient)
+        return laid_out
+
     def list_zones(self):
         # we're a specialized provider and never originate any zones ourselves.
         return []
@@ -265,7 +400,9 @@ class SpfSource(BaseSource):
                     self.includes,
                     self.exists,
                     self.soft_fail,
+                    aggregate_addresses=self.aggregate_addresses,
                 )
+                merged = self._layout(zone, merged, lenient)
                 self.log.info(
                     'population:   existing value for zone=%s, merging with configured and replacing record',
                     zone.decoded_name,
@@ -279,16 +416,17 @@ class SpfSource(BaseSource):
                 )
                 record = txt.copy()
                 # add a new value
-                record.values.append(self.spf_value)
+                record.values.append(
+                    self._layout(zone, self.spf_value, lenient)
+                )
                 # and make sure they're sorted to match Record behavior
                 record.values.sort()
             # replace with our updated version
             zone.add_record(record, lenient=lenient, replace=True)
         else:
+            value = self._layout(zone, self.spf_value, lenient)
             record = Record.new(
-                zone,
-                '',
-                {'ttl': self.ttl, 'type': 'TXT', 'value': self.spf_value},
+                zone, '', {'ttl': self.ttl, 'type': 'TXT', 'value': value}
             )
             zone.add_record(record, lenient=lenient)
 
@@ -0,0 +1,174 @@
+#
+#
+#
+
+from bisect import bisect_left
+from os import replace
+from threading import Lock
+
+
+class SpfHistogram(object):
+    '''
+    Distribution of observed values, counted in cumulative `buckets` as
+    Prometheus does, along with their count, sum, and maximum.
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # the last is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+
+class SpfStats(object):
+    '''
+    Counters and histograms describing the work a SpfDnsLookupProcessor has
+    done, safe to update from multiple threads.
+
+    Counters:
+      queries: DNS queries issued
+      cache_hits: answers, or non-existence, served from the cache
+      cache_misses: answers that weren't in the cache, neither it nor hits are
+        counted without one
+      coalesced: queries that joined an identical one already in flight
+      refreshed: stale cache entries refreshed in the background
+      validated: unique SPF values validated
+      reused: records whose SPF value had already been validated
+      skipped: SPF values unchanged since they were last validated
+
+    Histograms:
+      query_seconds: how long each DNS query took
+      record_lookups: the DNS lookups each validated SPF value requires
+    '''
+
+    COUNTERS = {
+        'queries': 'DNS queries issued',
+        'cache_hits': 'Answers served from the cache',
+        'cache_misses': 'Answers that were not in the cache',
+        'coalesced': 'Queries that joined an identical one in flight',
+        'refreshed': 'Stale cache entries refreshed in the background',
+        'validated': 'Unique SPF values validated',
+        'reused': 'Records whose SPF value had already been validated',
+        'skipped': 'SPF values unchanged since they were last validated',
+    }
+    HISTOGRAMS = {
+        'query_seconds': (
+            'How long each DNS query took',
+            (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+        ),
+        'record_lookups': (
+            'DNS lookups required by each validated SPF value',
+            tuple(range(11)),
+        ),
+    }
+
+    def __init__(self):
+        self._lock = Lock()
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self.histograms = {
+            name: SpfHistogram(buckets)
+            for name, (_, buckets) in self.HISTOGRAMS.items()
+        }
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def summary(self):
+        '''
+        Returns a one line, human readable, summary.
+        '''
+        with self._lock:
+            counters = dict(self.counters)
+            queries = self.histograms['query_seconds']
+            lookups = self.histograms['record_lookups']
+            query_mean, query_max = queries.mean, queries.max
+            lookups_mean, lookups_max = lookups.mean, lookups.max
+
+        parts = [f'{k}={v}' for k, v in counters.items()]
+        if query_mean is not None:
+            parts.append(
+                f'query_seconds mean={query_mean:.3f} max={query_max:.3f}'
+            )
+        if lookups_mean is not None:
+            parts.append(
+                f'record_lookups mean={lookups_mean:.1f} max={lookups_max}'
+            )
+        return ', '.join(parts)
+
+    def prometheus(self, labels=None):
+        '''
+        Returns the stats in the Prometheus text exposition format, metric
+        names prefixed with `octodns_spf_`.
+        '''
+
+        def fmt(extra=None):
+            pairs = dict(labels or {})
+            pairs.update(extra or {})
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs.items()) + '}'
+
+        lines = []
+        with self._lock:
+            for name, description in self.COUNTERS.items():
+                metric = f'octodns_spf_{name}_total'
+                lines.extend(
+                    (
+                        f'# HELP {metric} {description}',
+                        f'# TYPE {metric} counter',
+                        f'{metric}{fmt()} {self.counters[name]}',
+                    )
+                )
+            for name, (description, _) in self.HISTOGRAMS.items():
+                histogram = self.histograms[name]
+                metric = f'octodns_spf_{name}'
+                lines.extend(
+                    (
+                        f'# HELP {metric} {description}',
+                        f'# TYPE {metric} histogram',
+                    )
+                )
+                cumulative = 0
+                for le, count in zip(
+                    histogram.buckets + ('+Inf',), histogram.counts
+                ):
+                    cumulative += count
+                    lines.append(
+                        f'{metric}_bucket{fmt({"le": le})} {cumulative}'
+                    )
+                lines.extend(
+                    (
+                        f'{metric}_sum{fmt()} {histogram.sum}',
+                        f'{metric}_count{fmt()} {histogram.count}',
+                    )
+                )
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, labels=None):
+        '''
+        Writes `prometheus` to `path`, replacing it atomically so that
+        collectors, e.g. node_exporter's textfile collector, never see a
+        partial file.
+        '''
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as fh:
+            fh.write(self.prometheus(labels))
+        replace(tmp, path)
@@ -0,0 +1,140 @@
+#
+#
+#
+
+import asyncio
+from logging import getLogger
+from threading import Condition, Lock
+from time import monotonic, sleep
+
+
+class SpfThrottle(object):
+    '''
+    Limits the DNS queries made by SpfDnsLookupProcessor, a token bucket
+    allowing `qps` queries per second, with bursts of up to a second's worth,
+    and a cap of `max_in_flight` queries outstanding at once. Either may be
+    None for no limit.
+
+    A single process-wide instance is available via `shared` so that the
+    limits apply to everything a run does, regardless of how many processors
+    or workers are making queries. `waited` is the total number of seconds
+    callers have spent throttled.
+    '''
+
+    # Seconds between checks for a free in-flight slot by async callers,
+    # they can't block their event loop waiting on one
+    POLL_INTERVAL = 0.005
+
+    log = getLogger('SpfThrottle')
+
+    _shared = None
+    _shared_lock = Lock()
+
+    @classmethod
+    def shared(cls, qps=None, max_in_flight=None):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(qps, max_in_flight)
+            else:
+                # the most restrictive limits win
+                cls._shared._tighten(qps, max_in_flight)
+            return cls._shared
+
+    def __init__(self, qps=None, max_in_flight=None):
+        self.log.debug('__init__: qps=%s, max_in_flight=%s', qps, max_in_flight)
+        self.qps = qps
+        self.max_in_flight = max_in_flight
+        self.waited = 0
+        self.throttled = 0
+        self._lock = Lock()
+        self._tokens = self._burst()
+        self._updated = monotonic()
+        self._in_flight = 0
+        self._condition = Condition()
+
+    def _burst(self):
+        return max(1.0, self.qps or 0)
+
+    def _tighten(self, qps, max_in_flight):
+        with self._lock:
+            if qps is not None and (self.qps is None or qps < self.qps):
+                self.qps = qps
+                self._tokens = min(self._tokens, self._burst())
+        with self._condition:
+            if max_in_flight is not None and (
+                self.max_in_flight is None or max_in_flight < self.max_in_flight
+            ):
+                self.max_in_flight = max_in_flight
+
+    def _reserve(self):
+        '''
+        Takes a token, returning the number of seconds to wait until it's
+        actually available.
+        '''
+        with self._lock:
+            if self.qps is None:
+                return 0
+            now = monotonic()
+            self._tokens = min(
+                self._burst(), self._tokens + (now - self._updated) * self.qps
+            )
+            self._updated = now
+            # tokens may go negative, later callers queue up behind earlier
+            # ones
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.qps
+
+    def _enter(self, blocking):
+        with self._condition:
+            while (
+                self.max_in_flight is not None
+                and self._in_flight >= self.max_in_flight
+            ):
+                if not blocking:
+                    return False
+                self._condition.wait()
+            self._in_flight += 1
+            return True
+
+    def _record(self, waited):
+        if waited > 0:
+            with self._lock:
+                self.waited += waited
+                self.throttled += 1
+        return waited
+
+    def acquire(self):
+        '''
+        Blocks until a query may be made, returning the seconds spent waiting.
+        Each acquire must be paired with a `release` once the query completes.
+        '''
+        start = monotonic()
+        wait = self._reserve()
+        if wait > 0:
+            sleep(wait)
+        throttled = wait > 0
+        if not self._enter(False):
+            throttled = True
+            self._enter(True)
+        return self._record(monotonic() - start if throttled else 0)
+
+    async def acquire_async(self):
+        '''
+        `acquire` for asyncio callers, waits without blocking the event loop.
+        '''
+        start = monotonic()
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        throttled = wait > 0
+        while not self._enter(False):
+            throttled = True
+            await asyncio.sleep(self.POLL_INTERVAL)
+        return self._record(monotonic() - start if throttled else 0)
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
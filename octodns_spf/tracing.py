@@ -0,0 +1,108 @@
+#
+#
+#
+
+from json import dumps
+from logging import getLogger
+from threading import Lock
+from time import monotonic, time
+from uuid import uuid4
+
+
+class BaseSpfSpanSink(object):
+    '''
+    Receives the spans of SpfDnsLookupProcessor validations as they finish.
+    Sinks must be safe to call from multiple threads.
+    '''
+
+    def emit(self, span):
+        '''
+        `span` is a dict with `trace_id`, `span_id`, `parent_id`, `name`,
+        `domain`, `depth`, `start`, a timestamp, and `duration`, in seconds,
+        along with `lookups`, `cache`, and `error` when they apply. `cache` is
+        where the answer came from, `hit`, `miss`, `prefetched`, `zone`, or
+        `cost` when a previously walked target's cost was used.
+        '''
+        raise NotImplementedError(
+            f'{self.__class__.__name__} must implement emit'
+        )
+
+
+class JsonLinesSpanSink(BaseSpfSpanSink):
+    '''
+    Appends each span to `path` as a line of JSON.
+    '''
+
+    log = getLogger('JsonLinesSpanSink')
+
+    def __init__(self, path):
+        self.log.debug('__init__: path=%s', path)
+        self.path = path
+        self._lock = Lock()
+        # line buffered so that spans are on disk as they finish
+        self._fh = open(path, 'a', buffering=1)
+
+    def emit(self, span):
+        line = dumps(span)
+        with self._lock:
+            self._fh.write(f'{line}\n')
+
+    def close(self):
+        self._fh.close()
+
+
+class SpfSpan(object):
+    __slots__ = (
+        'trace_id',
+        'span_id',
+        'parent_id',
+        'name',
+        'domain',
+        'depth',
+        'start',
+        'started',
+        'attrs',
+    )
+
+    def __init__(self, trace_id, parent_id, name, domain, depth):
+        self.trace_id = trace_id
+        self.span_id = uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.domain = domain
+        self.depth = depth
+        self.start = time()
+        self.started = monotonic()
+        # set as they're known, included when the span finishes
+        self.attrs = {}
+
+
+class SpfTracer(object):
+    '''
+    Times the parts of a validation, a `record` span for each and `include`
+    and `redirect` spans, nested within it, for each target walked, handing
+    them to `sink` as they finish.
+    '''
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def start(self, name, domain, depth=0, parent=None):
+        if parent is None:
+            return SpfSpan(uuid4().hex, None, name, domain, depth)
+        return SpfSpan(parent.trace_id, parent.span_id, name, domain, depth)
+
+    def finish(self, span, **attrs):
+        data = {
+            'trace_id': span.trace_id,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'name': span.name,
+            'domain': span.domain,
+            'depth': span.depth,
+            'start': span.start,
+            'duration': monotonic() - span.started,
+        }
+        data.update(span.attrs)
+        data.update(attrs)
+        self.sink.emit(data)
@@ -0,0 +1,193 @@
+#
+#
+#
+
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from octodns_spf.cache import SpfResolutionCache, SpfSqliteCache
+
+
+class TestSpfResolutionCache(TestCase):
+    def setUp(self):
+        SpfResolutionCache._shared = None
+
+    def tearDown(self):
+        SpfResolutionCache._shared = None
+
+    @patch('octodns_spf.cache.time')
+    def test_get_set_expire(self, time_mock):
+        cache = SpfResolutionCache()
+        time_mock.return_value = 1000
+
+        self.assertIsNone(cache.get('TXT', 'unit.tests'))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+        cache.set('TXT', 'unit.tests', ['v=spf1 -all'], 60)
+        self.assertEqual(
+            (['v=spf1 -all'], 1060), cache.get('TXT', 'unit.tests')
+        )
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        # kind is part of the key
+        self.assertIsNone(cache.get('MX', 'unit.tests'))
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+        # still there just before expiring
+        time_mock.return_value = 1059
+        self.assertEqual(
+            (['v=spf1 -all'], 1060), cache.get('TXT', 'unit.tests')
+        )
+
+        # stale entries are returned within a grace period, but kept
+        time_mock.return_value = 1070
+        self.assertEqual(
+            (['v=spf1 -all'], 1060), cache.get('TXT', 'unit.tests', grace=30)
+        )
+        self.assertIsNone(cache.get('TXT', 'unit.tests', grace=10))
+        self.assertEqual(1, len(cache))
+        self.assertEqual((3, 3), (cache.hits, cache.misses))
+
+        # gone once the ttl has elapsed
+        time_mock.return_value = 1060
+        self.assertIsNone(cache.get('TXT', 'unit.tests'))
+        self.assertEqual(0, len(cache))
+        self.assertEqual((3, 4), (cache.hits, cache.misses))
+
+        # a zero ttl isn't stored
+        cache.set('TXT', 'unit.tests', ['v=spf1 -all'], 0)
+        self.assertEqual(0, len(cache))
+
+        cache.clear()
+        self.assertEqual((0, 0), (cache.hits, cache.misses))
+
+    @patch('octodns_spf.cache.time')
+    def test_lru_eviction(self, time_mock):
+        time_mock.return_value = 1000
+        cache = SpfResolutionCache(max_size=2)
+        cache.set('TXT', 'a', ['a'], 60)
+        cache.set('TXT', 'b', ['b'], 60)
+        # touch a so that b is the least recently used
+        self.assertEqual((['a'], 1060), cache.get('TXT', 'a'))
+        cache.set('TXT', 'c', ['c'], 60)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('TXT', 'b'))
+        self.assertEqual((['a'], 1060), cache.get('TXT', 'a'))
+        self.assertEqual((['c'], 1060), cache.get('TXT', 'c'))
+
+        # re-setting an existing key refreshes it rather than growing
+        cache.set('TXT', 'a', ['A'], 60)
+        self.assertEqual(2, len(cache))
+        self.assertEqual((['A'], 1060), cache.get('TXT', 'a'))
+
+    def test_shared(self):
+        shared = SpfResolutionCache.shared(max_size=10)
+        self.assertEqual(10, shared.max_size)
+        self.assertIs(shared, SpfResolutionCache.shared(max_size=5))
+        # smaller requests don't shrink it
+        self.assertEqual(10, shared.max_size)
+        # larger ones grow it
+        self.assertIs(shared, SpfResolutionCache.shared(max_size=20))
+        self.assertEqual(20, shared.max_size)
+
+
+class TestSpfSqliteCache(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = join(self.tmpdir.name, 'spf.db')
+
+    def tearDown(self):
+        for cache in SpfSqliteCache._shared.values():
+            cache.close()
+        SpfSqliteCache._shared = {}
+        self.tmpdir.cleanup()
+
+    @patch('octodns_spf.cache.time')
+    def test_get_set_expire(self, time_mock):
+        time_mock.return_value = 1000
+        cache = SpfSqliteCache(self.path, max_stale=300)
+
+        self.assertIsNone(cache.get('TXT', 'unit.tests'))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+        cache.set('TXT', 'unit.tests', ['v=spf1 -all'], 60)
+        cache.set('cost', 'unit.tests', 3, 60)
+        self.assertEqual(
+            (['v=spf1 -all'], 1060), cache.get('TXT', 'unit.tests')
+        )
+        self.assertEqual((3, 1060), cache.get('cost', 'unit.tests'))
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+        self.assertEqual(2, len(cache))
+
+        # ttls are capped at max_stale
+        cache.set('TXT', 'long.tests', ['v=spf1 a -all'], 86400)
+        self.assertEqual(
+            (['v=spf1 a -all'], 1300), cache.get('TXT', 'long.tests')
+        )
+
+        # nothing to keep
+        cache.set('TXT', 'zero.tests', ['v=spf1 -all'], 0)
+        self.assertIsNone(cache.get('TXT', 'zero.tests'))
+
+        # expired entries are ignored
+        time_mock.return_value = 1060
+        self.assertIsNone(cache.get('TXT', 'unit.tests'))
+        # unless they're within the grace period
+        self.assertEqual(
+            (['v=spf1 -all'], 1060), cache.get('TXT', 'unit.tests', grace=5)
+        )
+
+        # and overwritten
+        cache.set('TXT', 'unit.tests', ['v=spf1 mx -all'], 60)
+        self.assertEqual(
+            (['v=spf1 mx -all'], 1120), cache.get('TXT', 'unit.tests')
+        )
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual((0, 0), (cache.hits, cache.misses))
+        cache.close()
+
+    def test_persistence(self):
+        cache = SpfSqliteCache(self.path)
+        cache.set('TXT', 'unit.tests', ['v=spf1 -all'], 60)
+        cache.close()
+
+        # a later run, or another process, sees what was written
+        cache = SpfSqliteCache(self.path)
+        other = SpfSqliteCache(self.path)
+        self.assertEqual(['v=spf1 -all'], cache.get('TXT', 'unit.tests')[0])
+        other.set('TXT', 'other.tests', ['v=spf1 a -all'], 60)
+        self.assertEqual(['v=spf1 a -all'], cache.get('TXT', 'other.tests')[0])
+        (mode,) = cache._conn.execute('PRAGMA journal_mode').fetchone()
+        self.assertEqual('wal', mode)
+        cache.close()
+        other.close()
+
+    def test_shared(self):
+        shared = SpfSqliteCache.shared(self.path, max_stale=300)
+        self.assertEqual(300, shared.max_stale)
+        self.assertIs(shared, SpfSqliteCache.shared(self.path, max_stale=300))
+        # others share the connection, but cap what they write at their own
+        # max_stale
+        longer = SpfSqliteCache.shared(self.path, max_stale=600)
+        self.assertIsNot(shared, longer)
+        self.assertIs(shared._conn, longer._conn)
+        self.assertEqual((300, 600), (shared.max_stale, longer.max_stale))
+        self.assertIs(longer, SpfSqliteCache.shared(self.path, max_stale=600))
+        now = time()
+        shared.set('TXT', 'short.tests', ['v=spf1 -all'], 3600)
+        longer.set('TXT', 'long.tests', ['v=spf1 -all'], 3600)
+        self.assertAlmostEqual(
+            now + 300, longer.get('TXT', 'short.tests')[1], delta=5
+        )
+        self.assertAlmostEqual(
+            now + 600, shared.get('TXT', 'long.tests')[1], delta=5
+        )
+        self.assertEqual((1, 0), (shared.hits, shared.misses))
+        self.assertEqual((1, 0), (longer.hits, longer.misses))
+        # a different path is a different cache
+        other = SpfSqliteCache.shared(join(self.tmpdir.name, 'other.db'))
+        self.assertIsNot(shared, other)
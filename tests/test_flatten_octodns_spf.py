@@ -0,0 +1,550 @@
+#
+#
+#
+
+from json import loads
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from dns.resolver import LifetimeTimeout
+
+from octodns.record import Record
+from octodns.zone import Zone
+
+from octodns_spf import SpfFlatteningProcessor
+from octodns_spf.processor import SpfDnsLookupException, SpfValueException
+
+FIXTURE = '''---
+provider.example.com:
+  - v=spf1 ip4:10.0.0.0/24 include:_nb.provider.example.com ~all
+_nb.provider.example.com:
+  - v=spf1 ip4:10.0.1.0/24 ip6:2001:db8::/32 ip4:10.0.0.0/24 -all
+hosts.example.com:
+  - v=spf1 a:mail.example.com mx:example.com -all
+exists.example.com:
+  - v=spf1 exists:%{i}.spf.example.com -all
+static-exists.example.com:
+  - v=spf1 exists:spf.example.com -all
+macro.example.com:
+  - v=spf1 include:%{d}.example.com -all
+redirect.example.com:
+  - v=spf1 redirect=provider.example.com
+pass.example.com:
+  - v=spf1 ip4:10.9.9.9 all
+bare.example.com:
+  - v=spf1 mx -all
+nested-bad.example.com:
+  - v=spf1 ip4:10.1.1.1 include:exists.example.com -all
+loop-a.example.com:
+  - v=spf1 include:loop-b.example.com -all
+loop-b.example.com:
+  - v=spf1 include:loop-a.example.com -all
+none.example.com:
+  - not-spf
+bogus.example.com:
+  - v=spf1 ip4:10.7.0.300 -all
+adjacent.example.com:
+  - v=spf1 ip4:10.0.1.0/24 ip4:10.0.0.0/25 ip4:10.0.0.128/25 -all
+big.example.com:
+  - v=spf1 ip4:10.4.0.1 ip4:10.4.0.2 ip4:10.4.0.3 ip4:10.4.0.4 ip4:10.4.0.5 ip4:10.4.0.6 -all
+tiny.example.com:
+  - v=spf1 ip4:10.5.0.1 -all
+chain.example.com:
+  - v=spf1 ip4:10.6.0.1 include:_c1.chain.example.com -all
+_c1.chain.example.com:
+  - v=spf1 ip4:10.6.0.2 include:_c2.chain.example.com -all
+_c2.chain.example.com:
+  - v=spf1 -all
+mail.example.com:
+  A:
+    - 10.2.0.1
+  AAAA:
+    - 2001:db8::25
+mx1.example.com:
+  A:
+    - 10.3.0.1
+example.com:
+  MX:
+    - 10 mx1.example.com.
+    - 20 mail.example.com.
+'''
+
+
+class TestSpfFlatteningProcessor(TestCase):
+    def setUp(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = join(tmpdir.name, 'fixture.yaml')
+        with open(self.path, 'w') as fh:
+            fh.write(FIXTURE)
+
+    def processor(self, **kwargs):
+        return SpfFlatteningProcessor(
+            'flatten',
+            resolver={
+                'class': 'octodns_spf.resolver.FixtureResolver',
+                'path': self.path,
+            },
+            **kwargs,
+        )
+
+    def test_flatten_includes(self):
+        processor = self.processor()
+        self.assertFalse(processor.flatten_a_mx)
+
+        # nested includes are flattened and their addresses de-duplicated
+        self.assertEqual(
+            'v=spf1 ip4:10.1.0.0/16 ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip6:2001:db8::/32 -all',
+            processor.flatten(
+                'v=spf1 ip4:10.1.0.0/16 include:provider.example.com -all'
+            ),
+        )
+
+        # things that can't be flattened are left as includes
+        for include in (
+            'exists.example.com',
+            'static-exists.example.com',
+            'macro.example.com',
+            'redirect.example.com',
+            'pass.example.com',
+            'bare.example.com',
+            'nested-bad.example.com',
+            'loop-a.example.com',
+            'none.example.com',
+            'missing.example.com',
+            # a & mx aren't flattened unless enabled
+            'hosts.example.com',
+        ):
+            value = f'v=spf1 include:{include} ~all'
+            self.assertEqual(value, processor.flatten(value))
+
+        # as are those nested too deeply
+        value = 'v=spf1 include:chain.example.com -all'
+        self.assertEqual(value, self.processor(max_depth=2).flatten(value))
+        self.assertEqual(
+            'v=spf1 ip4:10.6.0.1 ip4:10.6.0.2 -all',
+            self.processor(max_depth=3).flatten(value),
+        )
+
+        # a mix of flattenable and not
+        self.assertEqual(
+            'v=spf1 a:mail.example.com ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip6:2001:db8::/32 include:exists.example.com ~all',
+            processor.flatten(
+                'v=spf1 a:mail.example.com include:exists.example.com include:provider.example.com ~all'
+            ),
+        )
+
+        # values it doesn't understand are left alone
+        for value in (
+            'v=spf1 ?all',
+            'v=spf1 -include:provider.example.com',
+            'v=spf1 a/24 -all',
+            'v=spf1 unknown:thing -all',
+            # a bare qualifier isn't mistaken for an understood value
+            'v=spf1 - include:provider.example.com -all',
+            'v=spf1 include: -all',
+        ):
+            self.assertEqual(value, processor.flatten(value))
+        # explicit passes are the same as the default
+        self.assertEqual(
+            'v=spf1 ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip6:2001:db8::/32',
+            processor.flatten('v=spf1 +include:provider.example.com'),
+        )
+        # a & mx of the current domain, or with cidr lengths, that aren't
+        # being flattened are left as they are alongside those that are
+        self.assertEqual(
+            'v=spf1 a/24 mx ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip6:2001:db8::/32 ~all',
+            processor.flatten(
+                'v=spf1 a/24 mx include:provider.example.com ~all'
+            ),
+        )
+
+    def test_aggregate_addresses(self):
+        processor = self.processor(aggregate_addresses=True)
+        self.assertEqual(
+            'v=spf1 ip4:10.0.0.0/23 ip6:2001:db8::/32 -all',
+            processor.flatten(
+                'v=spf1 include:provider.example.com include:adjacent.example.com -all'
+            ),
+        )
+        # addresses that can't be aggregated leave the value alone
+        value = 'v=spf1 include:bogus.example.com -all'
+        with self.assertLogs('SpfFlatteningProcessor', level='WARNING') as logs:
+            self.assertEqual(value, processor.flatten(value))
+        self.assertEqual(
+            [
+                f'WARNING:SpfFlatteningProcessor:flatten: unable to flatten "{value}", Invalid ip4 address: "10.7.0.300"'
+            ],
+            logs.output,
+        )
+        # without aggregation they're passed along as-is
+        self.assertEqual(
+            'v=spf1 ip4:10.7.0.300 -all', self.processor().flatten(value)
+        )
+
+    def test_flatten_a_mx(self):
+        processor = self.processor(flatten_a_mx=True)
+
+        self.assertEqual(
+            'v=spf1 ip4:10.2.0.1 ip4:10.3.0.1 ip6:2001:db8::25 -all',
+            processor.flatten('v=spf1 include:hosts.example.com -all'),
+        )
+        self.assertEqual(
+            'v=spf1 ip4:10.2.0.1 ip4:10.3.0.1 ip6:2001:db8::25 -all',
+            processor.flatten('v=spf1 a:mail.example.com mx:example.com -all'),
+        )
+        # those of the current domain, or with cidr lengths, aren't
+        self.assertEqual(
+            'v=spf1 a mx:example.com/24 ip4:10.2.0.1 ip6:2001:db8::25 -all',
+            processor.flatten(
+                'v=spf1 a a:mail.example.com mx:example.com/24 -all'
+            ),
+        )
+        # nor are includes with them
+        self.assertEqual(
+            'v=spf1 include:bare.example.com -all',
+            processor.flatten('v=spf1 include:bare.example.com -all'),
+        )
+        # names without addresses contribute nothing
+        self.assertEqual(
+            'v=spf1 -all', processor.flatten('v=spf1 a:example.com -all')
+        )
+        # ones that don't exist are left alone
+        self.assertEqual(
+            'v=spf1 a:missing.example.com mx:missing.example.com -all',
+            processor.flatten(
+                'v=spf1 a:missing.example.com mx:missing.example.com -all'
+            ),
+        )
+        # and a failure nested in an include leaves it alone
+        with patch.object(
+            processor.resolver,
+            'resolve',
+            side_effect=[
+                processor.resolver.resolve('hosts.example.com', 'TXT'),
+                LifetimeTimeout(timeout=1.0, errors=[]),
+            ],
+        ):
+            self.assertEqual(
+                'v=spf1 include:hosts.example.com -all',
+                processor.flatten('v=spf1 include:hosts.example.com -all'),
+            )
+
+    def test_process_source_zone(self):
+        processor = self.processor()
+
+        zone = Zone('unit.tests.', [])
+        apex = Record.new(
+            zone,
+            '',
+            {
+                'type': 'TXT',
+                'ttl': 3600,
+                'values': [
+                    'v=spf1 include:provider.example.com -all',
+                    'v=DMARC1\\; p=reject\\;',
+                ],
+            },
+        )
+        zone.add_record(apex)
+        unchanged = Record.new(
+            zone,
+            'unchanged',
+            {
+                'type': 'TXT',
+                'ttl': 3600,
+                'value': 'v=spf1 include:exists.example.com -all',
+            },
+        )
+        zone.add_record(unchanged)
+        lenient = Record.new(
+            zone,
+            'lenient',
+            {
+                'type': 'TXT',
+                'ttl': 3600,
+                'value': 'v=spf1 include:provider.example.com -all',
+                'octodns': {'lenient': True},
+            },
+        )
+        zone.add_record(lenient)
+        zone.add_record(
+            Record.new(
+                zone, 'other', {'type': 'TXT', 'ttl': 3600, 'value': 'not-spf'}
+            )
+        )
+        zone.add_record(
+            Record.new(
+                zone, 'a', {'type': 'A', 'ttl': 3600, 'value': '1.2.3.4'}
+            )
+        )
+
+        self.assertEqual(zone, processor.process_source_zone(zone, []))
+        records = {(r.name, r._type): r for r in zone.records}
+        self.assertEqual(
+            [
+                'v=DMARC1\\; p=reject\\;',
+                'v=spf1 ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip6:2001:db8::/32 -all',
+            ],
+            sorted(records[('', 'TXT')].values),
+        )
+        # the original wasn't modified
+        self.assertEqual(
+            'v=spf1 include:provider.example.com -all', apex.values[1]
+        )
+        self.assertIs(unchanged, records[('unchanged', 'TXT')])
+        self.assertIs(lenient, records[('lenient', 'TXT')])
+
+    def test_verify_dns_lookups(self):
+        processor = self.processor(verify_dns_lookups=True)
+
+        zone = Zone('unit.tests.', [])
+        zone.add_record(
+            Record.new(
+                zone,
+                '',
+                {
+                    'type': 'TXT',
+                    'ttl': 3600,
+                    'value': 'v=spf1 include:provider.example.com '
+                    + ' '.join(['a:mail.example.com'] * 10)
+                    + ' -all',
+                },
+            )
+        )
+        # flattening the include gets it under the limit
+        self.assertEqual(zone, processor.process_source_zone(zone, []))
+
+        zone.add_record(
+            Record.new(
+                zone,
+                'too-many',
+                {
+                    'type': 'TXT',
+                    'ttl': 3600,
+                    'value': 'v=spf1 include:exists.example.com '
+                    + ' '.join(['a:mail.example.com'] * 10)
+                    + ' -all',
+                },
+            )
+        )
+        with self.assertRaises(SpfDnsLookupException):
+            processor.process_source_zone(zone, [])
+
+    def test_selective(self):
+        processor = self.processor(selective=True)
+        self.assertEqual(10, processor.lookup_budget)
+
+        # within budget, nothing to do
+        value = 'v=spf1 include:big.example.com include:tiny.example.com -all'
+        self.assertEqual(value, processor.flatten(value))
+
+        fixed = ' '.join(['a:mail.example.com'] * 6)
+        # 6 + big (1) + tiny (1) + chain (3) = 11, only tiny is needed
+        value = f'v=spf1 {fixed} include:big.example.com include:tiny.example.com include:chain.example.com -all'
+        with self.assertLogs('SpfFlatteningProcessor', level='INFO') as logs:
+            flattened = processor.flatten(value)
+        self.assertEqual(
+            f'v=spf1 {fixed} ip4:10.5.0.1 include:big.example.com include:chain.example.com -all',
+            flattened,
+        )
+        self.assertEqual(
+            [
+                f'INFO:SpfFlatteningProcessor:flatten: chose include:tiny.example.com, saving 1 lookups, {len(value)} -> {len(flattened)} bytes'
+            ],
+            logs.output,
+        )
+
+        # with a tighter budget chain is needed to save 3, flattening tiny
+        # along with it makes for a shorter value
+        processor = self.processor(selective=True, lookup_budget=8)
+        self.assertEqual(
+            f'v=spf1 {fixed} ip4:10.5.0.1 ip4:10.6.0.1 ip4:10.6.0.2 include:big.example.com -all',
+            processor.flatten(value),
+        )
+
+        # greedy takes the most lookups per byte, tiny and then chain
+        processor.EXACT_MAX_CANDIDATES = 0
+        self.assertEqual(
+            f'v=spf1 {fixed} ip4:10.5.0.1 ip4:10.6.0.1 ip4:10.6.0.2 include:big.example.com -all',
+            processor.flatten(value),
+        )
+
+        # includes that can't be flattened count against the budget, exists
+        # is 2, missing blows it all on its own
+        processor = self.processor(selective=True, lookup_budget=8)
+        value = 'v=spf1 include:static-exists.example.com include:tiny.example.com include:chain.example.com include:big.example.com a:mail.example.com a:mail.example.com exists:mail.example.com -all'
+        self.assertEqual(
+            'v=spf1 a:mail.example.com a:mail.example.com ip4:10.5.0.1 ip4:10.6.0.1 ip4:10.6.0.2 include:static-exists.example.com include:big.example.com exists:mail.example.com -all',
+            processor.flatten(value),
+        )
+        value = (
+            'v=spf1 include:missing.example.com include:tiny.example.com -all'
+        )
+        with self.assertLogs('SpfFlatteningProcessor', level='WARNING') as logs:
+            self.assertEqual(
+                'v=spf1 ip4:10.5.0.1 include:missing.example.com -all',
+                processor.flatten(value),
+            )
+        self.assertIn(
+            'WARNING:SpfFlatteningProcessor:_select: flattening everything possible still needs 9 lookups, more than the budget of 8',
+            logs.output,
+        )
+
+        # a & mx are candidates when enabled
+        processor = self.processor(
+            selective=True, lookup_budget=1, flatten_a_mx=True
+        )
+        value = 'v=spf1 a:mail.example.com include:big.example.com -all'
+        self.assertEqual(
+            'v=spf1 ip4:10.2.0.1 ip6:2001:db8::25 include:big.example.com -all',
+            processor.flatten(value),
+        )
+        # greedy runs out of candidates when everything is needed
+        processor = self.processor(
+            selective=True, lookup_budget=0, flatten_a_mx=True
+        )
+        processor.EXACT_MAX_CANDIDATES = 0
+        self.assertEqual(
+            'v=spf1 ip4:10.2.0.1 ip4:10.4.0.1 ip4:10.4.0.2 ip4:10.4.0.3 ip4:10.4.0.4 ip4:10.4.0.5 ip4:10.4.0.6 ip6:2001:db8::25 -all',
+            processor.flatten(value),
+        )
+
+    def test_max_length(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        spans = join(tmpdir.name, 'spans.jsonl')
+        processor = self.processor(
+            max_length=120, verify_dns_lookups=True, tracing=spans
+        )
+        self.addCleanup(processor.tracer.sink.close)
+
+        zone = Zone('unit.tests.', [])
+        zone.add_record(
+            Record.new(
+                zone,
+                'mail',
+                {
+                    'type': 'TXT',
+                    'ttl': 42,
+                    'value': 'v=spf1 include:big.example.com include:provider.example.com -all',
+                },
+            )
+        )
+        # the generated values are answered from the zone when verifying
+        self.assertEqual(zone, processor.process_source_zone(zone, []))
+        records = {r.name: r for r in zone.records}
+        self.assertEqual(['_spf1.mail', 'mail'], sorted(records))
+        self.assertEqual(
+            'v=spf1 ip4:10.4.0.1 ip4:10.4.0.2 ip4:10.4.0.3 ip4:10.4.0.4 ip4:10.4.0.5 ip4:10.4.0.6 include:_spf1.mail.unit.tests -all',
+            records['mail'].values[0],
+        )
+        self.assertEqual(
+            'v=spf1 ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip6:2001:db8::/32',
+            records['_spf1.mail'].values[0],
+        )
+        self.assertEqual(42, records['_spf1.mail'].ttl)
+        self.assertEqual(
+            records['_spf1.mail'].values,
+            processor._zone_txt['_spf1.mail.unit.tests'],
+        )
+        with open(spans) as fh:
+            includes = {
+                s['domain']: s['cache']
+                for s in map(loads, fh)
+                if s['name'] == 'include'
+            }
+        self.assertEqual('zone', includes['_spf1.mail.unit.tests'])
+
+        # at the apex, untraced
+        processor = self.processor(max_length=120, verify_dns_lookups=True)
+        zone = Zone('unit.tests.', [])
+        zone.add_record(
+            Record.new(
+                zone,
+                '',
+                {
+                    'type': 'TXT',
+                    'ttl': 42,
+                    'value': 'v=spf1 include:big.example.com include:provider.example.com -all',
+                },
+            )
+        )
+        processor.process_source_zone(zone, [])
+        self.assertEqual(['', '_spf1'], sorted(r.name for r in zone.records))
+
+        # existing records aren't replaced by generated values
+        zone = Zone('unit.tests.', [])
+        for name, value in (
+            (
+                '',
+                'v=spf1 include:big.example.com include:provider.example.com -all',
+            ),
+            ('_spf1', 'verification-token'),
+        ):
+            zone.add_record(
+                Record.new(
+                    zone, name, {'type': 'TXT', 'ttl': 42, 'value': value}
+                )
+            )
+        with self.assertRaises(SpfValueException) as ctx:
+            processor.process_source_zone(zone, [])
+        self.assertEqual(
+            '_spf1.unit.tests. already has a TXT record, it can\'t hold a generated SPF value',
+            str(ctx.exception),
+        )
+        records = {r.name: r for r in zone.records}
+        self.assertEqual(['verification-token'], records['_spf1'].values)
+
+        # things that can't be split are an error
+        processor = self.processor(max_length=40)
+        zone = Zone('unit.tests.', [])
+        zone.add_record(
+            Record.new(
+                zone,
+                '',
+                {
+                    'type': 'TXT',
+                    'ttl': 42,
+                    'value': 'v=spf1 a:mail.example.com exists:mail.example.com -all',
+                },
+            )
+        )
+        for selective in (False, True):
+            processor.selective = selective
+            with self.assertRaises(SpfValueException) as ctx:
+                processor.process_source_zone(zone, [])
+            self.assertEqual(
+                'unit.tests.: Unable to fit SPF value within 40 bytes: "v=spf1 a:mail.example.com exists:mail.example.com -all"',
+                str(ctx.exception),
+            )
+
+    def test_max_length_selective(self):
+        fixed = ' '.join(['a:mail.example.com'] * 7)
+        value = f'v=spf1 {fixed} include:big.example.com include:chain.example.com -all'
+
+        # flattening chain is enough to fit within the budget, but the value
+        # is then too long and the include of a generated value would put it
+        # over, so big is flattened as well. At 190 bytes the first layout
+        # fails outright, at 193 it needs a generated value
+        for max_length in (193, 190):
+            zone = Zone('unit.tests.', [])
+            zone.add_record(
+                Record.new(zone, '', {'type': 'TXT', 'ttl': 42, 'value': value})
+            )
+            processor = self.processor(
+                selective=True, lookup_budget=8, max_length=max_length
+            )
+            processor.process_source_zone(zone, [])
+            records = {r.name: r for r in zone.records}
+            self.assertEqual(['', '_spf1'], sorted(records))
+            self.assertEqual(
+                f'v=spf1 {fixed} ip4:10.4.0.1 include:_spf1.unit.tests -all',
+                records[''].values[0],
+            )
+            self.assertEqual(
+                'v=spf1 ip4:10.4.0.2 ip4:10.4.0.3 ip4:10.4.0.4 ip4:10.4.0.5 ip4:10.4.0.6 ip4:10.6.0.1 ip4:10.6.0.2',
+                records['_spf1'].values[0],
+            )
@@ -0,0 +1,97 @@
+#
+#
+#
+
+from datetime import datetime, timezone
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from octodns.processor.base import ProcessorException
+
+from octodns_spf.known import SpfKnownIncludes
+
+
+class TestSpfKnownIncludes(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, content):
+        path = join(self.tmpdir.name, 'known.yaml')
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def test_shipped(self):
+        known = SpfKnownIncludes()
+        # none of the shipped costs have been verified
+        self.assertEqual((3, None), known.get('_spf.google.com'))
+        self.assertEqual(
+            {None}, {verified for _, verified in known.includes.values()}
+        )
+        # case and trailing dots don't matter
+        self.assertEqual(
+            known.get('_spf.google.com'), known.get('_SPF.Google.com.')
+        )
+        self.assertIsNone(known.get('unknown.unit.tests'))
+
+    def test_overrides(self):
+        path = self.write('''---
+version: 1
+includes:
+  _spf.google.com:
+    cost: 4
+    verified: 2026-10-02
+  spf.unit.tests.:
+    cost: 0
+    verified: '2026-10-03'
+  unverified.unit.tests:
+    cost: 2
+''')
+        known = SpfKnownIncludes(path)
+        self.assertEqual(
+            (4, datetime(2026, 10, 2, tzinfo=timezone.utc).timestamp()),
+            known.get('_spf.google.com'),
+        )
+        self.assertEqual(
+            (0, datetime(2026, 10, 3, tzinfo=timezone.utc).timestamp()),
+            known.get('spf.unit.tests'),
+        )
+        self.assertEqual((2, None), known.get('unverified.unit.tests'))
+        # the rest of the shipped table is still there
+        self.assertEqual(1, known.get('spf.protection.outlook.com')[0])
+
+        # a table with nothing in it is fine
+        path = self.write('---\nversion: 1\n')
+        self.assertEqual(3, SpfKnownIncludes(path).get('_spf.google.com')[0])
+
+    def test_errors(self):
+        for content, msg in (
+            ('', 'unsupported known includes version None, must be 1'),
+            ('version: 2\n', 'unsupported known includes version 2, must be 1'),
+            (
+                'version: 1\nincludes:\n  a.unit.tests:\n    verified: 2026-10-01\n',
+                'a.unit.tests must have a cost and, if verified, a date',
+            ),
+            (
+                'version: 1\nincludes:\n  a.unit.tests: 1\n',
+                'a.unit.tests must have a cost and, if verified, a date',
+            ),
+            (
+                'version: 1\nincludes:\n  a.unit.tests:\n    cost: 1\n    verified: yesterday\n',
+                'a.unit.tests must have a cost and, if verified, a date',
+            ),
+            (
+                'version: 1\nincludes:\n  a.unit.tests:\n    cost: 11\n    verified: 2026-10-01\n',
+                'a.unit.tests has an invalid cost 11, must be 0-10',
+            ),
+            (
+                'version: 1\nincludes:\n  a.unit.tests:\n    cost: lots\n    verified: 2026-10-01\n',
+                'a.unit.tests has an invalid cost lots, must be 0-10',
+            ),
+        ):
+            path = self.write(content)
+            with self.assertRaises(ProcessorException) as ctx:
+                SpfKnownIncludes(path)
+            self.assertEqual(f'{path}: {msg}', str(ctx.exception))
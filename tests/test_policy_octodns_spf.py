@@ -0,0 +1,168 @@
+#
+#
+#
+
+from unittest import TestCase
+
+from octodns_spf.policy import SpfException, SpfPolicy, SpfTerm, parse_spf
+
+
+class TestSpfPolicy(TestCase):
+    def test_tokenize(self):
+        policy = SpfPolicy(
+            'V=SPF1 a +A:a.unit.tests/24 -mx ~mx/24//64 ?ip4:1.2.3.4 IP6:2606::1 include:small.unit.tests exists:%{i}.unit.tests ptr redirect=r.unit.tests exp=explain.unit.tests Unknown-Mod=thing ~all'
+        )
+        self.assertEqual(
+            (
+                SpfTerm('a', '+', 'a', None, ''),
+                SpfTerm(
+                    '+A:a.unit.tests/24', '+', 'a', None, 'a.unit.tests/24'
+                ),
+                SpfTerm('-mx', '-', 'mx', None, ''),
+                SpfTerm('~mx/24//64', '~', 'mx', None, '/24//64'),
+                SpfTerm('?ip4:1.2.3.4', '?', 'ip4', None, '1.2.3.4'),
+                SpfTerm('IP6:2606::1', '+', 'ip6', None, '2606::1'),
+                SpfTerm(
+                    'include:small.unit.tests',
+                    '+',
+                    'include',
+                    None,
+                    'small.unit.tests',
+                ),
+                SpfTerm(
+                    'exists:%{i}.unit.tests',
+                    '+',
+                    'exists',
+                    None,
+                    '%{i}.unit.tests',
+                ),
+                SpfTerm('ptr', '+', 'ptr', None, ''),
+                SpfTerm(
+                    'redirect=r.unit.tests',
+                    None,
+                    None,
+                    'redirect',
+                    'r.unit.tests',
+                ),
+                SpfTerm(
+                    'exp=explain.unit.tests',
+                    None,
+                    None,
+                    'exp',
+                    'explain.unit.tests',
+                ),
+                SpfTerm(
+                    'Unknown-Mod=thing', None, None, 'unknown-mod', 'thing'
+                ),
+                SpfTerm('~all', '~', 'all', None, ''),
+            ),
+            policy.terms,
+        )
+        # all isn't a substring match, a domain containing it is just a domain
+        self.assertEqual(('small.unit.tests',), policy.includes)
+        self.assertEqual(('', 'a.unit.tests/24'), policy.a_records)
+        # qualified mechanisms aren't managed
+        self.assertEqual((), policy.mx_records)
+        self.assertEqual((), policy.ip4_addresses)
+        self.assertEqual(('2606::1',), policy.ip6_addresses)
+        self.assertEqual(
+            (
+                ('redirect', 'r.unit.tests'),
+                ('exp', 'explain.unit.tests'),
+                ('unknown-mod', 'thing'),
+            ),
+            policy.modifiers,
+        )
+        self.assertTrue(policy.soft_fail)
+        self.assertEqual('-mx', policy.unsupported)
+        self.assertIsNone(policy.unrecognized)
+
+        # unknown mechanisms, qualified modifiers, modifiers without names,
+        # bare qualifiers, and missing domain-specs aren't valid, they're noted,
+        # as written, and left out
+        for value, unrecognized in (
+            ('v=spf1 unknown:thing -all', 'unknown:thing'),
+            ('v=spf1 unknown:thing other:thing -all', 'unknown:thing'),
+            ('v=spf1 ip5 -all', 'ip5'),
+            ('v=spf1 -redirect=unit.tests', '-redirect=unit.tests'),
+            ('v=spf1 =unit.tests', '=unit.tests'),
+            ('v=spf1 + -all', '+'),
+            ('v=spf1 - -all', '-'),
+            ('v=spf1 include: -all', 'include:'),
+            ('v=spf1 include -all', 'include'),
+            ('v=spf1 exists: -all', 'exists:'),
+            ('v=spf1 ip4 -all', 'ip4'),
+            ('v=spf1 -a:/24 -all', '-a:/24'),
+            ('v=spf1 redirect=', 'redirect='),
+            ('v=spf1 exp= -all', 'exp='),
+        ):
+            policy = SpfPolicy(value)
+            self.assertEqual(unrecognized, policy.unrecognized)
+            self.assertEqual(1 if '-all' in value else 0, len(policy.terms))
+
+        for value, unsupported in (
+            ('v=spf1 all', 'all'),
+            ('v=spf1 ?all', '?all'),
+            ('v=spf1 ptr:unit.tests -all', 'ptr:unit.tests'),
+            ('v=spf1 -include:unit.tests', '-include:unit.tests'),
+        ):
+            self.assertEqual(unsupported, SpfPolicy(value).unsupported)
+
+    def test_policy(self):
+        policy = SpfPolicy(
+            'v=spf1 a:a.unit.tests mx:mx.unit.tests  ip4:1.2.3.4 ip6:2606::1 include:include.unit.tests exists:%{i}.unit.tests ~all'
+        )
+        self.assertEqual(
+            [
+                'a:a.unit.tests',
+                'mx:mx.unit.tests',
+                'ip4:1.2.3.4',
+                'ip6:2606::1',
+                'include:include.unit.tests',
+                'exists:%{i}.unit.tests',
+                '~all',
+            ],
+            [t.text for t in policy.terms],
+        )
+        self.assertEqual(('a.unit.tests',), policy.a_records)
+        self.assertEqual(('mx.unit.tests',), policy.mx_records)
+        self.assertEqual(('1.2.3.4',), policy.ip4_addresses)
+        self.assertEqual(('2606::1',), policy.ip6_addresses)
+        self.assertEqual(('include.unit.tests',), policy.includes)
+        self.assertEqual(('%{i}.unit.tests',), policy.exists)
+        self.assertEqual((), policy.modifiers)
+        self.assertTrue(policy.soft_fail)
+        self.assertIsNone(policy.unrecognized)
+        self.assertIsNone(policy.unsupported)
+        self.assertEqual(
+            'SpfPolicy<v=spf1 a:a.unit.tests mx:mx.unit.tests  ip4:1.2.3.4 ip6:2606::1 include:include.unit.tests exists:%{i}.unit.tests ~all>',
+            repr(policy),
+        )
+
+        # compact, no per-instance dict
+        with self.assertRaises(AttributeError):
+            policy.other = 42
+
+        # domains are interned, shared between policies
+        other = SpfPolicy('v=spf1 include:include.unit' + '.tests -all')
+        self.assertIs(policy.includes[0], other.includes[0])
+        self.assertFalse(other.soft_fail)
+        self.assertIsNone(SpfPolicy('v=spf1').soft_fail)
+
+        for value in ('', 'hello world v=spf1 -all'):
+            with self.assertRaises(SpfException) as ctx:
+                SpfPolicy(value)
+            self.assertEqual(
+                f'Unrecognized SPF value: "{value}"', str(ctx.exception)
+            )
+
+    def test_parse_spf(self):
+        parse_spf.cache_clear()
+        value = 'v=spf1 include:parse.unit.tests -all'
+        policy = parse_spf(value)
+        # parsed once, shared after that
+        self.assertIs(policy, parse_spf(value))
+        self.assertIs(policy, parse_spf(value))
+        info = parse_spf.cache_info()
+        self.assertEqual((2, 1), (info.hits, info.misses))
+        self.assertEqual(4096, info.maxsize)
@@ -0,0 +1,212 @@
+#
+#
+#
+
+from io import StringIO
+from json import loads
+from logging import getLogger
+from os import makedirs
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from octodns.manager import Manager
+
+from octodns_spf.cache import SpfSqliteCache
+from octodns_spf.prefetch import collect, main, prefetch
+
+FIXTURES = '''---
+_spf.provider.tests:
+  - v=spf1 include:_nb.provider.tests -all
+_nb.provider.tests:
+  - v=spf1 ip4:10.0.0.0/24 -all
+other.provider.tests:
+  - v=spf1 ip4:10.1.0.0/24 -all
+ptr.provider.tests:
+  - v=spf1 ptr -all
+'''
+
+ZONE = '''---
+'':
+  type: TXT
+  value: v=spf1 include:_spf.provider.tests -all
+lenient:
+  octodns:
+    lenient: true
+  type: TXT
+  value: v=spf1 include:ignored.provider.tests -all
+not-spf:
+  type: TXT
+  value: hello world
+www:
+  type: A
+  value: 1.2.3.4
+'''
+
+CONFIG = '''---
+providers:
+  config:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {tmpdir}/zones
+    escaped_semicolons: false
+  spf:
+    class: octodns_spf.SpfSource
+    includes:
+      - other.provider.tests
+      - ptr.provider.tests
+processors:
+  spf:
+    class: octodns_spf.SpfDnsLookupProcessor
+    cache_path: {tmpdir}/spf.db
+    resolver:
+      class: octodns_spf.resolver.FixtureResolver
+      path: {tmpdir}/fixtures.yaml
+  memory:
+    class: octodns_spf.SpfDnsLookupProcessor
+    resolver:
+      class: octodns_spf.resolver.FixtureResolver
+      path: {tmpdir}/fixtures.yaml
+  other:
+    class: octodns.processor.ownership.OwnershipProcessor
+zones:
+  unit.tests.:
+    sources:
+      - config
+    processors:
+      - spf
+    targets:
+      - config
+  alias.tests.:
+    alias: unit.tests.
+  other.tests.:
+    sources:
+      - config
+    processors:
+      - other
+    targets:
+      - config
+'''
+
+
+class TestPrefetch(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        tmpdir = self.tmpdir.name
+
+        def cleanup():
+            for cache in SpfSqliteCache._shared.values():
+                cache.close()
+            SpfSqliteCache._shared = {}
+
+        self.addCleanup(cleanup)
+
+        makedirs(join(tmpdir, 'zones'))
+        for filename, content in (
+            ('zones/unit.tests.yaml', ZONE),
+            ('zones/other.tests.yaml', ZONE),
+            ('fixtures.yaml', FIXTURES),
+            ('config.yaml', CONFIG.format(tmpdir=tmpdir)),
+        ):
+            with open(join(tmpdir, filename), 'w') as fh:
+                fh.write(content)
+        self.config_file = join(tmpdir, 'config.yaml')
+
+    def test_collect(self):
+        manager = Manager(self.config_file)
+        work = {p.id: values for p, values in collect(manager).items()}
+        # source includes go to every processor, zone values only to the
+        # processors the zone uses
+        self.assertEqual(
+            {
+                'spf': {
+                    'v=spf1 include:other.provider.tests -all': '<spf>',
+                    'v=spf1 include:ptr.provider.tests -all': '<spf>',
+                    'v=spf1 include:_spf.provider.tests -all': 'unit.tests.',
+                },
+                'memory': {
+                    'v=spf1 include:other.provider.tests -all': '<spf>',
+                    'v=spf1 include:ptr.provider.tests -all': '<spf>',
+                },
+            },
+            work,
+        )
+
+    def test_prefetch(self):
+        manager = Manager(self.config_file)
+        with self.assertLogs('SpfPrefetch', level='WARNING') as logs:
+            summary = prefetch(manager, max_workers=2)
+        self.assertEqual(
+            [
+                'WARNING:SpfPrefetch:prefetch: processor memory has no cache_path, its cache will not outlive this process'
+            ],
+            logs.output,
+        )
+
+        self.assertEqual(5, summary['values'])
+        self.assertEqual(
+            {'spf': (3, 1), 'memory': (2, 1)},
+            {
+                k: (v['values'], v['failures'])
+                for k, v in summary['processors'].items()
+            },
+        )
+        # problems are reported, but don't stop the warming
+        self.assertEqual(
+            {
+                'fqdn': '<spf>',
+                'value': 'v=spf1 include:ptr.provider.tests -all',
+                'error': 'SpfValueException: <spf> uses the deprecated ptr mechanism',
+            },
+            summary['errors'][0],
+        )
+        self.assertEqual(
+            ['collect', 'warm', 'total'], list(summary['seconds'].keys())
+        )
+        self.assertEqual(['p50', 'p95', 'p99'], list(summary['latency']))
+        self.assertEqual(5, len(summary['slowest']))
+        self.assertGreaterEqual(
+            summary['slowest'][0]['seconds'], summary['slowest'][-1]['seconds']
+        )
+
+        # the persistent cache has been warmed, for the next run
+        cache = manager.processors['spf'].cache
+        for name in (
+            '_spf.provider.tests',
+            '_nb.provider.tests',
+            'other.provider.tests',
+        ):
+            self.assertIsNotNone(cache.get('TXT', name))
+        self.assertEqual(1, cache.get('cost', '_spf.provider.tests')[0])
+
+    def test_main(self):
+        # main configures logging, put things back the way they were
+        root = getLogger()
+        self.addCleanup(setattr, root, 'handlers', list(root.handlers))
+        self.addCleanup(root.setLevel, root.level)
+
+        with (
+            patch(
+                'sys.argv',
+                [
+                    'octodns-spf-prefetch',
+                    '--config-file',
+                    self.config_file,
+                    '--max-workers',
+                    '1',
+                ],
+            ),
+            patch('sys.stdout', new_callable=StringIO) as stdout,
+        ):
+            main()
+        summary = loads(stdout.getvalue())
+        self.assertEqual(5, summary['values'])
+
+        # nothing to do is fine too
+        with patch('octodns_spf.prefetch.collect', return_value={}):
+            summary = prefetch(Manager(self.config_file))
+        self.assertEqual(0, summary['values'])
+        self.assertEqual(
+            {'p50': None, 'p95': None, 'p99': None}, summary['latency']
+        )
@@ -1,11 +1,75 @@
+from asyncio import gather, run, sleep
+from datetime import date, timedelta
+from json import loads
+from math import inf
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import sleep as time_sleep
+from time import time
 from unittest import TestCase
-from unittest.mock import MagicMock, call, patch
+from unittest.mock import AsyncMock, MagicMock, call, patch
 
+from dns.resolver import NXDOMAIN, LifetimeTimeout, NoAnswer
+
+from octodns.processor.base import ProcessorException
+from octodns.provider.plan import Plan
+from octodns.record import Create, Delete, Update
 from octodns.record.base import Record
 from octodns.zone import Zone
 
-from octodns_spf import SpfDnsLookupProcessor
+from octodns_spf import SpfDnsLookupProcessor, SpfSource
+from octodns_spf.cache import SpfResolutionCache, SpfSqliteCache
 from octodns_spf.processor import SpfDnsLookupException, SpfValueException
+from octodns_spf.resolver import (
+    BaseSpfResolver,
+    DnsPythonResolver,
+    FixtureResolver,
+)
+from octodns_spf.throttle import SpfThrottle
+from octodns_spf.tracing import BaseSpfSpanSink, JsonLinesSpanSink
+
+
+def _answer(*texts, ttl=3600):
+    answer = MagicMock()
+    rdatas = []
+    for text in texts:
+        rdata = MagicMock()
+        rdata.to_text.return_value = text
+        rdatas.append(rdata)
+    answer.__iter__.return_value = rdatas
+    answer.rrset.ttl = ttl
+    return answer
+
+
+class _ListSink(BaseSpfSpanSink):
+    def __init__(self):
+        self.spans = []
+
+    def emit(self, span):
+        self.spans.append(span)
+
+
+class _GatedResolver(BaseSpfResolver):
+    # answers once released, counting the queries it receives
+    def __init__(self, answer):
+        self.answer = answer
+        self.released = Event()
+        self.calls = 0
+
+    def resolve(self, name, rdtype):
+        self.calls += 1
+        self.released.wait(5)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+    async def resolve_async(self, name, rdtype):
+        self.calls += 1
+        await sleep(0.01)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
 
 
 class TestSpfDnsLookupProcessor(TestCase):
@@ -101,6 +165,9 @@ class TestSpfDnsLookupProcessor(TestCase):
         )
 
         resolver_mock.reset_mock(return_value=True, side_effect=True)
+        # include costs are memoized per-processor, start fresh since the
+        # answers are changing
+        processor = SpfDnsLookupProcessor('test')
         txt_value_mock = MagicMock()
         txt_value_mock.to_text.return_value = '"v=spf1 -all"'
         resolver_mock.return_value = [txt_value_mock]
@@ -162,6 +229,9 @@ class TestSpfDnsLookupProcessor(TestCase):
         )
 
         resolver_mock.reset_mock(return_value=True, side_effect=True)
+        # include costs are memoized per-processor, start fresh since the
+        # answers are changing
+        processor = SpfDnsLookupProcessor('test')
         txt_value_mock = MagicMock()
         txt_value_mock.to_text.return_value = (
             '"v=spf1 a a a a a a a a a a a -all"'
@@ -189,6 +259,9 @@ class TestSpfDnsLookupProcessor(TestCase):
         )
 
         resolver_mock.reset_mock(return_value=True, side_effect=True)
+        # include costs are memoized per-processor, start fresh since the
+        # answers are changing
+        processor = SpfDnsLookupProcessor('test')
         txt_value_mock = MagicMock()
         txt_value_mock.to_text.return_value = (
             '"v=spf1 ip4:1.2.3.4" " ip4:4.3.2.1 -all"'
@@ -215,6 +288,9 @@ class TestSpfDnsLookupProcessor(TestCase):
         )
 
         resolver_mock.reset_mock(return_value=True, side_effect=True)
+        # include costs are memoized per-processor, start fresh since the
+        # answers are changing
+        processor = SpfDnsLookupProcessor('test')
         first_txt_value_mock = MagicMock()
         first_txt_value_mock.to_text.return_value = (
             '"v=spf1 include:_spf.example.com -all"'
@@ -300,6 +376,537 @@ class TestSpfDnsLookupProcessor(TestCase):
             processor.process_source_zone(zone)
         resolver_mock.assert_not_called()
 
+    @patch('dns.resolver.resolve')
+    def test_check_dns_lookups_terms(self, resolver_mock):
+        processor = SpfDnsLookupProcessor('test')
+        a10 = ' '.join(['a'] * 10)
+
+        # all doesn't cost a lookup, whatever its qualifier
+        for term in ('-all', '~all', '?all', '+all', 'all'):
+            self.assertEqual(
+                10,
+                processor.check_dns_lookups(
+                    'unit.tests.', [f'v=spf1 {a10} {term}']
+                ),
+            )
+        # nor do addresses or exp, redirect does, but it's ignored, and costs
+        # nothing, when there's an all, wherever it appears
+        self.assertEqual(
+            1,
+            processor.check_dns_lookups(
+                'unit.tests.',
+                [
+                    'v=spf1 ip4:1.2.3.4 ip6:2606::1 a:small.unit.tests exp=exp.unit.tests redirect=unit.tests -all'
+                ],
+            ),
+        )
+        self.assertEqual(
+            0,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 -all redirect=b.unit.tests']
+            ),
+        )
+        resolver_mock.assert_not_called()
+
+        # qualified mechanisms, and the includes among them, count the same
+        resolver_mock.return_value = _answer('"v=spf1 a -all"')
+        self.assertEqual(
+            5,
+            processor.check_dns_lookups(
+                'unit.tests.',
+                [
+                    'v=spf1 ?mx -a:a.unit.tests ~exists:e.unit.tests +include:unit.tests -all'
+                ],
+            ),
+        )
+        resolver_mock.assert_called_once_with('unit.tests', 'TXT')
+
+        # the limit applies after the last term as well
+        with self.assertRaises(SpfDnsLookupException):
+            processor.check_dns_lookups('unit.tests.', [f'v=spf1 {a10} a'])
+
+        # things that aren't mechanisms or modifiers are errors
+        with self.assertRaises(SpfValueException) as ctx:
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 unknown:thing -all']
+            )
+        self.assertEqual(
+            'unit.tests. has an unrecognized SPF term "unknown:thing"',
+            str(ctx.exception),
+        )
+
+    @patch('dns.resolver.resolve')
+    def test_check_dns_lookups_redirect(self, resolver_mock):
+        answers = {
+            'redirect.unit.tests': '"v=spf1 include:_spf.unit.tests -all"',
+            '_spf.unit.tests': '"v=spf1 a mx -all"',
+            'again.unit.tests': '"v=spf1 redirect=redirect.unit.tests"',
+        }
+
+        def resolve(domain, _type):
+            return _answer(answers[domain])
+
+        resolver_mock.side_effect = resolve
+
+        processor = SpfDnsLookupProcessor('test')
+        # redirect's target is walked & costed like an include
+        self.assertEqual(
+            4,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 redirect=redirect.unit.tests']
+            ),
+        )
+        self.assertEqual(3, processor._costs['redirect.unit.tests'][0])
+        self.assertEqual(
+            {'redirect.unit.tests': ['_spf.unit.tests'], '_spf.unit.tests': []},
+            processor.include_graph,
+        )
+
+        # chained redirects reuse the memoized cost
+        resolver_mock.reset_mock()
+        self.assertEqual(
+            6,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 a redirect=again.unit.tests']
+            ),
+        )
+        resolver_mock.assert_called_once_with('again.unit.tests', 'TXT')
+
+        # the async engine prefetches redirect targets too
+        processor = SpfDnsLookupProcessor('test', engine='async')
+        with patch(
+            'dns.asyncresolver.resolve', new_callable=AsyncMock
+        ) as async_resolver_mock:
+            async_resolver_mock.side_effect = resolve
+            resolver_mock.reset_mock()
+            self.assertEqual(
+                5,
+                processor.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 redirect=again.unit.tests']
+                ),
+            )
+        resolver_mock.assert_not_called()
+        self.assertEqual(3, async_resolver_mock.call_count)
+
+    @patch('dns.resolver.resolve')
+    def test_check_dns_lookups_resolve_mechanisms(self, resolver_mock):
+        answers = {
+            ('unit.tests', 'A'): _answer('1.2.3.4'),
+            ('unit.tests', 'MX'): _answer('10 mx.unit.tests.'),
+            ('v6.unit.tests', 'AAAA'): _answer('2606::1'),
+            ('empty.unit.tests', 'A'): _answer(),
+            ('many.unit.tests', 'MX'): _answer(
+                *[f'10 mx{i}.unit.tests.' for i in range(11)]
+            ),
+            ('one.unit.tests', 'TXT'): _answer(
+                '"v=spf1 a:nope.unit.tests -all"'
+            ),
+            ('void.unit.tests', 'TXT'): _answer(
+                '"v=spf1 a:nope.unit.tests mx:nope.unit.tests -all"'
+            ),
+        }
+
+        def resolve(domain, rdtype):
+            try:
+                return answers[(domain, rdtype)]
+            except KeyError:
+                if domain in ('unit.tests', 'v6.unit.tests'):
+                    raise NoAnswer()
+                raise NXDOMAIN()
+
+        resolver_mock.side_effect = resolve
+
+        # disabled by default, nothing but includes is resolved
+        processor = SpfDnsLookupProcessor('test')
+        self.assertEqual(
+            3,
+            processor.check_dns_lookups(
+                'unit.tests.',
+                [
+                    'v=spf1 a:nope.unit.tests mx:nope.unit.tests exists:nope -all'
+                ],
+            ),
+        )
+        resolver_mock.assert_not_called()
+
+        processor = SpfDnsLookupProcessor('test', resolve_mechanisms=True)
+        # bare a & mx use the record's domain, cidr lengths are ignored, AAAA
+        # is tried when there's no A, and macros are skipped
+        self.assertEqual(
+            5,
+            processor.check_dns_lookups(
+                'unit.tests.',
+                [
+                    'v=spf1 a/24 mx a:v6.unit.tests//64 exists:unit.tests exists:%{i}.nope -all'
+                ],
+            ),
+        )
+        resolver_mock.assert_has_calls(
+            [
+                call('unit.tests', 'A'),
+                call('unit.tests', 'MX'),
+                call('v6.unit.tests', 'A'),
+                call('v6.unit.tests', 'AAAA'),
+                call('unit.tests', 'A'),
+            ]
+        )
+        self.assertEqual(5, resolver_mock.call_count)
+
+        # without a domain, e.g. generated values, bare a & mx are skipped
+        resolver_mock.reset_mock()
+        self.assertEqual(
+            2, processor.check_dns_lookups('<spf>', ['v=spf1 a mx -all'])
+        )
+        resolver_mock.assert_not_called()
+
+        # two void lookups are allowed, nxdomain, no answer, or empty
+        self.assertEqual(
+            2,
+            processor.check_dns_lookups(
+                'unit.tests.',
+                ['v=spf1 a:nope.unit.tests exists:empty.unit.tests -all'],
+            ),
+        )
+        # a third isn't, they're counted across includes
+        for value in (
+            'v=spf1 a:nope.unit.tests a:empty.unit.tests mx:v6.unit.tests -all',
+            'v=spf1 exists:nope.unit.tests include:void.unit.tests -all',
+        ):
+            with self.assertRaises(SpfDnsLookupException) as ctx:
+                processor.check_dns_lookups('unit.tests.', [value])
+            self.assertEqual(
+                'unit.tests. exceeds the 2 void DNS lookup limit in the SPF record',
+                str(ctx.exception),
+            )
+        # includes with voids aren't memoized, they count every time
+        self.assertEqual(
+            2,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:one.unit.tests -all']
+            ),
+        )
+        self.assertNotIn('one.unit.tests', processor._costs)
+        self.assertNotIn('void.unit.tests', processor._costs)
+        with self.assertRaises(SpfDnsLookupException):
+            processor.check_dns_lookups(
+                'unit.tests.',
+                ['v=spf1 exists:nope.unit.tests include:void.unit.tests -all'],
+            )
+
+        # mx is limited to 10 hosts
+        with self.assertRaises(SpfValueException) as ctx:
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 mx:many.unit.tests -all']
+            )
+        self.assertEqual(
+            'unit.tests. mx:many.unit.tests has more than 10 MX hosts',
+            str(ctx.exception),
+        )
+
+        # records with bare a & mx are deduped per-fqdn since their results
+        # depend upon it
+        zone = Zone('unit.tests.', [])
+        for name in ('', 'v6'):
+            zone.add_record(
+                Record.new(
+                    zone,
+                    name,
+                    {'type': 'TXT', 'ttl': 60, 'values': ['v=spf1 a -all']},
+                )
+            )
+        processor.process_source_zone(zone)
+        self.assertEqual(2, processor.validated)
+
+    @patch('dns.resolver.resolve')
+    @patch('dns.asyncresolver.resolve', new_callable=AsyncMock)
+    def test_processor_negative_cache(self, async_resolver_mock, resolver_mock):
+        SpfResolutionCache._shared = None
+        self.addCleanup(setattr, SpfResolutionCache, '_shared', None)
+
+        resolver_mock.side_effect = NXDOMAIN()
+        async_resolver_mock.side_effect = NoAnswer()
+
+        values = ['v=spf1 include:dead.unit.tests -all']
+        processor = SpfDnsLookupProcessor('test')
+        for _ in range(2):
+            with self.assertRaises(NXDOMAIN):
+                processor.check_dns_lookups('unit.tests.', values)
+        # dead includes are only queried once
+        resolver_mock.assert_called_once_with('dead.unit.tests', 'TXT')
+
+        # until they expire
+        processor._voids[('TXT', 'dead.unit.tests')] = (NXDOMAIN, 0)
+        with self.assertRaises(NXDOMAIN):
+            processor.check_dns_lookups('unit.tests.', values)
+        self.assertEqual(2, resolver_mock.call_count)
+
+        # the async engine remembers them as well, and shares them through the
+        # cache with other processors
+        processor = SpfDnsLookupProcessor(
+            'test', engine='async', cache_enabled=True
+        )
+        for _ in range(2):
+            with self.assertRaises(NoAnswer):
+                processor.check_dns_lookups('unit.tests.', values)
+        async_resolver_mock.assert_called_once_with('dead.unit.tests', 'TXT')
+        self.assertEqual(
+            'NoAnswer', processor.cache.get('TXT', 'dead.unit.tests')[0]
+        )
+
+        other = SpfDnsLookupProcessor('other', cache_enabled=True)
+        resolver_mock.reset_mock()
+        for _ in range(2):
+            with self.assertRaises(NoAnswer):
+                other.check_dns_lookups('unit.tests.', values)
+        resolver_mock.assert_not_called()
+        self.assertIn(('TXT', 'dead.unit.tests'), other._voids)
+
+        # sync negatives are cached too
+        with self.assertRaises(NXDOMAIN):
+            other.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:gone.unit.tests -all']
+            )
+        self.assertEqual(
+            'NXDOMAIN', other.cache.get('TXT', 'gone.unit.tests')[0]
+        )
+
+    def test_processor_coalesces_queries(self):
+        def concurrently(processor, n, target):
+            results = []
+
+            def run_one():
+                try:
+                    results.append(target())
+                except Exception as e:
+                    results.append(e)
+
+            threads = [Thread(target=run_one) for _ in range(n)]
+            for thread in threads:
+                thread.start()
+            # wait for everyone else to join the leader's query
+            for _ in range(500):
+                if processor.coalesced == n - 1:
+                    break
+                time_sleep(0.01)
+            processor.resolver.released.set()
+            for thread in threads:
+                thread.join()
+            return results
+
+        resolver = _GatedResolver(_answer('"v=spf1 ip4:1.2.3.4 -all"'))
+        processor = SpfDnsLookupProcessor('test', resolver=resolver)
+        results = concurrently(
+            processor, 5, lambda: processor._resolve('outlook.unit.tests')
+        )
+        # a single query answered everyone
+        self.assertEqual(1, resolver.calls)
+        self.assertEqual(4, processor.coalesced)
+        self.assertEqual([(['v=spf1 ip4:1.2.3.4 -all'], inf)] * 5, results)
+        self.assertEqual({}, processor._inflight)
+
+        # failures are shared the same way
+        resolver = _GatedResolver(NXDOMAIN())
+        processor = SpfDnsLookupProcessor('test', resolver=resolver)
+        results = concurrently(
+            processor, 3, lambda: processor._resolve('dead.unit.tests')
+        )
+        self.assertEqual(1, resolver.calls)
+        self.assertEqual(3, len(results))
+        for result in results:
+            self.assertIsInstance(result, NXDOMAIN)
+        self.assertEqual({}, processor._inflight)
+
+        # as are async queries
+        resolver = _GatedResolver(_answer('"v=spf1 -all"'))
+        processor = SpfDnsLookupProcessor('test', resolver=resolver)
+
+        async def both():
+            return await gather(
+                processor._resolve_txt_async('async.unit.tests'),
+                processor._resolve_txt_async('async.unit.tests'),
+            )
+
+        self.assertEqual([(['v=spf1 -all'], inf)] * 2, run(both()))
+        self.assertEqual(1, resolver.calls)
+        self.assertEqual(1, processor.coalesced)
+
+        resolver = _GatedResolver(RuntimeError('boom'))
+        processor = SpfDnsLookupProcessor('test', resolver=resolver)
+        with self.assertRaises(RuntimeError):
+            run(processor._resolve_txt_async('boom.unit.tests'))
+        self.assertEqual({}, processor._inflight)
+
+    @patch('dns.resolver.resolve')
+    @patch('dns.asyncresolver.resolve', new_callable=AsyncMock)
+    def test_processor_throttle(self, async_resolver_mock, resolver_mock):
+        SpfThrottle._shared = None
+        self.addCleanup(setattr, SpfThrottle, '_shared', None)
+
+        for kwargs, msg in (
+            ({'max_qps': 0}, 'Invalid max_qps 0, must be greater than 0'),
+            (
+                {'max_in_flight': 0},
+                'Invalid max_in_flight 0, must be at least 1',
+            ),
+        ):
+            with self.assertRaises(ProcessorException) as ctx:
+                SpfDnsLookupProcessor('test', **kwargs)
+            self.assertEqual(msg, str(ctx.exception))
+
+        # disabled by default
+        self.assertIsNone(SpfDnsLookupProcessor('test').throttle)
+        self.assertIsNone(SpfThrottle._shared)
+
+        # every instance shares the same throttle
+        processor = SpfDnsLookupProcessor('test', max_qps=1000)
+        other = SpfDnsLookupProcessor('other', engine='async', max_in_flight=4)
+        self.assertIs(processor.throttle, other.throttle)
+        self.assertEqual(
+            (1000, 4),
+            (processor.throttle.qps, processor.throttle.max_in_flight),
+        )
+
+        # queries go through it and release their slots, whether or not they
+        # succeed
+        resolver_mock.side_effect = [
+            _answer('"v=spf1 include:dead.unit.tests -all"'),
+            NXDOMAIN(),
+        ]
+        async_resolver_mock.side_effect = [
+            _answer('"v=spf1 include:dead.unit.tests -all"'),
+            NXDOMAIN(),
+        ]
+        values = ['v=spf1 include:example.com -all']
+        for engine in (processor, other):
+            with self.assertRaises(NXDOMAIN):
+                engine.check_dns_lookups('unit.tests.', values)
+            self.assertEqual(0, engine.throttle._in_flight)
+
+        # time spent waiting is tracked and reported
+        processor.throttle_waited = 1.5
+        processor._throttled(0)
+        processor._throttled(0.25)
+        with self.assertLogs('SpfDnsLookupProcessor', level='INFO') as logs:
+            processor.process_source_zone(Zone('unit.tests.', []))
+        self.assertTrue(
+            logs.output[-1].startswith(
+                'INFO:SpfDnsLookupProcessor:process_source_zone:   run totals after unit.tests., queries='
+            )
+        )
+        self.assertTrue(logs.output[-1].endswith(', throttle_waited=1.750'))
+
+    def test_processor_resolver_stats(self):
+        resolver = _GatedResolver(None)
+        resolver.stats = lambda: {'queries': 3, 'latency_p99': 0.01234}
+        processor = SpfDnsLookupProcessor('test', resolver=resolver)
+        with self.assertLogs('SpfDnsLookupProcessor', level='INFO') as logs:
+            processor.process_source_zone(Zone('unit.tests.', []))
+        # the resolver's stats, e.g. tail latency, are included in the summary
+        self.assertEqual(
+            'INFO:SpfDnsLookupProcessor:process_source_zone:   run totals after unit.tests., queries=0, cache_hits=0, cache_misses=0, coalesced=0, refreshed=0, validated=0, reused=0, skipped=0, resolver_queries=3, resolver_latency_p99=0.012',
+            logs.output[-1],
+        )
+
+    @patch('dns.resolver.resolve')
+    def test_processor_stats(self, resolver_mock):
+        SpfResolutionCache._shared = None
+        self.addCleanup(setattr, SpfResolutionCache, '_shared', None)
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = join(tmpdir.name, 'spf.prom')
+
+        resolver_mock.side_effect = lambda domain, _type: (
+            _answer('"v=spf1 ip4:10.0.0.0/24 -all"')
+            if domain == 'a.unit.tests'
+            else _answer('"v=spf1 include:a.unit.tests -all"')
+        )
+        processor = SpfDnsLookupProcessor(
+            'test', cache_enabled=True, metrics_path=path
+        )
+
+        zone = Zone('unit.tests.', [])
+        for name, value in (
+            ('one', 'v=spf1 include:a.unit.tests -all'),
+            ('two', 'v=spf1 include:b.unit.tests -all'),
+            ('three', 'v=spf1 include:a.unit.tests  -all'),
+        ):
+            zone.add_record(
+                Record.new(
+                    zone, name, {'type': 'TXT', 'ttl': 3600, 'value': value}
+                )
+            )
+        with self.assertLogs('SpfDnsLookupProcessor', level='INFO') as logs:
+            processor.process_source_zone(zone)
+        # a.unit.tests is walked once, then its cost is known, b's walk
+        # queries b
+        stats = processor.stats
+        self.assertEqual(
+            {
+                'queries': 2,
+                'cache_hits': 0,
+                'cache_misses': 2,
+                'coalesced': 0,
+                'refreshed': 0,
+                'validated': 2,
+                'reused': 1,
+                'skipped': 0,
+            },
+            stats.counters,
+        )
+        self.assertEqual((2, 1), (processor.validated, processor.reused))
+        self.assertEqual(2, stats.histograms['query_seconds'].count)
+        lookups = stats.histograms['record_lookups']
+        self.assertEqual((2, 1 + 2), (lookups.count, lookups.sum))
+        self.assertTrue(
+            logs.output[0].startswith(
+                'INFO:SpfDnsLookupProcessor:process_source_zone:   run totals after unit.tests., queries=2, cache_hits=0, cache_misses=2, coalesced=0, refreshed=0, validated=2, reused=1, skipped=0, query_seconds '
+            )
+        )
+
+        # answers, and voids, served from the cache are hits
+        resolver_mock.side_effect = NXDOMAIN()
+        self.assertEqual(
+            ['v=spf1 ip4:10.0.0.0/24 -all'],
+            processor._resolve('a.unit.tests')[0],
+        )
+        for _ in range(2):
+            with self.assertRaises(NXDOMAIN):
+                processor.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 include:dead.unit.tests -all']
+                )
+        self.assertEqual(
+            (3, 3, 2),
+            (
+                stats.counters['queries'],
+                stats.counters['cache_misses'],
+                stats.counters['cache_hits'],
+            ),
+        )
+
+        # the metrics file has what there was after the zone
+        with open(path) as fh:
+            metrics = fh.read()
+        self.assertIn('octodns_spf_queries_total{processor="test"} 2', metrics)
+        self.assertIn(
+            'octodns_spf_record_lookups_count{processor="test"} 2', metrics
+        )
+
+        # without a cache there's nothing to hit or miss, voids included
+        processor = SpfDnsLookupProcessor('test')
+        for _ in range(2):
+            with self.assertRaises(NXDOMAIN):
+                processor.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 include:dead.unit.tests -all']
+                )
+        self.assertEqual(
+            (1, 0, 0),
+            (
+                processor.stats.counters['queries'],
+                processor.stats.counters['cache_misses'],
+                processor.stats.counters['cache_hits'],
+            ),
+        )
+
     @patch('dns.resolver.resolve')
     def test_processor_errors_ptr_mechanisms(self, resolver_mock):
         processor = SpfDnsLookupProcessor('test')
@@ -397,6 +1004,1303 @@ class TestSpfDnsLookupProcessor(TestCase):
         )
         resolver_mock.return_value = [txt_value_mock]
 
-        with self.assertRaises(SpfDnsLookupException):
+        with self.assertRaises(SpfDnsLookupException) as ctx:
             processor.process_source_zone(zone)
-        resolver_mock.assert_called_with('example.com', 'TXT')
+        self.assertEqual(
+            'unit.tests. has an include loop, example.com -> example.com',
+            str(ctx.exception),
+        )
+        # detected right away, not once the lookup limit is reached
+        resolver_mock.assert_called_once_with('example.com', 'TXT')
+
+    @patch('dns.resolver.resolve')
+    def test_processor_include_loops_and_depth(self, resolver_mock):
+        answers = {
+            'a.unit.tests': '"v=spf1 include:b.unit.tests -all"',
+            'b.unit.tests': '"v=spf1 include:c.unit.tests include:d.unit.tests -all"',
+            'c.unit.tests': '"v=spf1 ip4:1.2.3.4 -all"',
+            'd.unit.tests': '"v=spf1 redirect=a.unit.tests"',
+        }
+
+        def resolve(domain, _type):
+            return _answer(answers[domain])
+
+        resolver_mock.side_effect = resolve
+
+        with self.assertRaises(ProcessorException) as ctx:
+            SpfDnsLookupProcessor('test', max_depth=0)
+        self.assertEqual(
+            'Invalid max_depth 0, must be at least 1', str(ctx.exception)
+        )
+
+        processor = SpfDnsLookupProcessor('test')
+        self.assertEqual(10, processor.max_depth)
+        # redirects back to the top of the chain are loops too
+        with self.assertRaises(SpfDnsLookupException) as ctx:
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:a.unit.tests -all']
+            )
+        self.assertEqual(
+            'unit.tests. has an include loop, a.unit.tests -> b.unit.tests -> d.unit.tests -> a.unit.tests',
+            str(ctx.exception),
+        )
+        self.assertEqual(4, resolver_mock.call_count)
+
+        # siblings including the same domain aren't loops
+        answers['d.unit.tests'] = '"v=spf1 include:c.unit.tests -all"'
+        processor = SpfDnsLookupProcessor('test')
+        self.assertEqual(
+            5,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:a.unit.tests -all']
+            ),
+        )
+
+        # depth is limited
+        processor = SpfDnsLookupProcessor('test', max_depth=2)
+        self.assertEqual(
+            2,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:d.unit.tests -all']
+            ),
+        )
+        # memoized costs don't require walking, so a fresh processor
+        processor = SpfDnsLookupProcessor('test', max_depth=2)
+        with self.assertRaises(SpfDnsLookupException) as ctx:
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:a.unit.tests -all']
+            )
+        self.assertEqual(
+            'unit.tests. exceeds the maximum include depth of 2',
+            str(ctx.exception),
+        )
+
+    @patch('dns.resolver.resolve')
+    def test_processor_cache(self, resolver_mock):
+        SpfResolutionCache._shared = None
+        self.addCleanup(setattr, SpfResolutionCache, '_shared', None)
+
+        # disabled by default
+        self.assertIsNone(SpfDnsLookupProcessor('test').cache)
+
+        processor = SpfDnsLookupProcessor('test', cache_enabled=True)
+        other = SpfDnsLookupProcessor('other', cache_enabled=True)
+        # every instance shares the same cache
+        self.assertIs(processor.cache, other.cache)
+
+        resolver_mock.side_effect = [
+            _answer('"v=spf1 include:_spf.example.com -all"'),
+            _answer('"v=spf1 a -all"'),
+        ]
+        values = ['v=spf1 include:example.com -all']
+        self.assertEqual(3, processor.check_dns_lookups('unit.tests.', values))
+        resolver_mock.assert_has_calls(
+            [call('example.com', 'TXT'), call('_spf.example.com', 'TXT')]
+        )
+        # costs and TXT values for both includes
+        self.assertEqual(4, processor.cache.misses)
+
+        # the second walk, by another instance, is served from the cache
+        resolver_mock.reset_mock()
+        self.assertEqual(3, other.check_dns_lookups('other.tests.', values))
+        resolver_mock.assert_not_called()
+        # the cost of the include was remembered so its tree isn't re-walked
+        self.assertEqual(1, processor.cache.hits)
+
+        # a cached value without a cost is walked, but not resolved
+        processor.cache.set('TXT', 'txt.example.com', ['v=spf1 mx -all'], 60)
+        self.assertEqual(
+            2,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:txt.example.com -all']
+            ),
+        )
+        resolver_mock.assert_not_called()
+        self.assertEqual(1, processor.cache.get('cost', 'txt.example.com')[0])
+
+        # a cached cost that blows the limit errors right away
+        processor.cache.set('cost', 'big.example.com', 10, 60)
+        with self.assertRaises(SpfDnsLookupException):
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:big.example.com']
+            )
+        resolver_mock.assert_not_called()
+
+    @patch('dns.resolver.resolve')
+    def test_processor_stale_while_revalidate(self, resolver_mock):
+        SpfResolutionCache._shared = None
+        self.addCleanup(setattr, SpfResolutionCache, '_shared', None)
+
+        with self.assertRaises(ProcessorException) as ctx:
+            SpfDnsLookupProcessor('test', stale_grace=-1)
+        self.assertEqual(
+            'Invalid stale_grace -1, must be at least 0', str(ctx.exception)
+        )
+
+        processor = SpfDnsLookupProcessor(
+            'test', cache_enabled=True, stale_grace=300
+        )
+        cache = processor.cache
+        now = time()
+        # expired recently, within the grace period
+        cache._entries[('TXT', 'stale.unit.tests')] = (
+            ['v=spf1 a -all'],
+            now - 10,
+        )
+        cache._entries[('TXT', 'other.unit.tests')] = (
+            ['v=spf1 -all'],
+            now - 20,
+        )
+        # expired beyond it
+        cache._entries[('TXT', 'old.unit.tests')] = (
+            ['v=spf1 a -all'],
+            now - 600,
+        )
+
+        resolver_mock.return_value = _answer('"v=spf1 a mx -all"')
+        # the stale value is used right away, no blocking query
+        self.assertEqual(
+            3,
+            processor.check_dns_lookups(
+                'unit.tests.',
+                [
+                    'v=spf1 include:stale.unit.tests include:other.unit.tests -all'
+                ],
+            ),
+        )
+        # a stale value isn't a basis for a memoized cost
+        self.assertIsNone(processor._cached_cost('stale.unit.tests'))
+        # they're refreshed in the background
+        processor._refresher.shutdown(wait=True)
+        resolver_mock.assert_has_calls(
+            [call('stale.unit.tests', 'TXT'), call('other.unit.tests', 'TXT')],
+            any_order=True,
+        )
+        self.assertEqual(2, processor.refreshed)
+        self.assertEqual(
+            ['v=spf1 a mx -all'], cache.get('TXT', 'stale.unit.tests')[0]
+        )
+        self.assertEqual(set(), processor._refreshing)
+
+        # entries beyond the grace period are queried as usual
+        resolver_mock.reset_mock()
+        self.assertEqual(
+            3,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:old.unit.tests -all']
+            ),
+        )
+        resolver_mock.assert_called_once_with('old.unit.tests', 'TXT')
+
+        # refreshes are only scheduled once at a time
+        processor._refresher = MagicMock()
+        processor._refreshing.add(('TXT', 'busy.unit.tests'))
+        processor._refresh_later('busy.unit.tests', 'TXT')
+        processor._refresher.submit.assert_not_called()
+
+        # failed refreshes keep the stale value, voids are remembered
+        resolver_mock.reset_mock()
+        resolver_mock.side_effect = [
+            LifetimeTimeout(timeout=1.0, errors=[]),
+            NXDOMAIN(),
+        ]
+        with self.assertLogs('SpfDnsLookupProcessor', level='WARNING'):
+            processor._refresh('stale.unit.tests', 'A')
+        processor._refresh('gone.unit.tests', 'TXT')
+        self.assertIn(('TXT', 'gone.unit.tests'), processor._voids)
+        self.assertEqual(4, processor.refreshed)
+
+    @patch('dns.resolver.resolve')
+    def test_processor_fingerprints(self, resolver_mock):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = join(tmpdir.name, 'fingerprints.db')
+
+        def cleanup():
+            for cache in SpfSqliteCache._shared.values():
+                cache.close()
+            SpfSqliteCache._shared = {}
+
+        self.addCleanup(cleanup)
+
+        def zone_with(*values):
+            zone = Zone('unit.tests.', [])
+            for i, value in enumerate(values):
+                zone.add_record(
+                    Record.new(
+                        zone,
+                        f'r{i}',
+                        {'type': 'TXT', 'ttl': 60, 'values': [value]},
+                    )
+                )
+            return zone
+
+        # disabled by default
+        self.assertIsNone(SpfDnsLookupProcessor('test').fingerprints)
+
+        resolver_mock.side_effect = [
+            _answer('"v=spf1 include:_spf.example.com -all"', ttl=300),
+            _answer('"v=spf1 a -all"', ttl=60),
+        ]
+        values = ('v=spf1 include:example.com -all', 'v=spf1 ip4:1.2.3.4 -all')
+        processor = SpfDnsLookupProcessor(
+            'test', fingerprint_path=path, fingerprint_max_age=3600
+        )
+        self.assertIsInstance(processor.fingerprints, SpfSqliteCache)
+        processor.process_source_zone(zone_with(*values))
+        self.assertEqual((2, 0), (processor.validated, processor.skipped))
+        self.assertEqual(2, resolver_mock.call_count)
+
+        # fingerprints last as long as the answers they relied upon, without
+        # any, as long as they're allowed
+        now = time()
+        fingerprints = processor.fingerprints
+        expires = fingerprints.get(
+            'fingerprint', processor._fingerprint(values[0])
+        )[1]
+        self.assertAlmostEqual(now + 60, expires, delta=5)
+        expires = fingerprints.get(
+            'fingerprint', processor._fingerprint(values[1])
+        )[1]
+        self.assertAlmostEqual(now + 3600, expires, delta=5)
+
+        # the next run skips the unchanged values, without any queries
+        resolver_mock.reset_mock()
+        resolver_mock.side_effect = None
+        resolver_mock.return_value = _answer('"v=spf1 a -all"')
+        processor = SpfDnsLookupProcessor('next', fingerprint_path=path)
+        with self.assertLogs('SpfDnsLookupProcessor', level='INFO') as logs:
+            processor.process_source_zone(
+                zone_with(*values, 'v=spf1 include:_spf.example.com -all')
+            )
+        self.assertEqual((1, 2), (processor.validated, processor.skipped))
+        resolver_mock.assert_called_once_with('_spf.example.com', 'TXT')
+        self.assertIn('validated=1, reused=0, skipped=2', logs.output[-1])
+
+        # options that change the outcome are part of the fingerprint
+        resolver_mock.reset_mock()
+        processor = SpfDnsLookupProcessor(
+            'strict', fingerprint_path=path, max_depth=1
+        )
+        processor.process_source_zone(zone_with(values[1]))
+        self.assertEqual((1, 0), (processor.validated, processor.skipped))
+
+        # failures aren't remembered, they're re-validated until fixed
+        resolver_mock.reset_mock()
+        resolver_mock.return_value = _answer('"v=spf1 ptr -all"')
+        for _ in range(2):
+            processor = SpfDnsLookupProcessor('test', fingerprint_path=path)
+            with self.assertRaises(SpfValueException):
+                processor.process_source_zone(
+                    zone_with('v=spf1 include:ptr.example.com -all')
+                )
+            self.assertEqual(1, processor.validated)
+        self.assertEqual(2, resolver_mock.call_count)
+
+    @patch('dns.resolver.resolve')
+    def test_processor_fingerprints_resolved_mechanisms(self, resolver_mock):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = join(tmpdir.name, 'fingerprints.db')
+
+        def cleanup():
+            for cache in SpfSqliteCache._shared.values():
+                cache.close()
+            SpfSqliteCache._shared = {}
+
+        self.addCleanup(cleanup)
+
+        answers = {
+            ('x.unit.tests', 'A'): _answer('1.2.3.4', ttl=5),
+            ('six.unit.tests', 'AAAA'): _answer('2606::1', ttl=600),
+            ('mail.unit.tests', 'MX'): _answer('10 mx.unit.tests.', ttl=30),
+        }
+
+        def resolve(domain, rdtype):
+            if (domain, rdtype) in answers:
+                return answers[(domain, rdtype)]
+            if domain == 'six.unit.tests':
+                raise NoAnswer()
+            raise NXDOMAIN()
+
+        resolver_mock.side_effect = resolve
+        processor = SpfDnsLookupProcessor(
+            'test', resolve_mechanisms=True, fingerprint_path=path
+        )
+        # the answers of resolved mechanisms, and the voids, limit how long
+        # the value's outcome is known for
+        now = time()
+        for value, ttl in (
+            ('v=spf1 a:x.unit.tests a:y.unit.tests a:w.unit.tests -all', 5),
+            ('v=spf1 a:y.unit.tests -all', processor.NEGATIVE_TTL),
+            # the missing A for as long as the AAAA
+            ('v=spf1 a:six.unit.tests -all', processor.NEGATIVE_TTL),
+            ('v=spf1 exists:six.unit.tests -all', processor.NEGATIVE_TTL),
+            ('v=spf1 mx:mail.unit.tests -all', 30),
+            ('v=spf1 mx:y.unit.tests -all', processor.NEGATIVE_TTL),
+            # nothing that can be resolved ahead of time
+            ('v=spf1 exists:%{i}.unit.tests -all', None),
+        ):
+            _, _, expires = processor._check('unit.tests.', [value])
+            if ttl is None:
+                self.assertEqual(inf, expires)
+            else:
+                self.assertAlmostEqual(now + ttl, expires, delta=5)
+
+        # so the fingerprint is only good for as long
+        zone = Zone('unit.tests.', [])
+        zone.add_record(
+            Record.new(
+                zone,
+                '',
+                {
+                    'type': 'TXT',
+                    'ttl': 60,
+                    'value': 'v=spf1 a:x.unit.tests a:y.unit.tests a:w.unit.tests -all',
+                },
+            )
+        )
+        processor.process_source_zone(zone)
+        expires = processor.fingerprints.get(
+            'fingerprint',
+            processor._fingerprint(
+                'v=spf1 a:x.unit.tests a:y.unit.tests a:w.unit.tests -all'
+            ),
+        )[1]
+        self.assertAlmostEqual(now + 5, expires, delta=5)
+
+    @patch('dns.resolver.resolve')
+    def test_processor_persistent_cache(self, resolver_mock):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = join(tmpdir.name, 'spf.db')
+
+        def cleanup():
+            for cache in SpfSqliteCache._shared.values():
+                cache.close()
+            SpfSqliteCache._shared = {}
+
+        self.addCleanup(cleanup)
+
+        processor = SpfDnsLookupProcessor(
+            'test', cache_path=path, cache_max_stale=600
+        )
+        self.assertIsInstance(processor.cache, SpfSqliteCache)
+        self.assertEqual(600, processor.cache.max_stale)
+        # fingerprints in the same file don't change how long answers are kept
+        other = SpfDnsLookupProcessor(
+            'other',
+            cache_path=path,
+            cache_max_stale=600,
+            fingerprint_path=path,
+            fingerprint_max_age=60,
+        )
+        self.assertIs(processor.cache, other.cache)
+        self.assertEqual(
+            (600, 60), (other.cache.max_stale, other.fingerprints.max_stale)
+        )
+
+        resolver_mock.side_effect = [
+            _answer('"v=spf1 include:_spf.example.com -all"', ttl=300),
+            _answer('"v=spf1 a -all"', ttl=60),
+        ]
+        values = ['v=spf1 include:example.com -all']
+        self.assertEqual(3, processor.check_dns_lookups('unit.tests.', values))
+        cache = processor.cache
+        self.assertEqual(
+            ['v=spf1 include:_spf.example.com -all'],
+            cache.get('TXT', 'example.com')[0],
+        )
+        # costs are stored per-include
+        self.assertEqual(2, cache.get('cost', 'example.com')[0])
+        self.assertEqual(1, cache.get('cost', '_spf.example.com')[0])
+        # expiring with the shortest lived answer in their trees
+        self.assertAlmostEqual(
+            cache.get('TXT', '_spf.example.com')[1],
+            cache.get('cost', 'example.com')[1],
+            delta=1,
+        )
+
+        # a subsequent run reads the persisted values
+        cleanup()
+        resolver_mock.reset_mock()
+        processor = SpfDnsLookupProcessor('test', cache_path=path)
+        self.assertEqual(3, processor.check_dns_lookups('unit.tests.', values))
+        resolver_mock.assert_not_called()
+
+    def test_processor_engine_validation(self):
+        self.assertEqual('sync', SpfDnsLookupProcessor('test').engine)
+        self.assertEqual(
+            'async', SpfDnsLookupProcessor('test', engine='async').engine
+        )
+        with self.assertRaises(ProcessorException) as ctx:
+            SpfDnsLookupProcessor('test', engine='threads')
+        self.assertEqual(
+            'Unsupported engine "threads", must be one of sync, async',
+            str(ctx.exception),
+        )
+
+    @patch('dns.resolver.resolve')
+    @patch('dns.asyncresolver.resolve', new_callable=AsyncMock)
+    def test_processor_async_engine(self, async_resolver_mock, resolver_mock):
+        answers = {
+            'one.example.com': '"v=spf1 include:a.example.com include:b.example.com -all"',
+            'two.example.com': '"v=spf1 include:b.example.com mx -all"',
+            'a.example.com': '"v=spf1 a -all"',
+            'b.example.com': '"v=spf1 ip4:1.2.3.4 -all"',
+            'ptr.example.com': '"v=spf1 ptr -all"',
+        }
+
+        def resolve(domain, _type):
+            try:
+                return _answer(answers[domain])
+            except KeyError:
+                raise NXDOMAIN()
+
+        async_resolver_mock.side_effect = resolve
+        resolver_mock.side_effect = resolve
+
+        processor = SpfDnsLookupProcessor('test', engine='async')
+        sync = SpfDnsLookupProcessor('test')
+
+        values = [
+            'v=spf1 include:one.example.com include:two.example.com -all',
+            'v=DMARC1\\; p=reject\\;',
+        ]
+        self.assertEqual(7, sync.check_dns_lookups('unit.tests.', values))
+        resolver_mock.reset_mock()
+        self.assertEqual(7, processor.check_dns_lookups('unit.tests.', values))
+        # everything came from the concurrent prefetch, a level at a time and
+        # each domain only once
+        resolver_mock.assert_not_called()
+        async_resolver_mock.assert_has_calls(
+            [
+                call('one.example.com', 'TXT'),
+                call('two.example.com', 'TXT'),
+                call('a.example.com', 'TXT'),
+                call('b.example.com', 'TXT'),
+            ]
+        )
+        self.assertEqual(4, async_resolver_mock.call_count)
+
+        # errors are raised the same way as the sync engine
+        for engine in (processor, sync):
+            with self.assertRaises(SpfValueException):
+                engine.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 include:ptr.example.com -all']
+                )
+            with self.assertRaises(NXDOMAIN):
+                engine.check_dns_lookups(
+                    'unit.tests.',
+                    ['v=spf1 include:a.example.com include:nope.example.com'],
+                )
+
+    @patch('dns.resolver.resolve')
+    @patch('dns.asyncresolver.resolve', new_callable=AsyncMock)
+    def test_processor_async_engine_limits(
+        self, async_resolver_mock, resolver_mock
+    ):
+        # a chain of 12 includes, each one level deeper than the last
+        def resolve(domain, _type):
+            n = int(domain.split('.')[0][1:]) + 1
+            return _answer(f'"v=spf1 include:i{n}.example.com -all"')
+
+        async_resolver_mock.side_effect = resolve
+        resolver_mock.side_effect = resolve
+
+        processor = SpfDnsLookupProcessor('test', engine='async')
+        with self.assertRaises(SpfDnsLookupException):
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:i0.example.com -all']
+            )
+        # prefetching stops once the limit must have been exceeded
+        self.assertEqual(11, async_resolver_mock.call_count)
+        resolver_mock.assert_not_called()
+
+    @patch('dns.asyncresolver.resolve', new_callable=AsyncMock)
+    def test_processor_async_engine_cache(self, async_resolver_mock):
+        SpfResolutionCache._shared = None
+        self.addCleanup(setattr, SpfResolutionCache, '_shared', None)
+
+        async_resolver_mock.return_value = _answer('"v=spf1 a -all"')
+
+        processor = SpfDnsLookupProcessor(
+            'test', engine='async', cache_enabled=True
+        )
+        # the include costs aren't cached so the walk happens each time, but
+        # the prefetch uses the cached values
+        processor.cache.set(
+            'TXT', 'example.com', ['v=spf1 include:a.example.com -all'], 60
+        )
+        values = ['v=spf1 include:example.com -all']
+        self.assertEqual(3, processor.check_dns_lookups('unit.tests.', values))
+        async_resolver_mock.assert_called_once_with('a.example.com', 'TXT')
+
+    def test_processor_max_workers_validation(self):
+        self.assertEqual(1, SpfDnsLookupProcessor('test').max_workers)
+        with self.assertRaises(ProcessorException) as ctx:
+            SpfDnsLookupProcessor('test', max_workers=0)
+        self.assertEqual(
+            'Invalid max_workers 0, must be at least 1', str(ctx.exception)
+        )
+
+    @patch('dns.resolver.resolve')
+    def test_processor_max_workers(self, resolver_mock):
+        resolver_mock.side_effect = lambda domain, _type: _answer(
+            '"v=spf1 a -all"'
+        )
+
+        processor = SpfDnsLookupProcessor('test', max_workers=4)
+
+        zone = Zone('unit.tests.', [])
+        for i in range(8):
+            zone.add_record(
+                Record.new(
+                    zone,
+                    f'sub{i}',
+                    {
+                        'type': 'TXT',
+                        'ttl': 86400,
+                        'value': f'v=spf1 include:s{i}.example.com -all',
+                    },
+                )
+            )
+        self.assertEqual(zone, processor.process_source_zone(zone))
+        self.assertEqual(8, resolver_mock.call_count)
+
+        # add some failures, the first in record order is the one raised no
+        # matter which finishes first
+        zone.add_record(
+            Record.new(
+                zone,
+                'z-ptr',
+                {'type': 'TXT', 'ttl': 86400, 'value': 'v=spf1 ptr -all'},
+            )
+        )
+        zone.add_record(
+            Record.new(
+                zone,
+                'a-limit',
+                {
+                    'type': 'TXT',
+                    'ttl': 86400,
+                    'value': 'v=spf1 a a a a a a a a a a a -all',
+                },
+            )
+        )
+        with self.assertLogs('SpfDnsLookupProcessor', level='ERROR') as logs:
+            with self.assertRaises(SpfDnsLookupException) as ctx:
+                processor.process_source_zone(zone)
+        self.assertEqual(
+            'a-limit.unit.tests. exceeds the 10 DNS lookup limit in the SPF record',
+            str(ctx.exception),
+        )
+        # all of the failures are logged, in order
+        self.assertEqual(
+            [
+                'ERROR:SpfDnsLookupProcessor:process_source_zone: a-limit.unit.tests. exceeds the 10 DNS lookup limit in the SPF record',
+                'ERROR:SpfDnsLookupProcessor:process_source_zone: z-ptr.unit.tests. uses the deprecated ptr mechanism',
+            ],
+            logs.output,
+        )
+
+    def test_processor_max_workers_dedup(self):
+        def validate(processor, value):
+            zone = Zone('unit.tests.', [])
+            for i in range(8):
+                zone.add_record(
+                    Record.new(
+                        zone,
+                        f'sub{i}',
+                        {'type': 'TXT', 'ttl': 86400, 'value': value},
+                    )
+                )
+            errors = []
+
+            def run_one():
+                try:
+                    with self.assertLogs('SpfDnsLookupProcessor'):
+                        processor.process_source_zone(zone)
+                except Exception as e:
+                    errors.append(e)
+
+            thread = Thread(target=run_one)
+            thread.start()
+            # wait for everyone else to wait on the first's validation
+            for _ in range(500):
+                if processor.reused == 7:
+                    break
+                time_sleep(0.01)
+            processor.resolver.released.set()
+            thread.join()
+            return errors
+
+        # the value is only validated once, no matter how many are validating
+        # it concurrently
+        resolver = _GatedResolver(_answer('"v=spf1 -all"'))
+        processor = SpfDnsLookupProcessor(
+            'test', resolver=resolver, max_workers=8
+        )
+        self.assertEqual(
+            [], validate(processor, 'v=spf1 include:c.unit.tests -all')
+        )
+        self.assertEqual(1, resolver.calls)
+        self.assertEqual((1, 7), (processor.validated, processor.reused))
+        self.assertEqual(
+            {'v=spf1 include:c.unit.tests -all': 1}, processor._results
+        )
+
+        # as are its failures, each reported for its own record
+        resolver = _GatedResolver(_answer('"v=spf1 -all"'))
+        processor = SpfDnsLookupProcessor(
+            'test', resolver=resolver, max_workers=8
+        )
+        a10 = ' '.join(['a'] * 10)
+        (error,) = validate(
+            processor, f'v=spf1 include:c.unit.tests {a10} -all'
+        )
+        self.assertEqual(
+            'sub0.unit.tests. exceeds the 10 DNS lookup limit in the SPF record',
+            str(error),
+        )
+        self.assertEqual(1, resolver.calls)
+        self.assertEqual((1, 7), (processor.validated, processor.reused))
+
+        # errors that aren't the value's fault are shared, but not remembered
+        resolver = _GatedResolver(NXDOMAIN())
+        processor = SpfDnsLookupProcessor(
+            'test', resolver=resolver, max_workers=8
+        )
+        (error,) = validate(processor, 'v=spf1 include:c.unit.tests -all')
+        self.assertIsInstance(error, NXDOMAIN)
+        self.assertEqual(1, resolver.calls)
+        self.assertEqual({}, processor._results)
+
+    @patch('dns.resolver.resolve')
+    def test_processor_memoizes_include_costs(self, resolver_mock):
+        answers = {
+            'a.example.com': '"v=spf1 include:shared.example.com -all"',
+            'b.example.com': '"v=spf1 mx include:shared.example.com -all"',
+            'shared.example.com': '"v=spf1 a include:deep.example.com -all"',
+            'deep.example.com': '"v=spf1 a a -all"',
+        }
+        resolver_mock.side_effect = lambda domain, _type: _answer(
+            answers[domain]
+        )
+
+        processor = SpfDnsLookupProcessor('test')
+        values = ['v=spf1 include:a.example.com include:b.example.com -all']
+        # a: 1 + shared(1 + 1 + deep(1 + 2)) = 6, b: 1 + 1 + 5 = 7
+        for domain, expected in (('a', 6), ('b', 7)):
+            self.assertEqual(
+                expected,
+                SpfDnsLookupProcessor('other').check_dns_lookups(
+                    'unit.tests.', [f'v=spf1 include:{domain}.example.com -all']
+                ),
+            )
+        resolver_mock.reset_mock()
+
+        # together they're over the limit, shared is only walked once
+        with self.assertRaises(SpfDnsLookupException):
+            processor.check_dns_lookups('unit.tests.', values)
+        self.assertEqual(
+            [
+                call('a.example.com', 'TXT'),
+                call('shared.example.com', 'TXT'),
+                call('deep.example.com', 'TXT'),
+                call('b.example.com', 'TXT'),
+            ],
+            resolver_mock.call_args_list,
+        )
+        self.assertEqual(
+            {
+                'a.example.com': ['shared.example.com'],
+                'b.example.com': ['shared.example.com'],
+                'shared.example.com': ['deep.example.com'],
+                'deep.example.com': [],
+            },
+            processor.include_graph,
+        )
+        self.assertEqual(5, processor._costs['a.example.com'][0])
+        self.assertEqual(4, processor._costs['shared.example.com'][0])
+        # b's tree wasn't finished so its cost isn't known
+        self.assertNotIn('b.example.com', processor._costs)
+
+        # subsequent records reuse the memoized costs without any lookups
+        resolver_mock.reset_mock()
+        self.assertEqual(
+            6,
+            processor.check_dns_lookups(
+                'other.tests.', ['v=spf1 include:a.example.com -all']
+            ),
+        )
+        resolver_mock.assert_not_called()
+
+    @patch('dns.resolver.resolve')
+    def test_processor_dedups_spf_values(self, resolver_mock):
+        resolver_mock.side_effect = lambda domain, _type: _answer(
+            '"not-spf"' if domain == 'text.example.com' else '"v=spf1 a -all"'
+        )
+
+        processor = SpfDnsLookupProcessor('test')
+
+        def zone_with(name, *values):
+            zone = Zone(name, [])
+            for i, value in enumerate(values):
+                zone.add_record(
+                    Record.new(
+                        zone,
+                        f'sub{i}',
+                        {'type': 'TXT', 'ttl': 3600, 'value': value},
+                    )
+                )
+            return zone
+
+        value = 'v=spf1 include:example.com include:text.example.com -all'
+        with self.assertLogs('SpfDnsLookupProcessor', level='INFO') as logs:
+            processor.process_source_zone(zone_with('first.tests.', value))
+            # same value, different whitespace, is the same thing
+            processor.process_source_zone(
+                zone_with(
+                    'second.tests.',
+                    value,
+                    value.replace(' ', '  '),
+                    'v=DMARC1\\; p=reject\\;',
+                )
+            )
+        # totals for the run so far, logged once after each zone
+        first, second = [o for o in logs.output if o.startswith('INFO')]
+        self.assertTrue(
+            first.startswith(
+                'INFO:SpfDnsLookupProcessor:process_source_zone:   run totals after first.tests., '
+            )
+        )
+        self.assertIn('coalesced=0, refreshed=0, validated=1, reused=0,', first)
+        self.assertTrue(
+            second.startswith(
+                'INFO:SpfDnsLookupProcessor:process_source_zone:   run totals after second.tests., '
+            )
+        )
+        self.assertIn(
+            'coalesced=0, refreshed=0, validated=1, reused=2,', second
+        )
+        self.assertEqual(2, resolver_mock.call_count)
+
+        # failures are remembered and re-raised for the record at hand
+        resolver_mock.reset_mock()
+        bad = 'v=spf1 ptr -all'
+        with self.assertRaises(SpfValueException) as ctx:
+            processor.process_source_zone(zone_with('first.tests.', bad))
+        self.assertEqual(
+            'sub0.first.tests. uses the deprecated ptr mechanism',
+            str(ctx.exception),
+        )
+        with self.assertRaises(SpfValueException) as ctx:
+            processor.process_source_zone(zone_with('second.tests.', bad))
+        self.assertEqual(
+            'sub0.second.tests. uses the deprecated ptr mechanism',
+            str(ctx.exception),
+        )
+        self.assertEqual(2, processor.validated)
+        self.assertEqual(3, processor.reused)
+
+    @patch('dns.resolver.resolve')
+    def test_processor_changes_only(self, resolver_mock):
+        resolver_mock.side_effect = lambda domain, _type: _answer(
+            '"v=spf1 ip4:10.0.0.0/24 -all"'
+        )
+
+        processor = SpfDnsLookupProcessor('test', changes_only=True)
+
+        existing = Zone('unit.tests.', [])
+        desired = Zone('unit.tests.', [])
+
+        def txt(zone, name, value, **kwargs):
+            record = Record.new(
+                zone,
+                name,
+                {'type': 'TXT', 'ttl': 3600, 'value': value, **kwargs},
+            )
+            zone.add_record(record)
+            return record
+
+        # unchanged, in both, isn't part of the plan and isn't validated even
+        # though it's invalid
+        for zone in (existing, desired):
+            txt(zone, 'unchanged', 'v=spf1 ptr -all')
+        # source zones are left alone
+        self.assertEqual(desired, processor.process_source_zone(desired))
+        # as are empty plans
+        self.assertIsNone(processor.process_plan(None, [], None))
+        self.assertEqual(0, processor.validated)
+
+        created = txt(desired, 'created', 'v=spf1 include:created.tests -all')
+        old = txt(existing, 'updated', 'v=spf1 -all')
+        updated = txt(desired, 'updated', 'v=spf1 include:updated.tests -all')
+        deleted = txt(existing, 'deleted', 'v=spf1 ptr -all')
+        lenient = txt(
+            desired, 'lenient', 'v=spf1 ptr -all', octodns={'lenient': True}
+        )
+        plan = Plan(
+            existing,
+            desired,
+            [
+                Create(created),
+                Update(old, updated),
+                Delete(deleted),
+                Create(lenient),
+            ],
+            True,
+        )
+        with self.assertLogs('SpfDnsLookupProcessor', level='INFO') as logs:
+            self.assertEqual(plan, processor.process_plan(plan, [], None))
+        self.assertTrue(
+            logs.output[0].startswith(
+                'INFO:SpfDnsLookupProcessor:process_plan:   run totals after unit.tests., '
+            )
+        )
+        self.assertIn('validated=2, reused=0,', logs.output[0])
+        self.assertEqual(
+            [call('created.tests', 'TXT'), call('updated.tests', 'TXT')],
+            resolver_mock.call_args_list,
+        )
+
+        # problems in the changes are reported
+        bad = txt(desired, 'bad', 'v=spf1 ptr -all')
+        with self.assertRaises(SpfValueException) as ctx:
+            processor.process_plan(
+                Plan(existing, desired, [Create(bad)], True), [], None
+            )
+        self.assertEqual(
+            'bad.unit.tests. uses the deprecated ptr mechanism',
+            str(ctx.exception),
+        )
+
+        # with the default the plan is left alone, the source zone has been
+        # validated
+        processor = SpfDnsLookupProcessor('test')
+        self.assertEqual(plan, processor.process_plan(plan, [], None))
+        self.assertEqual(0, processor.validated)
+
+    def test_processor_resolver_config(self):
+        self.assertIsInstance(
+            SpfDnsLookupProcessor('test').resolver, DnsPythonResolver
+        )
+
+        processor = SpfDnsLookupProcessor(
+            'test',
+            resolver={
+                'class': 'octodns_spf.resolver.DnsPythonResolver',
+                'nameservers': ['10.0.0.53'],
+                'timeout': 2,
+            },
+        )
+        self.assertIsInstance(processor.resolver, DnsPythonResolver)
+        self.assertEqual(['10.0.0.53'], processor.resolver.nameservers)
+        self.assertEqual(2, processor.resolver.timeout)
+
+        # instances are used as-is
+        resolver = DnsPythonResolver(retries=3)
+        self.assertIs(
+            resolver, SpfDnsLookupProcessor('test', resolver=resolver).resolver
+        )
+
+        for _class in (
+            None,
+            'NoDots',
+            'octodns_spf.nope.Resolver',
+            'octodns_spf.resolver.Nope',
+        ):
+            with self.assertRaises(ProcessorException) as ctx:
+                SpfDnsLookupProcessor('test', resolver={'class': _class})
+            self.assertEqual(
+                f'Unknown resolver class: {_class}', str(ctx.exception)
+            )
+
+    def test_processor_fixture_resolver(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        path = join(tmpdir.name, 'fixture.yaml')
+        with open(path, 'w') as fh:
+            fh.write("""---
+example.com:
+  - v=spf1 include:_spf.example.com -all
+_spf.example.com:
+  - v=spf1 a mx -all
+""")
+
+        for engine in ('sync', 'async'):
+            processor = SpfDnsLookupProcessor(
+                'test',
+                engine=engine,
+                resolver={
+                    'class': 'octodns_spf.resolver.FixtureResolver',
+                    'path': path,
+                },
+            )
+            self.assertIsInstance(processor.resolver, FixtureResolver)
+            self.assertEqual(
+                4,
+                processor.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 include:example.com -all']
+                ),
+            )
+            with self.assertRaises(NXDOMAIN):
+                processor.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 include:missing.example.com -all']
+                )
+
+    def test_processor_known_includes(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        fixtures = join(tmpdir.name, 'fixture.yaml')
+        with open(fixtures, 'w') as fh:
+            fh.write("""---
+old.tests:
+  - v=spf1 a -all
+unverified.tests:
+  - v=spf1 a -all
+drift.tests:
+  TXT:
+    - v=spf1 a mx -all
+  A:
+    - 10.0.0.1
+  MX:
+    - 10 mx.drift.tests.
+same.tests:
+  - v=spf1 exists:%{i}.same.tests -all
+void.tests:
+  - v=spf1 a:nothing.tests -all
+""")
+        known = join(tmpdir.name, 'known.yaml')
+        # relative to today so that the entries don't age out
+        recent = date.today() - timedelta(days=1)
+        old = date.today() - timedelta(days=365)
+        with open(known, 'w') as fh:
+            fh.write(f"""---
+version: 1
+includes:
+  trusted.tests:
+    cost: 1
+    verified: {recent}
+  old.tests:
+    cost: 0
+    verified: {old}
+  unverified.tests:
+    cost: 0
+  drift.tests:
+    cost: 1
+    verified: {recent}
+  same.tests:
+    cost: 1
+    verified: {recent}
+  missing.tests:
+    cost: 1
+    verified: {recent}
+  void.tests:
+    cost: 1
+    verified: {recent}
+""")
+        resolver = {
+            'class': 'octodns_spf.resolver.FixtureResolver',
+            'path': fixtures,
+        }
+
+        with self.assertRaises(ProcessorException) as ctx:
+            SpfDnsLookupProcessor('test', known_includes='sometimes')
+        self.assertEqual(
+            'Unsupported known_includes "sometimes", must be one of trust, verify',
+            str(ctx.exception),
+        )
+        with self.assertRaises(ProcessorException) as ctx:
+            SpfDnsLookupProcessor('test', known_includes_path=known)
+        self.assertEqual(
+            'known_includes_path requires known_includes to be set',
+            str(ctx.exception),
+        )
+
+        for engine in ('sync', 'async'):
+            processor = SpfDnsLookupProcessor(
+                'test',
+                engine=engine,
+                resolver=resolver,
+                known_includes='trust',
+                known_includes_path=known,
+            )
+            # trusted.tests isn't in the fixtures, it's never resolved
+            self.assertEqual(
+                2,
+                processor.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 include:trusted.tests -all']
+                ),
+            )
+            # the shipped table is there too
+            self.assertEqual(3, processor.known.get('_spf.google.com')[0])
+            # entries that haven't been verified, recently enough or at all,
+            # are walked
+            for domain in ('old.tests', 'unverified.tests'):
+                self.assertEqual(
+                    2,
+                    processor.check_dns_lookups(
+                        'unit.tests.', [f'v=spf1 include:{domain} -all']
+                    ),
+                )
+            # as are those that aren't in it
+            self.assertIsNone(processor._cached_cost('unknown.tests'))
+            self.assertEqual({'trusted.tests'}, processor.known_used)
+            self.assertIsNone(processor._refresher)
+
+        with self.assertLogs('SpfDnsLookupProcessor', level='INFO') as logs:
+            processor.process_source_zone(Zone('unit.tests.', []))
+        self.assertTrue(logs.output[-1].endswith(', known_used=1'))
+
+        processor = SpfDnsLookupProcessor(
+            'test',
+            resolver=resolver,
+            resolve_mechanisms=True,
+            known_includes='verify',
+            known_includes_path=known,
+        )
+        value = 'v=spf1 include:drift.tests include:same.tests include:missing.tests include:void.tests -all'
+        with self.assertLogs('SpfDnsLookupProcessor', level='WARNING') as logs:
+            # the known costs are used right away
+            self.assertEqual(
+                8, processor.check_dns_lookups('unit.tests.', [value])
+            )
+            # and verified in the background
+            processor._refresher.shutdown(wait=True)
+        self.assertEqual(
+            [
+                'WARNING:SpfDnsLookupProcessor:_verify_known: drift.tests costs 2 lookups, the known includes table has 1',
+                'WARNING:SpfDnsLookupProcessor:_verify_known: missing.tests failed, The DNS query name does not exist: missing.tests.',
+            ],
+            sorted(logs.output),
+        )
+        # verified costs are used from then on, failures and subtrees with
+        # voids keep using the known ones
+        self.assertEqual(2, processor._costs['drift.tests'][0])
+        self.assertEqual(1, processor._costs['same.tests'][0])
+        self.assertNotIn('missing.tests', processor._costs)
+        self.assertNotIn('void.tests', processor._costs)
+        self.assertEqual(9, processor.check_dns_lookups('unit.tests.', [value]))
+        self.assertEqual(
+            {'drift.tests', 'same.tests', 'missing.tests', 'void.tests'},
+            processor.known_used,
+        )
+
+        # each is only verified once
+        processor._refresher = MagicMock()
+        processor._cached_cost('missing.tests')
+        processor._refresher.submit.assert_not_called()
+
+    def test_processor_tracing(self):
+        SpfResolutionCache._shared = None
+        self.addCleanup(setattr, SpfResolutionCache, '_shared', None)
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        fixtures = join(tmpdir.name, 'fixture.yaml')
+        with open(fixtures, 'w') as fh:
+            fh.write("""---
+example.com:
+  - v=spf1 include:_a.example.com redirect=_r.example.com
+_a.example.com:
+  - v=spf1 ip4:10.0.0.0/24 -all
+_r.example.com:
+  - v=spf1 include:_a.example.com -all
+loop.example.com:
+  - v=spf1 include:loop.example.com -all
+""")
+        resolver = {
+            'class': 'octodns_spf.resolver.FixtureResolver',
+            'path': fixtures,
+        }
+
+        # off by default
+        self.assertIsNone(SpfDnsLookupProcessor('test').tracer)
+
+        sink = _ListSink()
+        processor = SpfDnsLookupProcessor(
+            'test', resolver=resolver, cache_enabled=True, tracing=sink
+        )
+        self.assertIs(sink, processor.tracer.sink)
+        self.assertEqual(
+            4,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:example.com -all']
+            ),
+        )
+        # spans are emitted as they finish, children before their parents
+        self.assertEqual(
+            [
+                ('include', '_a.example.com', 2, 0, 'miss'),
+                ('include', '_a.example.com', 3, 0, 'cost'),
+                ('redirect', '_r.example.com', 2, 1, 'miss'),
+                ('include', 'example.com', 1, 3, 'miss'),
+                ('record', 'unit.tests.', 0, 4, None),
+            ],
+            [
+                (
+                    s['name'],
+                    s['domain'],
+                    s['depth'],
+                    s['lookups'],
+                    s.get('cache'),
+                )
+                for s in sink.spans
+            ],
+        )
+        spans = {(s['domain'], s['depth']): s for s in sink.spans}
+        self.assertEqual(
+            [
+                spans[('_r.example.com', 2)]['span_id'],
+                spans[('example.com', 1)]['span_id'],
+                spans[('unit.tests.', 0)]['span_id'],
+                None,
+            ],
+            [
+                spans[k]['parent_id']
+                for k in (
+                    ('_a.example.com', 3),
+                    ('_r.example.com', 2),
+                    ('example.com', 1),
+                    ('unit.tests.', 0),
+                )
+            ],
+        )
+        self.assertEqual(
+            {spans[('unit.tests.', 0)]['trace_id']},
+            {s['trace_id'] for s in sink.spans},
+        )
+
+        # cached answers, and voids, are hits, labeling them doesn't consult
+        # the cache a second time
+        sink.spans = []
+        processor.cache.set('TXT', 'cached.example.com', ['v=spf1 -all'], 60)
+        hits, misses = processor.cache.hits, processor.cache.misses
+        processor.check_dns_lookups(
+            'unit.tests.', ['v=spf1 include:cached.example.com -all']
+        )
+        self.assertEqual('hit', sink.spans[0]['cache'])
+        # the answer's hit and its cost's miss
+        self.assertEqual(
+            (hits + 1, misses + 1),
+            (processor.cache.hits, processor.cache.misses),
+        )
+        for cache in ('miss', 'hit'):
+            sink.spans = []
+            with self.assertRaises(NXDOMAIN):
+                processor.check_dns_lookups(
+                    'unit.tests.', ['v=spf1 include:missing.example.com -all']
+                )
+            include, record = sink.spans
+            self.assertEqual(
+                ('include', cache), (include['name'], include['cache'])
+            )
+            self.assertTrue(include['error'].startswith('NXDOMAIN: '))
+            self.assertEqual(include['error'], record['error'])
+
+        # names in the zone being validated are answered from it
+        sink.spans = []
+        processor._zone_txt = {'zone.unit.tests': ['v=spf1 -all']}
+        hits, misses = processor.cache.hits, processor.cache.misses
+        processor.check_dns_lookups(
+            'unit.tests.', ['v=spf1 include:zone.unit.tests -all']
+        )
+        processor._zone_txt = {}
+        self.assertEqual('zone', sink.spans[0]['cache'])
+        self.assertEqual(
+            (hits, misses), (processor.cache.hits, processor.cache.misses)
+        )
+
+        # failures part way through the walk finish the spans being walked
+        sink.spans = []
+        with self.assertRaises(SpfDnsLookupException):
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:loop.example.com -all']
+            )
+        error = 'SpfDnsLookupException: unit.tests. has an include loop, loop.example.com -> loop.example.com'
+        self.assertEqual(
+            [
+                ('include', 'loop.example.com', 1, error),
+                ('record', 'unit.tests.', 0, error),
+            ],
+            [
+                (s['name'], s['domain'], s['depth'], s['error'])
+                for s in sink.spans
+            ],
+        )
+
+        # without a cache answers are misses
+        sink = _ListSink()
+        processor = SpfDnsLookupProcessor(
+            'test', resolver=resolver, tracing=sink
+        )
+        processor.check_dns_lookups(
+            'unit.tests.', ['v=spf1 include:_a.example.com -all']
+        )
+        self.assertEqual('miss', sink.spans[0]['cache'])
+
+        # async resolves ahead of the walk, to a JSON-lines file by path
+        path = join(tmpdir.name, 'spans.jsonl')
+        processor = SpfDnsLookupProcessor(
+            'test', resolver=resolver, engine='async', tracing=path
+        )
+        self.assertIsInstance(processor.tracer.sink, JsonLinesSpanSink)
+        self.assertEqual(
+            4,
+            processor.check_dns_lookups(
+                'unit.tests.', ['v=spf1 include:example.com -all']
+            ),
+        )
+        processor.tracer.sink.close()
+        with open(path) as fh:
+            spans = [loads(line) for line in fh]
+        self.assertEqual(
+            ['prefetched', 'cost', 'prefetched', 'prefetched', None],
+            [s.get('cache') for s in spans],
+        )
+
+        # or the sink's config
+        processor = SpfDnsLookupProcessor(
+            'test',
+            tracing={
+                'class': 'octodns_spf.tracing.JsonLinesSpanSink',
+                'path': path,
+            },
+        )
+        self.assertEqual(path, processor.tracer.sink.path)
+        processor.tracer.sink.close()
+
+    def test_processor_zone_names(self):
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        fixtures = join(tmpdir.name, 'fixture.yaml')
+        with open(fixtures, 'w') as fh:
+            # what was published before, the zone's desired chain wins
+            fh.write("""---
+_spf1.unit.tests:
+  - v=spf1 a mx include:x.tests include:y.tests include:z.tests -all
+""")
+        processor = SpfDnsLookupProcessor(
+            'test',
+            resolver={
+                'class': 'octodns_spf.resolver.FixtureResolver',
+                'path': fixtures,
+            },
+        )
+        # a previously walked cost isn't used either
+        processor._costs['_spf1.unit.tests'] = (9, inf)
+
+        # SpfSource's generated chain is published by the same sync
+        zone = Zone('unit.tests.', [])
+        SpfSource(
+            'long',
+            ip4_addresses=[f'10.0.{i}.0/24' for i in range(20)],
+            max_length=200,
+        ).populate(zone)
+        self.assertEqual(['', '_spf1'], sorted(r.name for r in zone.records))
+        self.assertEqual(zone, processor.process_source_zone(zone))
+        self.assertEqual(1, processor.stats.histograms['record_lookups'].sum)
+        # nothing built on the zone's values is remembered
+        self.assertLessEqual(processor._costs['_spf1.unit.tests'][1], time())
+        self.assertEqual(0, processor.stats.counters['queries'])
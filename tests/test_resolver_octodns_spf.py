@@ -0,0 +1,398 @@
+#
+#
+#
+
+from asyncio import run, sleep
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from dns.resolver import NXDOMAIN, LifetimeTimeout, NoAnswer, NoNameservers
+
+from octodns.processor.base import ProcessorException
+
+from octodns_spf.resolver import (
+    BaseSpfResolver,
+    DnsPythonResolver,
+    FixtureResolver,
+    HedgedResolver,
+)
+
+
+class TestBaseSpfResolver(TestCase):
+    def test_base(self):
+        with self.assertRaises(NotImplementedError) as ctx:
+            BaseSpfResolver().resolve('unit.tests', 'TXT')
+        self.assertEqual(
+            'Abstract base class, resolve method missing', str(ctx.exception)
+        )
+
+        class Dummy(BaseSpfResolver):
+            def resolve(self, name, rdtype):
+                return [name, rdtype]
+
+        # async falls back to the sync implementation
+        self.assertEqual(
+            ['unit.tests', 'TXT'],
+            run(Dummy().resolve_async('unit.tests', 'TXT')),
+        )
+        # no stats by default
+        self.assertEqual({}, Dummy().stats())
+
+
+class TestDnsPythonResolver(TestCase):
+    @patch('dns.asyncresolver.resolve', new_callable=AsyncMock)
+    @patch('dns.resolver.resolve')
+    def test_defaults(self, resolver_mock, async_resolver_mock):
+        resolver = DnsPythonResolver()
+        self.assertIsNone(resolver._resolver)
+        self.assertIsNone(resolver._async_resolver)
+
+        answer = MagicMock()
+        resolver_mock.return_value = answer
+        async_resolver_mock.return_value = answer
+
+        self.assertEqual(answer, resolver.resolve('unit.tests', 'TXT'))
+        resolver_mock.assert_called_once_with('unit.tests', 'TXT')
+        self.assertEqual(
+            answer, run(resolver.resolve_async('unit.tests', 'TXT'))
+        )
+        async_resolver_mock.assert_called_once_with('unit.tests', 'TXT')
+
+    def test_configured(self):
+        resolver = DnsPythonResolver(
+            timeout=1.5, lifetime=4, nameservers=['10.0.0.53']
+        )
+        for r in (resolver._resolver, resolver._async_resolver):
+            self.assertEqual(1.5, r.timeout)
+            self.assertEqual(4, r.lifetime)
+            self.assertEqual(['10.0.0.53'], r.nameservers)
+
+        # only what's configured is changed
+        resolver = DnsPythonResolver(nameservers=['10.0.0.53'])
+        default = DnsPythonResolver(timeout=1.5)._resolver
+        self.assertEqual(default.lifetime, resolver._resolver.lifetime)
+        self.assertEqual(['10.0.0.53'], resolver._resolver.nameservers)
+
+        answer = MagicMock()
+        resolver._resolver = MagicMock()
+        resolver._resolver.resolve.return_value = answer
+        resolver._async_resolver = MagicMock()
+        resolver._async_resolver.resolve = AsyncMock(return_value=answer)
+
+        self.assertEqual(answer, resolver.resolve('unit.tests', 'TXT'))
+        resolver._resolver.resolve.assert_called_once_with('unit.tests', 'TXT')
+        self.assertEqual(
+            answer, run(resolver.resolve_async('unit.tests', 'TXT'))
+        )
+        resolver._async_resolver.resolve.assert_called_once_with(
+            'unit.tests', 'TXT'
+        )
+
+    @patch('dns.asyncresolver.resolve', new_callable=AsyncMock)
+    @patch('dns.resolver.resolve')
+    def test_retries(self, resolver_mock, async_resolver_mock):
+        answer = MagicMock()
+        timeout = LifetimeTimeout(timeout=1.0, errors=[])
+
+        resolver = DnsPythonResolver(retries=2)
+        self.assertIsNone(resolver._resolver)
+
+        resolver_mock.side_effect = [timeout, NoNameservers(), answer]
+        self.assertEqual(answer, resolver.resolve('unit.tests', 'TXT'))
+        self.assertEqual(3, resolver_mock.call_count)
+
+        resolver_mock.reset_mock()
+        resolver_mock.side_effect = [timeout, timeout, timeout, answer]
+        with self.assertRaises(LifetimeTimeout):
+            resolver.resolve('unit.tests', 'TXT')
+        self.assertEqual(3, resolver_mock.call_count)
+
+        # other errors aren't retried
+        resolver_mock.reset_mock()
+        resolver_mock.side_effect = [NXDOMAIN(), answer]
+        with self.assertRaises(NXDOMAIN):
+            resolver.resolve('unit.tests', 'TXT')
+        self.assertEqual(1, resolver_mock.call_count)
+
+        async_resolver_mock.side_effect = [timeout, answer]
+        self.assertEqual(
+            answer, run(resolver.resolve_async('unit.tests', 'TXT'))
+        )
+        async_resolver_mock.reset_mock()
+        async_resolver_mock.side_effect = [timeout, timeout, timeout, answer]
+        with self.assertRaises(LifetimeTimeout):
+            run(resolver.resolve_async('unit.tests', 'TXT'))
+        self.assertEqual(3, async_resolver_mock.call_count)
+
+
+class TestHedgedResolver(TestCase):
+    def hedged(self, *behaviors, **kwargs):
+        # each behavior is (seconds to wait, answer or exception)
+        resolver = HedgedResolver(
+            [f'10.0.0.{i}' for i in range(len(behaviors))],
+            hedge_delay=0.02,
+            **kwargs,
+        )
+        self.addCleanup(resolver.close)
+        self.cancelled = []
+        for nameserver, (delay, result) in zip(resolver.nameservers, behaviors):
+
+            async def resolve(
+                name, rdtype, delay=delay, result=result, ns=nameserver
+            ):
+                try:
+                    await sleep(delay)
+                except BaseException:
+                    self.cancelled.append(ns)
+                    raise
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+            resolver._resolvers[nameserver].resolve = AsyncMock(
+                side_effect=resolve
+            )
+        return resolver
+
+    def calls(self, resolver):
+        return [r.resolve.call_count for r in resolver._resolvers.values()]
+
+    def test_config(self):
+        for args, kwargs, msg in (
+            (
+                (['10.0.0.1'],),
+                {},
+                'HedgedResolver requires at least 2 nameservers',
+            ),
+            (
+                (['10.0.0.1', '10.0.0.2'],),
+                {'hedge_percentile': 100},
+                'Invalid hedge_percentile 100, must be between 0 and 100',
+            ),
+        ):
+            with self.assertRaises(ProcessorException) as ctx:
+                HedgedResolver(*args, **kwargs)
+            self.assertEqual(msg, str(ctx.exception))
+
+        resolver = HedgedResolver(['10.0.0.1', '10.0.0.2'], timeout=1.5)
+        for nameserver, r in resolver._resolvers.items():
+            self.assertEqual([nameserver], r.nameservers)
+            self.assertEqual(1.5, r.lifetime)
+        self.assertEqual(
+            {
+                'queries': 0,
+                'hedged': 0,
+                'failovers': 0,
+                'sidelined': 0,
+                'latency_p50': None,
+                'latency_p95': None,
+                'latency_p99': None,
+            },
+            resolver.stats(),
+        )
+
+    def test_hedging(self):
+        answer = MagicMock()
+
+        # a quick answer from the first nameserver is all that's needed
+        resolver = self.hedged((0, answer), (0, MagicMock()))
+        self.assertEqual(answer, resolver.resolve('unit.tests', 'TXT'))
+        self.assertEqual([1, 0], self.calls(resolver))
+
+        # a slow one is hedged, the first answer wins and the other's given up
+        resolver = self.hedged((5, MagicMock()), (0, answer))
+        self.assertEqual(
+            answer, run(resolver.resolve_async('unit.tests', 'TXT'))
+        )
+        self.assertEqual([1, 1], self.calls(resolver))
+        self.assertEqual(['10.0.0.0'], self.cancelled)
+        stats = resolver.stats()
+        self.assertEqual(
+            (1, 1, 0), (stats['queries'], stats['hedged'], stats['failovers'])
+        )
+        self.assertGreater(stats['latency_p99'], 0.02)
+        self.assertLess(stats['latency_p99'], 5)
+
+        # nxdomain & no answer are answers, they aren't failed over
+        for error in (NXDOMAIN(), NoAnswer()):
+            resolver = self.hedged((0, error), (0, answer))
+            with self.assertRaises(error.__class__):
+                resolver.resolve('unit.tests', 'TXT')
+            self.assertEqual([1, 0], self.calls(resolver))
+            self.assertEqual(0, resolver._failures['10.0.0.0'])
+
+        # once there are enough samples the percentile is used
+        resolver = self.hedged((0, answer), (0, answer), hedge_percentile=90)
+        self.assertEqual(0.02, resolver._hedge_after())
+        resolver._latencies.extend(i / 100 for i in range(20))
+        self.assertEqual(0.18, resolver._hedge_after())
+
+    def test_sync_loop(self):
+        answer = MagicMock()
+        resolver = self.hedged((0, answer), (0, answer))
+        # nothing's started until it's needed
+        self.assertIsNone(resolver._loop)
+
+        # synchronous queries share a single loop, from any thread
+        self.assertEqual(answer, resolver.resolve('unit.tests', 'TXT'))
+        loop = resolver._loop
+        self.assertTrue(loop.is_running())
+        results = []
+        threads = [
+            Thread(
+                target=lambda: results.append(
+                    resolver.resolve('unit.tests', 'TXT')
+                )
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([answer] * 4, results)
+        self.assertIs(loop, resolver._loop)
+
+        # including those that are themselves within a running loop
+        async def within():
+            return resolver.resolve('unit.tests', 'TXT')
+
+        self.assertEqual(answer, run(within()))
+        self.assertIs(loop, resolver._loop)
+
+        # closing stops it, another is started if needed
+        resolver.close()
+        self.assertIsNone(resolver._loop)
+        self.assertTrue(loop.is_closed())
+        resolver.close()
+        self.assertEqual(answer, resolver.resolve('unit.tests', 'TXT'))
+        self.assertIsNot(loop, resolver._loop)
+
+    def test_failover_and_sidelining(self):
+        answer = MagicMock()
+        timeout = LifetimeTimeout(timeout=1.0, errors=[])
+
+        # failures are immediately failed over
+        resolver = self.hedged(
+            (0, timeout), (0, answer), failure_threshold=2, cooldown=60
+        )
+        self.assertEqual(answer, resolver.resolve('unit.tests', 'TXT'))
+        self.assertEqual(1, resolver.stats()['failovers'])
+        self.assertEqual(0, resolver.stats()['sidelined'])
+
+        # enough in a row and the nameserver is sidelined
+        with self.assertLogs('HedgedResolver', level='WARNING'):
+            resolver.resolve('unit.tests', 'TXT')
+        self.assertEqual(1, resolver.stats()['sidelined'])
+        self.assertEqual([2, 2], self.calls(resolver))
+        resolver.resolve('unit.tests', 'TXT')
+        self.assertEqual([2, 3], self.calls(resolver))
+
+        # once its cooldown is over it's tried again
+        resolver._sidelined['10.0.0.0'] = 0
+        resolver.resolve('unit.tests', 'TXT')
+        self.assertEqual([3, 4], self.calls(resolver))
+
+        # when everything fails the last error is raised
+        error = NoNameservers()
+        resolver = self.hedged((0, timeout), (0, error), failure_threshold=1)
+        with self.assertLogs('HedgedResolver', level='WARNING'):
+            with self.assertRaises(NoNameservers):
+                resolver.resolve('unit.tests', 'TXT')
+        self.assertEqual(2, resolver.stats()['sidelined'])
+        # and when everything's sidelined, everything's tried
+        with self.assertLogs('HedgedResolver', level='WARNING'):
+            with self.assertRaises(NoNameservers):
+                resolver.resolve('unit.tests', 'TXT')
+        self.assertEqual([2, 2], self.calls(resolver))
+
+
+class TestFixtureResolver(TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def fixture(self, content, filename='fixture.yaml'):
+        path = join(self.tmpdir.name, filename)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def test_yaml(self):
+        long_value = 'v=spf1 ' + ' '.join(
+            f'ip4:10.0.{i}.0/24' for i in range(30)
+        )
+        resolver = FixtureResolver(
+            self.fixture(f'''---
+_spf.Example.com.:
+  - v=spf1 include:_netblocks.example.com -all
+  - not-spf
+example.com:
+  txt:
+    - v=spf1 mx -all
+  MX:
+    - 10 mx1.example.com.
+    - 20 mx2.example.com.
+  A: []
+long.example.com:
+  - {long_value}
+'''),
+            ttl=300,
+        )
+
+        answer = resolver.resolve('_spf.example.com', 'TXT')
+        self.assertEqual(300, answer.rrset.ttl)
+        self.assertEqual(
+            ['"not-spf"', '"v=spf1 include:_netblocks.example.com -all"'],
+            sorted(rdata.to_text() for rdata in answer),
+        )
+
+        answer = resolver.resolve('example.com.', 'MX')
+        self.assertEqual(
+            ['10 mx1.example.com.', '20 mx2.example.com.'],
+            sorted(rdata.to_text() for rdata in answer),
+        )
+        self.assertEqual(
+            ['"v=spf1 mx -all"'],
+            [
+                rdata.to_text()
+                for rdata in resolver.resolve('EXAMPLE.COM', 'TXT')
+            ],
+        )
+
+        # long values are split into 255 byte strings
+        (rdata,) = resolver.resolve('long.example.com', 'TXT')
+        self.assertEqual(2, len(rdata.strings))
+        self.assertEqual(255, len(rdata.strings[0]))
+        self.assertEqual(long_value.encode(), b''.join(rdata.strings))
+
+        with self.assertRaises(NXDOMAIN):
+            resolver.resolve('missing.example.com', 'TXT')
+        with self.assertRaises(NoAnswer):
+            resolver.resolve('example.com', 'AAAA')
+        with self.assertRaises(NoAnswer):
+            resolver.resolve('example.com', 'A')
+
+        # async works the same
+        answer = run(resolver.resolve_async('example.com', 'TXT'))
+        self.assertEqual(
+            ['"v=spf1 mx -all"'], [rdata.to_text() for rdata in answer]
+        )
+
+    def test_json_and_empty(self):
+        resolver = FixtureResolver(
+            self.fixture(
+                '{"example.com": ["v=spf1 -all"]}', filename='fixture.json'
+            )
+        )
+        self.assertEqual(FixtureResolver.DEFAULT_TTL, resolver.ttl)
+        answer = resolver.resolve('example.com', 'TXT')
+        self.assertEqual(
+            ['"v=spf1 -all"'], [rdata.to_text() for rdata in answer]
+        )
+
+        resolver = FixtureResolver(self.fixture(''))
+        self.assertEqual({}, resolver.records)
@@ -3,6 +3,7 @@
 #
 
 from unittest import TestCase
+from unittest.mock import patch
 
 from octodns.record import Record
 from octodns.zone import Zone
@@ -11,7 +12,9 @@ from octodns_spf import SpfSource
 from octodns_spf.processor import SpfDnsLookupException
 from octodns_spf.source import (
     SpfException,
+    _aggregate_addresses,
     _build_spf,
+    _layout_spf,
     _merge_and_dedup_preserving_order,
     _merge_spf,
     _parse_spf,
@@ -36,10 +39,10 @@ class TestSpfSource(TestCase):
             (['some.thing', 'another.one'], [], [], [], [], [], False),
             _parse_spf('v=spf1 a:some.thing   a:another.one -all'),
         )
-        # not valid, but things don't blow up
-        self.assertEqual(
-            ([''], [], [], [], [], [], False), _parse_spf('v=spf1 a: -all')
-        )
+        # a domain-spec is required after the :
+        with self.assertRaises(SpfException) as ctx:
+            _parse_spf('v=spf1 a: -all')
+        self.assertEqual('Unrecognized SPF mechinism: "a:"', str(ctx.exception))
 
     def test_spf_parse_mx(self):
         self.assertEqual(
@@ -54,9 +57,11 @@ class TestSpfSource(TestCase):
             ([], ['some.thing', 'another.one'], [], [], [], [], False),
             _parse_spf('v=spf1 mx:some.thing   mx:another.one -all'),
         )
-        # not valid, but things don't blow up
+        # a domain-spec is required after the :
+        with self.assertRaises(SpfException) as ctx:
+            _parse_spf('v=spf1 mx: -all')
         self.assertEqual(
-            ([], [''], [], [], [], [], False), _parse_spf('v=spf1 mx: -all')
+            'Unrecognized SPF mechinism: "mx:"', str(ctx.exception)
         )
 
     def test_spf_parse_ip4(self):
@@ -72,9 +77,11 @@ class TestSpfSource(TestCase):
             ([], [], ['1.2.3.4', '5.6.7.8'], [], [], [], False),
             _parse_spf('v=spf1 ip4:1.2.3.4   ip4:5.6.7.8 -all'),
         )
-        # not valid, but things don't blow up
+        # a domain-spec is required after the :
+        with self.assertRaises(SpfException) as ctx:
+            _parse_spf('v=spf1 ip4: -all')
         self.assertEqual(
-            ([], [], [''], [], [], [], False), _parse_spf('v=spf1 ip4: -all')
+            'Unrecognized SPF mechinism: "ip4:"', str(ctx.exception)
         )
         self.assertEqual(
             ([], [], ['not-an-ip'], [], [], [], False),
@@ -94,9 +101,11 @@ class TestSpfSource(TestCase):
             ([], [], [], ['2606::1', '2606::2'], [], [], False),
             _parse_spf('v=spf1 ip6:2606::1   ip6:2606::2 -all'),
         )
-        # not valid, but things don't blow up
+        # a domain-spec is required after the :
+        with self.assertRaises(SpfException) as ctx:
+            _parse_spf('v=spf1 ip6: -all')
         self.assertEqual(
-            ([], [], [], [''], [], [], False), _parse_spf('v=spf1 ip6: -all')
+            'Unrecognized SPF mechinism: "ip6:"', str(ctx.exception)
         )
         self.assertEqual(
             ([], [], [], ['not-an-ip'], [], [], False),
@@ -116,10 +125,11 @@ class TestSpfSource(TestCase):
             ([], [], [], [], ['unit.tests', 'extra.spaces'], [], False),
             _parse_spf('v=spf1 include:unit.tests   include:extra.spaces -all'),
         )
-        # not valid, but things don't blow up
+        # a domain-spec is required after the :
+        with self.assertRaises(SpfException) as ctx:
+            _parse_spf('v=spf1 include: -all')
         self.assertEqual(
-            ([], [], [], [], [''], [], False),
-            _parse_spf('v=spf1 include: -all'),
+            'Unrecognized SPF mechinism: "include:"', str(ctx.exception)
         )
 
     def test_spf_parse_exists(self):
@@ -155,9 +165,11 @@ class TestSpfSource(TestCase):
                 'v=spf1 exists:%{ir}.%{l1r+-}._spf.%{d}    exists:other.thing -all'
             ),
         )
-        # not valid, but things don't blow up
+        # a domain-spec is required after the :
+        with self.assertRaises(SpfException) as ctx:
+            _parse_spf('v=spf1 exists: -all')
         self.assertEqual(
-            ([], [], [], [], [], [''], False), _parse_spf('v=spf1 exists: -all')
+            'Unrecognized SPF mechinism: "exists:"', str(ctx.exception)
         )
 
     def test_spf_parse_soft_fail(self):
@@ -174,9 +186,40 @@ class TestSpfSource(TestCase):
         with self.assertRaises(SpfException) as ctx:
             _parse_spf('v=spf1 unknown:thing -all')
         self.assertEqual(
-            'Unrecognized SPF mechinism: "unknown"', str(ctx.exception)
+            'Unrecognized SPF mechinism: "unknown:thing"', str(ctx.exception)
+        )
+
+    def test_spf_parse_rfc(self):
+        # bare a & mx, the current domain, and cidr lengths
+        self.assertEqual(
+            (['', '/24'], ['', 'mx.unit.tests/24//64'], [], [], [], [], False),
+            _parse_spf('v=spf1 a a/24 mx mx:mx.unit.tests/24//64 -all'),
+        )
+        # domains containing all are domains
+        self.assertEqual(
+            ([], [], [], [], ['small.unit.tests'], [], None),
+            _parse_spf('v=spf1 include:small.unit.tests'),
+        )
+        # explicit passes and modifiers
+        self.assertEqual(
+            ([], ['mx.unit.tests'], [], [], [], [], None),
+            _parse_spf(
+                'v=spf1 +mx:mx.unit.tests redirect=unit.tests exp=exp.unit.tests'
+            ),
         )
 
+        # things that can't be represented
+        for value, term in (
+            ('v=spf1 ptr -all', 'ptr'),
+            ('v=spf1 -ip4:1.2.3.4 ~all', '-ip4:1.2.3.4'),
+            ('v=spf1 ?all', '?all'),
+        ):
+            with self.assertRaises(SpfException) as ctx:
+                _parse_spf(value)
+            self.assertEqual(
+                f'Unsupported SPF term: "{term}"', str(ctx.exception)
+            )
+
     def test_spf_parse_invalid(self):
         with self.assertRaises(SpfException) as ctx:
             _parse_spf('hello world v=spf1 unknown:thing -all')
@@ -204,6 +247,38 @@ class TestSpfSource(TestCase):
             _build_spf(['some.thing', 'another.one'], [], [], [], [], [], None),
         )
 
+    def test_build_spf_bare(self):
+        self.assertEqual(
+            'v=spf1 a a/24 a:some.thing/24 mx mx//64 mx:some.thing',
+            _build_spf(
+                ['', '/24', 'some.thing/24'],
+                ['', '//64', 'some.thing'],
+                [],
+                [],
+                [],
+                [],
+                None,
+            ),
+        )
+
+    def test_build_spf_modifiers(self):
+        self.assertEqual(
+            'v=spf1 mx redirect=unit.tests exp=exp.unit.tests',
+            _build_spf(
+                [],
+                [''],
+                [],
+                [],
+                [],
+                [],
+                None,
+                modifiers=(
+                    ('redirect', 'unit.tests'),
+                    ('exp', 'exp.unit.tests'),
+                ),
+            ),
+        )
+
     def test_build_spf_mxs(self):
         self.assertEqual(
             'v=spf1 mx:some.thing',
@@ -262,6 +337,157 @@ class TestSpfSource(TestCase):
             ),
         )
 
+    def test_aggregate_addresses(self):
+        # adjacent networks collapse, contained ones and dups disappear, host
+        # bits are ignored, and single hosts don't get a prefix
+        self.assertEqual(
+            ['10.0.0.0/23', '10.1.0.0/31', '192.168.1.1'],
+            list(
+                _aggregate_addresses(
+                    [
+                        '192.168.1.1/32',
+                        '10.0.0.0/24',
+                        '10.0.1.0/24',
+                        '10.0.0.5',
+                        '10.0.1.7/24',
+                        '10.1.0.0',
+                        '10.1.0.1',
+                        '192.168.1.1',
+                    ],
+                    4,
+                )
+            ),
+        )
+        self.assertEqual(
+            ['2001:db8::/31', '2606::1'],
+            list(
+                _aggregate_addresses(
+                    ['2606::1/128', '2001:db8::/32', '2001:db9::/32'], 6
+                )
+            ),
+        )
+        self.assertEqual([], list(_aggregate_addresses([], 4)))
+
+        # lots of prefixes
+        self.assertEqual(
+            ['10.0.0.0/20'],
+            list(
+                _aggregate_addresses(
+                    [f'10.0.{i // 256}.{i % 256}' for i in range(4096)], 4
+                )
+            ),
+        )
+
+        for address, version in (
+            ('not-an-ip', 4),
+            ('2606::1', 4),
+            ('1.2.3.4', 6),
+            ('10.0.0.0/33', 4),
+        ):
+            with self.assertRaises(SpfException) as ctx:
+                list(_aggregate_addresses([address], version))
+            self.assertEqual(
+                f'Invalid ip{version} address: "{address}"', str(ctx.exception)
+            )
+
+    def test_build_spf_aggregate_addresses(self):
+        self.assertEqual(
+            'v=spf1 ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip6:2606::1 ip6:2606::1 -all',
+            _build_spf(
+                [],
+                [],
+                ['10.0.0.0/24', '10.0.1.0/24'],
+                ['2606::1', '2606::1'],
+                [],
+                [],
+                False,
+            ),
+        )
+        self.assertEqual(
+            'v=spf1 ip4:10.0.0.0/23 ip6:2606::1 -all',
+            _build_spf(
+                [],
+                [],
+                ['10.0.0.0/24', '10.0.1.0/24'],
+                ['2606::1', '2606::1'],
+                [],
+                [],
+                False,
+                aggregate_addresses=True,
+            ),
+        )
+
+    def test_layout_spf(self):
+        value = (
+            'v=spf1 a:mail.example.com '
+            + ' '.join(f'ip4:10.0.{i}.0/24' for i in range(20))
+            + ' ip6:2001:db8::/32 -all'
+        )
+
+        # fits, nothing to do
+        self.assertEqual(
+            (value, []), _layout_spf(value, 'example.com', len(value))
+        )
+
+        # what doesn't fit spills into a chain of values
+        laid_out, generated = _layout_spf(value, 'example.com', 120)
+        self.assertEqual(
+            'v=spf1 a:mail.example.com ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip4:10.0.2.0/24 ip4:10.0.3.0/24 include:_spf1.example.com -all',
+            laid_out,
+        )
+        self.assertEqual(
+            [
+                (
+                    '_spf1',
+                    'v=spf1 ip4:10.0.4.0/24 ip4:10.0.5.0/24 ip4:10.0.6.0/24 ip4:10.0.7.0/24 ip4:10.0.8.0/24 include:_spf2.example.com',
+                ),
+                (
+                    '_spf2',
+                    'v=spf1 ip4:10.0.9.0/24 ip4:10.0.10.0/24 ip4:10.0.11.0/24 ip4:10.0.12.0/24 ip4:10.0.13.0/24 include:_spf3.example.com',
+                ),
+                (
+                    '_spf3',
+                    'v=spf1 ip4:10.0.14.0/24 ip4:10.0.15.0/24 ip4:10.0.16.0/24 ip4:10.0.17.0/24 ip4:10.0.18.0/24 include:_spf4.example.com',
+                ),
+                ('_spf4', 'v=spf1 ip4:10.0.19.0/24 ip6:2001:db8::/32'),
+            ],
+            generated,
+        )
+        for v in [laid_out] + [v for _, v in generated]:
+            self.assertLessEqual(len(v), 120)
+        # nothing was lost along the way
+        self.assertEqual(
+            sorted(value.split()[1:]),
+            sorted(
+                t
+                for v in [laid_out] + [v for _, v in generated]
+                for t in v.split()[1:]
+                if not t.startswith('include:_spf')
+            ),
+        )
+
+        # unrecognized terms would be lost
+        with self.assertRaises(SpfException) as ctx:
+            _layout_spf(value + ' unknown:thing', 'example.com', 120)
+        self.assertEqual(
+            'Unrecognized SPF mechinism: "unknown:thing"', str(ctx.exception)
+        )
+
+        # only addresses can be moved
+        with self.assertRaises(SpfException) as ctx:
+            _layout_spf(value, 'example.com', 40)
+        self.assertEqual(
+            f'Unable to fit SPF value within 40 bytes: "{value}"',
+            str(ctx.exception),
+        )
+        value = 'v=spf1 ip6:2001:db8:1234:5678::/64 ip6:2001:db8:1234:5679::/64 -all'
+        with self.assertRaises(SpfException) as ctx:
+            _layout_spf(value, 'x.com', 40)
+        self.assertEqual(
+            'Unable to fit "ip6:2001:db8:1234:5678::/64" within 40 bytes',
+            str(ctx.exception),
+        )
+
     def test_merge_and_dedup_preserving_order(self):
         # b is empty
         self.assertEqual(
@@ -340,6 +566,51 @@ class TestSpfSource(TestCase):
             'v=spf1', _merge_spf('v=spf1', [], [], [], [], [], [], None)
         )
 
+        # modifiers are preserved, and with a redirect no all is added since
+        # it'd take precedence
+        self.assertEqual(
+            'v=spf1 a a:another-a.unit.tests redirect=unit.tests',
+            _merge_spf(
+                'v=spf1 a redirect=unit.tests',
+                ['another-a.unit.tests'],
+                [],
+                [],
+                [],
+                [],
+                [],
+                False,
+            ),
+        )
+        self.assertEqual(
+            'v=spf1 a:another-a.unit.tests -all exp=exp.unit.tests',
+            _merge_spf(
+                'v=spf1 exp=exp.unit.tests',
+                ['another-a.unit.tests'],
+                [],
+                [],
+                [],
+                [],
+                [],
+                False,
+            ),
+        )
+
+        # addresses can be aggregated
+        self.assertEqual(
+            'v=spf1 ip4:10.0.0.0/23 ip4:10.0.2.1 -all',
+            _merge_spf(
+                'v=spf1 ip4:10.0.0.0/24 ip4:10.0.2.1 -all',
+                [],
+                [],
+                ['10.0.1.0/24', '10.0.0.5'],
+                [],
+                [],
+                [],
+                False,
+                aggregate_addresses=True,
+            ),
+        )
+
     zone = Zone('unit.tests.', [])
     no_mail = SpfSource('no-mail')
     has_a = SpfSource(
@@ -544,6 +815,127 @@ class TestSpfSource(TestCase):
             spf.values[0],
         )
 
+    def test_aggregate_addresses_source(self):
+        source = SpfSource(
+            'aggregate',
+            ip4_addresses=['10.0.1.0/24', '10.0.0.0/24'],
+            merging_enabled=True,
+            aggregate_addresses=True,
+        )
+        self.assertEqual('v=spf1 ip4:10.0.0.0/23 -all', source.spf_value)
+
+        zone = self.zone.copy()
+        self.has_ip4.populate(zone)
+        source.populate(zone)
+        spf = _find_apex_txt(zone.records)
+        self.assertEqual(
+            'v=spf1 ip4:1.2.3.4 ip4:5.6.7.8 ip4:10.0.0.0/23 -all', spf.values[0]
+        )
+
+        # invalid addresses are an error
+        with self.assertRaises(SpfException) as ctx:
+            SpfSource(
+                'aggregate', ip4_addresses=['10.0.0.'], aggregate_addresses=True
+            )
+        self.assertEqual('Invalid ip4 address: "10.0.0."', str(ctx.exception))
+
+    def test_max_length(self):
+        ip4_addresses = [f'10.0.{i}.0/24' for i in range(20)]
+        source = SpfSource('long', ip4_addresses=ip4_addresses, max_length=200)
+        # fits, nothing is split
+        zone = self.zone.copy()
+        SpfSource('short', max_length=200).populate(zone)
+        self.assertEqual(1, len(zone.records))
+
+        # created
+        zone = self.zone.copy()
+        with self.assertLogs('SpfSource[long]', level='INFO') as logs:
+            source.populate(zone)
+        self.assertIn(
+            'INFO:SpfSource[long]:populate:   value is 341 bytes, split into 2 values',
+            logs.output,
+        )
+        records = {r.name: r for r in zone.records}
+        self.assertEqual(['', '_spf1'], sorted(records))
+        self.assertEqual(
+            'v=spf1 ip4:10.0.0.0/24 ip4:10.0.1.0/24 ip4:10.0.2.0/24 ip4:10.0.3.0/24 ip4:10.0.4.0/24 ip4:10.0.5.0/24 ip4:10.0.6.0/24 ip4:10.0.7.0/24 ip4:10.0.8.0/24 ip4:10.0.9.0/24 include:_spf1.unit.tests -all',
+            records[''].values[0],
+        )
+        self.assertEqual(
+            'v=spf1 ' + ' '.join(f'ip4:10.0.{i}.0/24' for i in range(10, 20)),
+            records['_spf1'].values[0],
+        )
+        self.assertEqual(source.ttl, records['_spf1'].ttl)
+
+        # appended to an existing record
+        zone = self.zone.copy()
+        zone.add_record(
+            Record.new(zone, '', {'type': 'TXT', 'ttl': 42, 'value': 'not-spf'})
+        )
+        source.populate(zone)
+        records = {r.name: r for r in zone.records}
+        self.assertEqual(['', '_spf1'], sorted(records))
+        self.assertIn('include:_spf1.unit.tests', records[''].values[1])
+
+        # merged
+        source = SpfSource(
+            'long',
+            ip4_addresses=ip4_addresses,
+            merging_enabled=True,
+            max_length=200,
+        )
+        zone = self.zone.copy()
+        self.has_a.populate(zone)
+        source.populate(zone)
+        records = {r.name: r for r in zone.records}
+        self.assertTrue(
+            records[''].values[0].startswith('v=spf1 a:a.unit.tests ip4:')
+        )
+        self.assertTrue(records['_spf1'].values[0].startswith('v=spf1 ip4:'))
+
+        # existing TXT records aren't overwritten
+        zone = self.zone.copy()
+        self.has_a.populate(zone)
+        zone.add_record(
+            Record.new(
+                zone, '_spf1', {'type': 'TXT', 'ttl': 42, 'value': 'mine'}
+            )
+        )
+        with self.assertRaises(SpfException) as ctx:
+            source.populate(zone)
+        self.assertEqual(
+            "_spf1.unit.tests. already has a TXT record, it can't hold a generated SPF value",
+            str(ctx.exception),
+        )
+        self.assertEqual(
+            ['mine'], {r.name: r for r in zone.records}['_spf1'].values
+        )
+
+    @patch('dns.resolver.resolve')
+    def test_max_length_verify_dns_lookups(self, resolver_mock):
+        # the generated values count against the limit
+        source = SpfSource(
+            'long',
+            a_records=[f'a_{i}.unit.tests.' for i in range(10)],
+            ip4_addresses=[f'10.0.{i}.0/24' for i in range(20)],
+            max_length=400,
+            verify_dns_lookups=True,
+        )
+        with self.assertRaises(SpfDnsLookupException):
+            source.populate(self.zone.copy())
+        resolver_mock.assert_not_called()
+
+        source = SpfSource(
+            'long',
+            a_records=[f'a_{i}.unit.tests.' for i in range(9)],
+            ip4_addresses=[f'10.0.{i}.0/24' for i in range(20)],
+            max_length=400,
+            verify_dns_lookups=True,
+        )
+        zone = self.zone.copy()
+        source.populate(zone)
+        self.assertEqual(2, len(zone.records))
+
     def test_list_zones(self):
         # hard-coded [] so not much to do here
         self.assertEqual([], self.no_mail.list_zones())
@@ -0,0 +1,117 @@
+#
+#
+#
+
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+
+from octodns_spf.stats import SpfHistogram, SpfStats
+
+
+class TestSpfHistogram(TestCase):
+    def test_observe(self):
+        histogram = SpfHistogram((1, 5, 10))
+        self.assertIsNone(histogram.mean)
+        self.assertIsNone(histogram.max)
+        for value in (0, 1, 2, 5, 7, 100):
+            histogram.observe(value)
+        # values land in the first bucket they're less than or equal to
+        self.assertEqual([2, 2, 1, 1], histogram.counts)
+        self.assertEqual(
+            (6, 115, 100), (histogram.count, histogram.sum, histogram.max)
+        )
+        self.assertAlmostEqual(115 / 6, histogram.mean)
+
+
+class TestSpfStats(TestCase):
+    def test_counters(self):
+        stats = SpfStats()
+        self.assertEqual(set(SpfStats.COUNTERS), set(stats.counters))
+        self.assertEqual(0, sum(stats.counters.values()))
+
+        def work():
+            for _ in range(1000):
+                stats.increment('queries')
+                stats.observe('query_seconds', 0.01)
+
+        threads = [Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4000, stats.counters['queries'])
+        self.assertEqual(4000, stats.histograms['query_seconds'].count)
+
+        stats.increment('cache_hits', 3)
+        self.assertEqual(3, stats.counters['cache_hits'])
+
+    def test_summary(self):
+        stats = SpfStats()
+        self.assertEqual(
+            'queries=0, cache_hits=0, cache_misses=0, coalesced=0, refreshed=0, validated=0, reused=0, skipped=0',
+            stats.summary(),
+        )
+        stats.increment('queries', 2)
+        stats.observe('query_seconds', 0.01)
+        stats.observe('query_seconds', 0.03)
+        stats.observe('record_lookups', 2)
+        stats.observe('record_lookups', 7)
+        self.assertEqual(
+            'queries=2, cache_hits=0, cache_misses=0, coalesced=0, refreshed=0, validated=0, reused=0, skipped=0, query_seconds mean=0.020 max=0.030, record_lookups mean=4.5 max=7',
+            stats.summary(),
+        )
+
+    def test_prometheus(self):
+        stats = SpfStats()
+        stats.increment('queries', 2)
+        stats.observe('query_seconds', 0.003)
+        stats.observe('query_seconds', 0.2)
+        stats.observe('record_lookups', 4)
+
+        text = stats.prometheus()
+        lines = text.split('\n')
+        self.assertEqual('', lines[-1])
+        self.assertEqual(
+            [
+                '# HELP octodns_spf_queries_total DNS queries issued',
+                '# TYPE octodns_spf_queries_total counter',
+                'octodns_spf_queries_total 2',
+            ],
+            lines[:3],
+        )
+        self.assertIn('# TYPE octodns_spf_query_seconds histogram', lines)
+        # buckets are cumulative
+        self.assertIn('octodns_spf_query_seconds_bucket{le="0.005"} 1', lines)
+        self.assertIn('octodns_spf_query_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('octodns_spf_query_seconds_bucket{le="0.25"} 2', lines)
+        self.assertIn('octodns_spf_query_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('octodns_spf_query_seconds_sum 0.203', lines)
+        self.assertIn('octodns_spf_query_seconds_count 2', lines)
+        self.assertIn('octodns_spf_record_lookups_bucket{le="3"} 0', lines)
+        self.assertIn('octodns_spf_record_lookups_bucket{le="4"} 1', lines)
+
+        # labels go on every sample
+        text = stats.prometheus({'processor': 'spf'})
+        self.assertIn('octodns_spf_queries_total{processor="spf"} 2', text)
+        self.assertIn(
+            'octodns_spf_record_lookups_bucket{processor="spf",le="+Inf"} 1',
+            text,
+        )
+        self.assertIn('octodns_spf_record_lookups_sum{processor="spf"} 4', text)
+
+    def test_write_prometheus(self):
+        with TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, 'spf.prom')
+            stats = SpfStats()
+            stats.write_prometheus(path, {'processor': 'spf'})
+            stats.increment('queries')
+            stats.write_prometheus(path, {'processor': 'spf'})
+            with open(path) as fh:
+                self.assertEqual(
+                    stats.prometheus({'processor': 'spf'}), fh.read()
+                )
+            # nothing's left behind
+            self.assertEqual(['spf.prom'], listdir(tmpdir))
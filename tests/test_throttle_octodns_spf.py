@@ -0,0 +1,134 @@
+#
+#
+#
+
+from asyncio import run
+from threading import Thread
+from time import sleep as time_sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from octodns_spf.throttle import SpfThrottle
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+class TestSpfThrottle(TestCase):
+    def setUp(self):
+        SpfThrottle._shared = None
+        self.clock = _Clock()
+        for target, fake in (
+            ('octodns_spf.throttle.monotonic', self.clock.monotonic),
+            ('octodns_spf.throttle.sleep', self.clock.sleep),
+            ('octodns_spf.throttle.asyncio.sleep', self.clock.async_sleep),
+        ):
+            patcher = patch(target, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        SpfThrottle._shared = None
+
+    def test_unlimited(self):
+        throttle = SpfThrottle()
+        for _ in range(100):
+            self.assertEqual(0, throttle.acquire())
+        self.assertEqual(0, run(throttle.acquire_async()))
+        self.assertEqual([], self.clock.slept)
+        self.assertEqual((0, 0), (throttle.waited, throttle.throttled))
+
+    def test_qps(self):
+        throttle = SpfThrottle(qps=2)
+        # a second's worth of burst
+        self.assertEqual(0, throttle.acquire())
+        self.assertEqual(0, throttle.acquire())
+        # then one every half second
+        self.assertEqual(0.5, throttle.acquire())
+        self.assertEqual(0.5, run(throttle.acquire_async()))
+        self.assertEqual([0.5, 0.5], self.clock.slept)
+        self.assertEqual((1.0, 2), (throttle.waited, throttle.throttled))
+
+        # tokens refill while idle, but never beyond the burst
+        self.clock.now += 60
+        for _ in range(2):
+            self.assertEqual(0, throttle.acquire())
+        self.assertEqual(0.5, throttle.acquire())
+
+        # slow rates still allow a single query at a time
+        throttle = SpfThrottle(qps=0.5)
+        self.assertEqual(0, throttle.acquire())
+        self.assertEqual(2, throttle.acquire())
+
+    def test_max_in_flight(self):
+        throttle = SpfThrottle(max_in_flight=1)
+        self.assertEqual(0, throttle.acquire())
+
+        # another thread has to wait until the slot's released
+        results = []
+        thread = Thread(target=lambda: results.append(throttle.acquire()))
+        thread.start()
+        for _ in range(500):
+            if throttle._condition._waiters:
+                break
+            time_sleep(0.01)
+        self.clock.now += 0.25
+        throttle.release()
+        thread.join()
+        self.assertEqual([0.25], results)
+        self.assertEqual(1, throttle.throttled)
+
+        # async callers poll rather than blocking their loop
+        async def release_later():
+            # hold the slot through a couple of polls
+            def release():
+                if len(self.clock.slept) == 2:
+                    throttle.release()
+
+            original = self.clock.sleep
+
+            def sleep(seconds):
+                original(seconds)
+                release()
+
+            self.clock.sleep = sleep
+            return await throttle.acquire_async()
+
+        self.assertAlmostEqual(
+            2 * SpfThrottle.POLL_INTERVAL, run(release_later())
+        )
+        self.assertEqual(1, throttle._in_flight)
+        throttle.release()
+        self.assertEqual(0, throttle._in_flight)
+
+    def test_shared(self):
+        shared = SpfThrottle.shared(qps=10)
+        self.assertIs(shared, SpfThrottle.shared())
+        self.assertEqual((10, None), (shared.qps, shared.max_in_flight))
+
+        # the most restrictive limits win
+        SpfThrottle.shared(qps=20, max_in_flight=8)
+        self.assertEqual((10, 8), (shared.qps, shared.max_in_flight))
+        SpfThrottle.shared(qps=2, max_in_flight=16)
+        self.assertEqual((2, 8), (shared.qps, shared.max_in_flight))
+        self.assertEqual(2, shared._tokens)
+        SpfThrottle.shared(max_in_flight=4)
+        self.assertEqual((2, 4), (shared.qps, shared.max_in_flight))
+
+        SpfThrottle._shared = None
+        shared = SpfThrottle.shared(max_in_flight=4)
+        SpfThrottle.shared(qps=5)
+        self.assertEqual((5, 4), (shared.qps, shared.max_in_flight))
@@ -0,0 +1,110 @@
+#
+#
+#
+
+from json import loads
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+
+from octodns_spf.tracing import BaseSpfSpanSink, JsonLinesSpanSink, SpfTracer
+
+
+class _ListSink(BaseSpfSpanSink):
+    def __init__(self):
+        self.spans = []
+
+    def emit(self, span):
+        self.spans.append(span)
+
+
+class TestSpanSinks(TestCase):
+    def test_base(self):
+        with self.assertRaises(NotImplementedError) as ctx:
+            BaseSpfSpanSink().emit({})
+        self.assertEqual(
+            'BaseSpfSpanSink must implement emit', str(ctx.exception)
+        )
+
+    def test_json_lines(self):
+        with TemporaryDirectory() as tmpdir:
+            path = join(tmpdir, 'spans.jsonl')
+            sink = JsonLinesSpanSink(path)
+
+            def work(n):
+                for i in range(100):
+                    sink.emit({'name': 'include', 'n': n, 'i': i})
+
+            threads = [Thread(target=work, args=(n,)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # lines are written as they're emitted, whole
+            with open(path) as fh:
+                spans = [loads(line) for line in fh]
+            self.assertEqual(400, len(spans))
+            self.assertEqual(
+                list(range(100)), [s['i'] for s in spans if s['n'] == 2]
+            )
+
+            # later sinks append
+            sink.close()
+            sink = JsonLinesSpanSink(path)
+            sink.emit({'name': 'record'})
+            sink.close()
+            with open(path) as fh:
+                self.assertEqual(401, len(fh.readlines()))
+
+
+class TestSpfTracer(TestCase):
+    def test_spans(self):
+        sink = _ListSink()
+        tracer = SpfTracer(sink)
+
+        record = tracer.start('record', 'unit.tests.')
+        include = tracer.start('include', 'a.unit.tests', 1, record)
+        include.attrs['cache'] = 'miss'
+        tracer.finish(include, lookups=2)
+        tracer.finish(record, error='boom')
+
+        first, second = sink.spans
+        self.assertEqual(
+            {
+                'trace_id',
+                'span_id',
+                'parent_id',
+                'name',
+                'domain',
+                'depth',
+                'start',
+                'duration',
+                'lookups',
+                'cache',
+            },
+            set(first),
+        )
+        self.assertEqual(
+            ('include', 'a.unit.tests', 1, 2, 'miss'),
+            (
+                first['name'],
+                first['domain'],
+                first['depth'],
+                first['lookups'],
+                first['cache'],
+            ),
+        )
+        # nested within the record, part of its trace
+        self.assertEqual(record.span_id, first['parent_id'])
+        self.assertEqual(record.trace_id, first['trace_id'])
+        self.assertNotEqual(first['span_id'], second['span_id'])
+        self.assertIsNone(second['parent_id'])
+        self.assertEqual((0, 'boom'), (second['depth'], second['error']))
+        self.assertGreaterEqual(second['duration'], first['duration'])
+        self.assertLessEqual(second['start'], first['start'])
+
+        # every record is a trace of its own
+        other = tracer.start('record', 'other.unit.tests.')
+        self.assertNotEqual(record.trace_id, other.trace_id)